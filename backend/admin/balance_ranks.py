@@ -0,0 +1,73 @@
+'''
+Снимок балансов для сортировки списка пользователей админки.
+user_balances намеренно без индекса на balance (обновления баланса — HOT),
+поэтому порядок по балансу берётся из user_balance_ranks с индексом
+(balance, user_id). Снимок хранит полный баланс с шардами и переписывает
+только изменившиеся строки; время обновления — в cache_versions.
+Список обновляет устаревший снимок сам, на первой странице.
+Запуск: python balance_ranks.py
+'''
+
+import json
+import os
+import time
+from typing import Any, Optional
+
+import db
+
+MAX_AGE = float(os.environ.get('BALANCE_RANKS_MAX_AGE', '300'))
+LOCK_KEY = 'balance_ranks'
+REFRESHED_KEY = 'balance_ranks:refreshed'
+
+REFRESH_SQL = '''
+    INSERT INTO user_balance_ranks AS r (user_id, balance)
+    SELECT user_id, balance FROM account_balances
+    ON CONFLICT (user_id) DO UPDATE SET balance = EXCLUDED.balance
+    WHERE r.balance IS DISTINCT FROM EXCLUDED.balance
+'''
+
+
+def refreshed_at(cur: Any) -> Optional[int]:
+    '''Время последнего обновления снимка (unix-секунды) или None.'''
+    cur.execute('SELECT version FROM cache_versions WHERE key = %s', (REFRESHED_KEY,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def refresh(conn: Any) -> Optional[int]:
+    '''Обновляет снимок и фиксирует; None — его уже обновляет другой вызов.'''
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_try_advisory_xact_lock(hashtext(%s))', (LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return None
+        cur.execute(REFRESH_SQL)
+        changed = cur.rowcount
+        cur.execute('''
+            INSERT INTO cache_versions (key, version) VALUES (%s, %s)
+            ON CONFLICT (key) DO UPDATE SET version = EXCLUDED.version
+        ''', (REFRESHED_KEY, int(time.time())))
+    conn.commit()
+    return changed
+
+
+def refresh_if_stale(conn: Any, max_age: float = MAX_AGE) -> Optional[int]:
+    '''Обновляет снимок старше max_age; возвращает время снимка.'''
+    with conn.cursor() as cur:
+        stamp = refreshed_at(cur)
+    conn.commit()
+    if stamp is None or time.time() - stamp >= max_age:
+        refresh(conn)
+        with conn.cursor() as cur:
+            stamp = refreshed_at(cur)
+        conn.commit()
+    return stamp
+
+
+def main() -> None:
+    with db.connection() as conn:
+        print(json.dumps({'changed': refresh(conn)}))
+
+
+if __name__ == '__main__':
+    main()
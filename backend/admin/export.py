@@ -0,0 +1,147 @@
+'''
+Выгрузка withdrawal_requests, balance_transactions и stock_transactions
+в CSV или NDJSON. Строки читаются серверным (именованным) курсором
+порциями по CHUNK_ROWS и сразу кодируются в выходной поток, поэтому
+память ограничена одной порцией, а не размером таблицы. Порядок —
+(created_at, id); продолжение выгрузки — по курсору "created_at|id".
+Полная выгрузка за месяц без ограничения числа строк:
+    python export.py withdrawals --format csv --from 2024-05-01 --to 2024-06-01 > may.csv
+'''
+
+import csv
+import io
+import sys
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import api
+import db
+
+CHUNK_ROWS = 2000
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson'
+}
+
+# table -> (SELECT без WHERE, алиас основной таблицы, {параметр: колонка для фильтра по равенству})
+EXPORTS: Dict[str, Tuple[str, str, Dict[str, str]]] = {
+    'withdrawals': ('''
+        SELECT wr.id, wr.user_id, u.username, wr.telegram_username, wr.amount, wr.status,
+               wr.admin_comment, wr.processed_by, wr.created_at, wr.processed_at
+        FROM withdrawal_requests wr
+        JOIN users u ON wr.user_id = u.id
+    ''', 'wr', {'status': 'wr.status', 'user_id': 'wr.user_id'}),
+    'balance_transactions': ('''
+        SELECT bt.id, bt.user_id, bt.amount, bt.transaction_type, bt.description, bt.created_at
+        FROM balance_transactions bt
+    ''', 'bt', {'type': 'bt.transaction_type', 'user_id': 'bt.user_id'}),
+    'stock_transactions': ('''
+        SELECT st.id, st.user_id, st.company_id, st.transaction_type, st.shares,
+               st.price_per_share, st.total_amount, st.created_at
+        FROM stock_transactions st
+    ''', 'st', {'type': 'st.transaction_type', 'user_id': 'st.user_id', 'company_id': 'st.company_id'})
+}
+
+
+def build_query(table: str, params: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    '''SQL выгрузки с фильтрами from/to (по created_at), равенствами и курсором; ValueError при ошибке.'''
+    select, alias, equals = EXPORTS[table]
+    conditions = []
+    args: List[Any] = []
+
+    if params.get('from'):
+        conditions.append(f'{alias}.created_at >= %s')
+        args.append(datetime.fromisoformat(params['from']))
+    if params.get('to'):
+        conditions.append(f'{alias}.created_at < %s')
+        args.append(datetime.fromisoformat(params['to']))
+    for param, column in equals.items():
+        if params.get(param):
+            conditions.append(f'{column} = %s')
+            args.append(params[param])
+    if params.get('cursor'):
+        cursor_time, _, cursor_id = params['cursor'].rpartition('|')
+        conditions.append(f'({alias}.created_at, {alias}.id) > (%s, %s)')
+        args.extend([datetime.fromisoformat(cursor_time), int(cursor_id)])
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f'{select} {where} ORDER BY {alias}.created_at, {alias}.id', args
+
+
+def _encode_csv(names: List[str], rows: List[Any], header: bool) -> str:
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    if header:
+        writer.writerow(names)
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def _encode_ndjson(names: List[str], rows: List[Any], header: bool) -> str:
+    return ''.join(api.dumps(dict(zip(names, row))) + '\n' for row in rows)
+
+
+ENCODERS: Dict[str, Callable[[List[str], List[Any], bool], str]] = {
+    'csv': _encode_csv,
+    'ndjson': _encode_ndjson
+}
+
+
+def stream(conn: Any, table: str, params: Dict[str, Any], fmt: str,
+           write: Callable[[str], Any], max_rows: Optional[int] = None) -> Optional[str]:
+    '''
+    Пишет строки выгрузки в write() порциями. Возвращает курсор продолжения,
+    если строк больше max_rows, иначе None.
+    '''
+    sql, args = build_query(table, params)
+    if max_rows is not None:
+        sql += f' LIMIT {int(max_rows) + 1}'
+
+    encode = ENCODERS[fmt]
+    names: List[str] = []
+    written = 0
+    last = None
+    more = False
+    with conn.cursor(name=f'export_{table}') as cur:
+        cur.itersize = CHUNK_ROWS
+        cur.execute(sql, args)
+        while True:
+            rows = cur.fetchmany(CHUNK_ROWS)
+            names = names or [column.name for column in cur.description]
+            more = max_rows is not None and written + len(rows) > max_rows
+            if more:
+                rows = rows[:max_rows - written]
+            if rows or written == 0:
+                write(encode(names, rows, written == 0))
+            if rows:
+                last = rows[-1]
+                written += len(rows)
+            if more or len(rows) < CHUNK_ROWS:
+                break
+
+    if not more or last is None:
+        return None
+    return f"{last[names.index('created_at')].isoformat()}|{last[0]}"
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Export admin tables as CSV or NDJSON')
+    parser.add_argument('table', choices=sorted(EXPORTS))
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--from', dest='from_', help='created_at >= (ISO date)')
+    parser.add_argument('--to', help='created_at < (ISO date)')
+    parser.add_argument('--status')
+    parser.add_argument('--type')
+    parser.add_argument('--user-id')
+    args = parser.parse_args()
+
+    params = {'from': args.from_, 'to': args.to, 'status': args.status, 'type': args.type, 'user_id': args.user_id}
+    with db.connection() as conn:
+        stream(conn, args.table, params, args.format, sys.stdout.write)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,229 +5,441 @@ Args: event - dict с httpMethod, body, queryStringParameters
 Returns: HTTP response dict с данными для администратора
 '''
 
-import json
+import base64
+import gzip
+import io
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+import api
+import balance_ranks
+import db
+import export
+import ledger
+
+USER_COLUMNS = ('id', 'username', 'email', 'telegram_id', 'telegram_username', 'balance',
+                'is_admin', 'created_at', 'last_login')
+# Баланс живёт в user_balances (+ шарды), остальное — в users
+USER_SELECT = {'balance': '''CASE WHEN ub.sharded THEN ub.balance + COALESCE(
+    (SELECT SUM(delta) FROM user_balance_shards s WHERE s.user_id = ub.user_id), 0)
+    ELSE ub.balance END::bigint AS balance'''}
+
+# sort -> (выражение в ORDER BY и индексе, тип значения курсора, id в том же индексе).
+# Баланс сортируется по снимку user_balance_ranks (см. balance_ranks.py)
+USER_SORTS = {
+    'balance': ('r.balance', 'bigint', 'r.user_id'),
+    'created_at': ("COALESCE(u.created_at, '-infinity')", 'timestamp', 'u.id'),
+    'last_login': ("COALESCE(u.last_login, '-infinity')", 'timestamp', 'u.id')
+}
+
+EXPORT_MAX_ROWS = int(os.environ.get('EXPORT_MAX_ROWS', '50000'))
+
+WITHDRAWAL_BATCH_LIMIT = 500
+AUDIT_BATCH_LIMIT = 100
+
+# Решения по заявке: approved списывает сумму с баланса, rejected — только меняет статус
+# (при создании заявки средства не резервируются, поэтому возвращать нечего).
+WITHDRAWAL_DECISIONS = ('approved', 'rejected')
+
+WITHDRAWAL_ERRORS = {
+    'invalid_request': 'Invalid withdrawal id',
+    'invalid_status': 'Invalid status',
+    'already_processed': 'Withdrawal already processed',
+    'insufficient_balance': 'Insufficient balance'
+}
+
+# Заявки блокируются в порядке id, счета — в порядке user_id, поэтому
+# параллельные пакеты не взаимоблокируются. Несколько заявок одного
+# пользователя проверяются нарастающим итогом против его баланса; счета
+# остаются заблокированными до списания через ledger.post в той же транзакции.
+PROCESS_WITHDRAWALS_SQL = '''
+    WITH input (withdrawal_id, status, comment, admin_id) AS (
+        VALUES %s
+    ),
+    requests AS (
+        SELECT wr.id, wr.user_id, wr.amount, i.status, i.comment, i.admin_id
+        FROM withdrawal_requests wr
+        JOIN input i ON i.withdrawal_id = wr.id
+        WHERE wr.status = 'pending'
+        ORDER BY wr.id
+        FOR UPDATE OF wr
+    ),
+    accounts AS (
+        SELECT b.user_id AS id, b.balance + COALESCE(
+            (SELECT SUM(delta) FROM user_balance_shards s WHERE s.user_id = b.user_id), 0) AS balance
+        FROM user_balances b
+        WHERE b.user_id IN (SELECT user_id FROM requests WHERE status = 'approved')
+        ORDER BY b.user_id
+        FOR UPDATE OF b
+    ),
+    decided AS (
+        SELECT r.*, COALESCE(
+            r.status = 'rejected'
+            OR SUM(CASE WHEN r.status = 'approved' THEN r.amount ELSE 0 END)
+                   OVER (PARTITION BY r.user_id ORDER BY r.id) <= a.balance,
+            FALSE
+        ) AS accepted
+        FROM requests r
+        LEFT JOIN accounts a ON a.id = r.user_id
+    ),
+    updated AS (
+        UPDATE withdrawal_requests wr
+        SET status = d.status, admin_comment = d.comment, processed_by = d.admin_id,
+            processed_at = CURRENT_TIMESTAMP
+        FROM decided d
+        WHERE wr.id = d.id AND d.accepted
+        RETURNING wr.id
+    )
+    SELECT i.withdrawal_id,
+           CASE
+               WHEN d.accepted THEN d.status
+               WHEN d.id IS NOT NULL THEN 'insufficient_balance'
+               WHEN wr.id IS NOT NULL THEN 'already_processed'
+               ELSE 'not_found'
+           END AS outcome,
+           d.user_id, d.amount
+    FROM input i
+    LEFT JOIN decided d ON d.id = i.withdrawal_id
+    LEFT JOIN withdrawal_requests wr ON wr.id = i.withdrawal_id
+'''
+PROCESS_WITHDRAWALS_TEMPLATE = '(%s::int, %s::varchar, %s::text, %s::int)'
+
+STAT_METRICS = ('total_users', 'total_balance', 'total_transactions', 'pending_withdrawals')
+
+router = api.Router('GET, POST, PUT, OPTIONS', 'Content-Type, X-User-Id, X-Admin-Token',
+                    default_actions={'GET': 'stats'})
+
+ACCESS_DENIED = api.error(403, 'Access denied')
+
+
+def admin_id(request: api.Request) -> Any:
+    return request.query.get('admin_id') or request.body.get('admin_id')
+
+
+def require_admin(request: api.Request) -> Optional[Dict[str, Any]]:
+    with request.conn.cursor() as cur:
+        cur.execute('SELECT is_admin FROM users WHERE id = %s', (admin_id(request),))
+        admin_check = cur.fetchone()
+
+    if not admin_check or not admin_check[0]:
+        return ACCESS_DENIED
+    return None
+
+
+router.guard = require_admin
+
+
+@router.route('GET', 'stats')
+def stats(request: api.Request) -> Dict[str, Any]:
+    with request.conn.cursor() as cur:
+        cur.execute('SELECT metric, SUM(value) AS value FROM platform_stats GROUP BY metric')
+        counters = dict(cur.fetchall())
+
+    return api.ok(stats={metric: counters.get(metric) or 0 for metric in STAT_METRICS})
+
+
+@router.route('GET', 'withdrawals')
+def withdrawals(request: api.Request) -> Dict[str, Any]:
+    params = request.query
+    conditions = []
+    args = []
+
+    try:
+        limit = min(max(int(params.get('limit', 200)), 1), 1000)
+
+        if params.get('status'):
+            conditions.append('wr.status = %s')
+            args.append(params['status'])
+        if params.get('from'):
+            conditions.append('wr.created_at >= %s')
+            args.append(datetime.fromisoformat(params['from']))
+        if params.get('to'):
+            conditions.append('wr.created_at < %s')
+            args.append(datetime.fromisoformat(params['to']))
+        if params.get('cursor'):
+            cursor_time, _, cursor_id = params['cursor'].rpartition('|')
+            conditions.append('(wr.created_at, wr.id) < (%s, %s)')
+            args.extend([datetime.fromisoformat(cursor_time), int(cursor_id)])
+    except ValueError:
+        return api.error(400, 'Invalid list parameters')
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    with request.conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT wr.*, u.username, COALESCE(b.balance, 0) AS balance
+            FROM withdrawal_requests wr
+            JOIN users u ON wr.user_id = u.id
+            LEFT JOIN account_balances b ON b.user_id = u.id
+            {where}
+            ORDER BY wr.created_at DESC, wr.id DESC
+            LIMIT %s
+        ''', (*args, limit + 1))
+        rows = cur.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            names = [column.name for column in cur.description]
+            next_cursor = f"{rows[-1][names.index('created_at')].isoformat()}|{rows[-1][0]}"
+
+        return api.ok(withdrawals=api.rows_json(cur, rows), next_cursor=next_cursor)
+
+
+@router.route('GET', 'export')
+def export_rows(request: api.Request) -> Dict[str, Any]:
+    params = request.query
+    table = params.get('table', 'withdrawals')
+    fmt = params.get('format', 'csv')
+
+    if table not in export.EXPORTS or fmt not in export.FORMATS:
+        return api.error(400, 'Invalid export parameters')
+
+    compress = 'gzip' in request.headers.get('accept-encoding', '')
+    buffer = io.BytesIO()
+    sink = gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=5) if compress else buffer
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Admin-Token',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    
     try:
-        admin_id = event.get('queryStringParameters', {}).get('admin_id') or \
-                   json.loads(event.get('body', '{}')).get('admin_id')
-        
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute('SELECT is_admin FROM users WHERE id = %s', (admin_id,))
-            admin_check = cur.fetchone()
-            
-            if not admin_check or not admin_check.get('is_admin'):
-                return {
-                    'statusCode': 403,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({'success': False, 'error': 'Access denied'}),
-                    'isBase64Encoded': False
-                }
-        
-        if method == 'GET':
-            action = event.get('queryStringParameters', {}).get('action', 'stats')
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if action == 'stats':
-                    cur.execute('SELECT COUNT(*) as total_users FROM users')
-                    users_count = cur.fetchone()
-                    
-                    cur.execute('SELECT SUM(balance) as total_balance FROM users')
-                    total_balance = cur.fetchone()
-                    
-                    cur.execute('SELECT COUNT(*) as total_transactions FROM balance_transactions')
-                    transactions_count = cur.fetchone()
-                    
-                    cur.execute('SELECT COUNT(*) as pending_withdrawals FROM withdrawal_requests WHERE status = %s', ('pending',))
-                    pending = cur.fetchone()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'stats': {
-                                'total_users': users_count['total_users'],
-                                'total_balance': total_balance['total_balance'] or 0,
-                                'total_transactions': transactions_count['total_transactions'],
-                                'pending_withdrawals': pending['pending_withdrawals']
-                            }
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
-                
-                elif action == 'withdrawals':
-                    cur.execute('''
-                        SELECT wr.*, u.username, u.balance
-                        FROM withdrawal_requests wr
-                        JOIN users u ON wr.user_id = u.id
-                        ORDER BY wr.created_at DESC
-                    ''')
-                    withdrawals = cur.fetchall()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'withdrawals': [dict(w) for w in withdrawals]
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
-                
-                elif action == 'users':
-                    cur.execute('''
-                        SELECT id, username, email, telegram_username, balance, is_admin, created_at, last_login
-                        FROM users
-                        ORDER BY balance DESC
-                        LIMIT 100
-                    ''')
-                    users = cur.fetchall()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'users': [dict(u) for u in users]
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
-        
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if action == 'add_balance':
-                    user_id = body_data.get('user_id')
-                    amount = body_data.get('amount')
-                    reason = body_data.get('reason', 'Admin adjustment')
-                    
-                    cur.execute('UPDATE users SET balance = balance + %s WHERE id = %s', (amount, user_id))
-                    
-                    cur.execute('''
-                        INSERT INTO balance_transactions (user_id, amount, transaction_type, description)
-                        VALUES (%s, %s, 'admin_adjustment', %s)
-                    ''', (user_id, amount, reason))
-                    
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'message': 'Balance updated'
-                        }),
-                        'isBase64Encoded': False
-                    }
-                
-                elif action == 'add_task':
-                    title = body_data.get('title')
-                    description = body_data.get('description')
-                    reward = body_data.get('reward')
-                    task_type = body_data.get('task_type', 'manual')
-                    
-                    cur.execute('''
-                        INSERT INTO tasks (title, description, task_type, reward, icon)
-                        VALUES (%s, %s, %s, %s, 'Star')
-                        RETURNING id
-                    ''', (title, description, task_type, reward))
-                    
-                    task = cur.fetchone()
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'task_id': task['id']
-                        }),
-                        'isBase64Encoded': False
-                    }
-        
-        elif method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if action == 'process_withdrawal':
-                    withdrawal_id = body_data.get('withdrawal_id')
-                    status = body_data.get('status')
-                    comment = body_data.get('comment', '')
-                    
-                    cur.execute('''
-                        UPDATE withdrawal_requests
-                        SET status = %s, admin_comment = %s, processed_by = %s, processed_at = CURRENT_TIMESTAMP
-                        WHERE id = %s
-                    ''', (status, comment, admin_id, withdrawal_id))
-                    
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'message': 'Withdrawal processed'
-                        }),
-                        'isBase64Encoded': False
-                    }
-        
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'success': False, 'error': 'Invalid request'}),
-            'isBase64Encoded': False
-        }
-    
-    finally:
-        conn.close()
\ No newline at end of file
+        next_cursor = export.stream(request.conn, table, params, fmt,
+                                    lambda chunk: sink.write(chunk.encode('utf-8')), EXPORT_MAX_ROWS)
+    except ValueError:
+        return api.error(400, 'Invalid export parameters')
+    if compress:
+        sink.close()
+
+    headers = {
+        'Content-Type': export.FORMATS[fmt],
+        'Content-Disposition': f'attachment; filename="{table}.{fmt}"',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'X-Next-Cursor, Content-Disposition'
+    }
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    if next_cursor:
+        headers['X-Next-Cursor'] = next_cursor
+
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': base64.b64encode(buffer.getvalue()).decode('ascii') if compress else buffer.getvalue().decode('utf-8'),
+        'isBase64Encoded': compress
+    }
+
+
+def like_prefix(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def parse_sort_value(sort: str, value: str) -> Any:
+    if sort == 'balance':
+        return int(value)
+    return value if value == '-infinity' else datetime.fromisoformat(value)
+
+
+def estimate_count(cur: Any, where: str, args: List[Any]) -> int:
+    '''Оценка числа строк по статистике планировщика вместо COUNT(*).'''
+    cur.execute(f'EXPLAIN (FORMAT JSON) SELECT 1 FROM users u {where}', args)
+    plan = cur.fetchone()[0]
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+@router.route('GET', 'users')
+def users(request: api.Request) -> Dict[str, Any]:
+    params = request.query
+    sort = params.get('sort', 'balance')
+    order = params.get('order', 'desc')
+    conditions = []
+    args = []
+
+    if sort not in USER_SORTS or order not in ('asc', 'desc'):
+        return api.error(400, 'Invalid list parameters')
+    sort_expr, sort_type, id_expr = USER_SORTS[sort]
+
+    try:
+        limit = min(max(int(params.get('limit', 100)), 1), 200)
+
+        if params.get('q'):
+            prefix = like_prefix(params['q'].strip().lower())
+            conditions.append('(lower(u.username) LIKE %s OR u.telegram_id LIKE %s)')
+            args.extend([prefix, prefix])
+        if params.get('cursor'):
+            cursor_value, _, cursor_id = params['cursor'].rpartition(':')
+            conditions.append(f"({sort_expr}, {id_expr}) {'<' if order == 'desc' else '>'} (%s::{sort_type}, %s)")
+            args.extend([parse_sort_value(sort, cursor_value), int(cursor_id)])
+    except ValueError:
+        return api.error(400, 'Invalid list parameters')
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    # Первая страница обновляет устаревший снимок; листание идёт по тому же
+    sorted_at = None
+    if sort == 'balance' and not params.get('cursor'):
+        sorted_at = balance_ranks.refresh_if_stale(request.conn)
+
+    with request.conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT {', '.join(USER_SELECT.get(column, 'u.' + column) for column in USER_COLUMNS)},
+                   {sort_expr} AS sort_key
+            FROM users u
+            JOIN user_balances ub ON ub.user_id = u.id
+            JOIN user_balance_ranks r ON r.user_id = u.id
+            {where}
+            ORDER BY {sort_expr} {order}, {id_expr} {order}
+            LIMIT %s
+        ''', (*args, limit + 1))
+        rows = cur.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            # Курсор — ключ сортировки, а не показанный баланс с шардами
+            last = rows[-1][-1]
+            next_cursor = f'{last if sort == "balance" else last.isoformat()}:{rows[-1][0]}'
+
+        users = [dict(zip(USER_COLUMNS, row)) for row in rows]
+        payload = {'users': api.rows_json(cur, users), 'next_cursor': next_cursor}
+        if not params.get('cursor'):
+            payload['total_estimate'] = estimate_count(cur, where, args)
+        if sorted_at is not None:
+            payload['sorted_at'] = sorted_at
+
+    return api.ok(**payload)
+
+
+@router.route('GET', 'audit')
+def audit(request: api.Request) -> Dict[str, Any]:
+    try:
+        user_ids = [int(v) for v in (request.query.get('user_id') or '').split(',') if v]
+    except ValueError:
+        return api.error(400, 'Invalid user_id')
+
+    if not user_ids or len(user_ids) > AUDIT_BATCH_LIMIT:
+        return api.error(400, f'Provide 1 to {AUDIT_BATCH_LIMIT} user ids')
+
+    with request.conn.cursor() as cur:
+        return api.ok(audit=ledger.audit(cur, user_ids))
+
+
+@router.route('POST', 'add_balance')
+def add_balance(request: api.Request) -> Dict[str, Any]:
+    user_id = request.body.get('user_id')
+    amount = request.body.get('amount')
+    reason = request.body.get('reason', 'Admin adjustment')
+
+    conn = request.conn
+    with conn.cursor() as cur:
+        try:
+            balances = ledger.post(cur, [(user_id, amount, 'admin_adjustment', reason)], allow_overdraft=True)
+        except ledger.UnknownAccount:
+            return api.error(404, 'User not found')
+
+        conn.commit()
+
+    return api.ok(message='Balance updated', new_balance=next(iter(balances.values())))
+
+
+@router.route('POST', 'balance_mode')
+def balance_mode(request: api.Request) -> Dict[str, Any]:
+    user_id = request.body.get('user_id')
+    sharded = request.body.get('sharded')
+
+    if not isinstance(sharded, bool):
+        return api.error(400, 'sharded must be true or false')
+
+    conn = request.conn
+    with conn.cursor() as cur:
+        balance = ledger.set_sharded(cur, user_id, sharded)
+        if balance is None:
+            return api.error(404, 'User not found')
+        conn.commit()
+
+    return api.ok(user_id=user_id, sharded=sharded, balance=balance)
+
+
+@router.route('POST', 'add_task')
+def add_task(request: api.Request) -> Dict[str, Any]:
+    title = request.body.get('title')
+    description = request.body.get('description')
+    reward = request.body.get('reward')
+    task_type = request.body.get('task_type', 'manual')
+
+    conn = request.conn
+    with conn.cursor() as cur:
+        cur.execute('''
+            INSERT INTO tasks (title, description, task_type, reward, icon)
+            VALUES (%s, %s, %s, %s, 'Star')
+            RETURNING id
+        ''', (title, description, task_type, reward))
+
+        task = cur.fetchone()
+        conn.commit()
+
+    return api.ok(task_id=task[0])
+
+
+def parse_decision(item: Dict[str, Any]) -> Tuple[Optional[int], Optional[str]]:
+    '''(withdrawal_id, None) для корректного решения, иначе (id или None, код ошибки).'''
+    try:
+        withdrawal_id = int(item.get('withdrawal_id'))
+    except (TypeError, ValueError):
+        return None, 'invalid_request'
+    if item.get('status') not in WITHDRAWAL_DECISIONS:
+        return withdrawal_id, 'invalid_status'
+    return withdrawal_id, None
+
+
+def process_withdrawals(request: api.Request, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    '''Применяет решения по заявкам одним запросом; возвращает исход по каждой заявке в порядке входа.'''
+    decisions = [parse_decision(item) for item in items]
+    values = {
+        withdrawal_id: (withdrawal_id, item['status'], item.get('comment', ''), admin_id(request))
+        for item, (withdrawal_id, problem) in zip(items, decisions)
+        if problem is None
+    }
+
+    outcomes: Dict[int, str] = {}
+    if values:
+        conn = request.conn
+        with conn.cursor() as cur:
+            rows = db.execute_values(cur, PROCESS_WITHDRAWALS_SQL, list(values.values()),
+                                     template=PROCESS_WITHDRAWALS_TEMPLATE, page_size=len(values), fetch=True)
+            ledger.post(cur, [
+                (user_id, -amount, 'withdrawal', f'Вывод средств, заявка #{withdrawal_id}')
+                for withdrawal_id, outcome, user_id, amount in rows
+                if outcome == 'approved'
+            ], allow_overdraft=True)
+        conn.commit()
+        outcomes = {row[0]: row[1] for row in rows}
+
+    return [
+        {'withdrawal_id': item.get('withdrawal_id'), 'outcome': problem or outcomes[withdrawal_id]}
+        for item, (withdrawal_id, problem) in zip(items, decisions)
+    ]
+
+
+@router.route('PUT', 'process_withdrawal')
+def process_withdrawal(request: api.Request) -> Dict[str, Any]:
+    outcome = process_withdrawals(request, [request.body])[0]['outcome']
+
+    if outcome in WITHDRAWAL_DECISIONS:
+        return api.ok(message='Withdrawal processed', status=outcome)
+    if outcome == 'not_found':
+        return api.error(404, 'Withdrawal not found')
+    return api.error(400, WITHDRAWAL_ERRORS[outcome])
+
+
+@router.route('PUT', 'process_withdrawals')
+def process_withdrawals_batch(request: api.Request) -> Dict[str, Any]:
+    items = request.body.get('items') or []
+
+    if not isinstance(items, list) or len(items) > WITHDRAWAL_BATCH_LIMIT:
+        return api.error(400, f'Provide up to {WITHDRAWAL_BATCH_LIMIT} items')
+
+    results = process_withdrawals(request, [item if isinstance(item, dict) else {} for item in items])
+    processed = len({str(result['withdrawal_id']) for result in results if result['outcome'] in WITHDRAWAL_DECISIONS})
+    return api.ok(processed=processed, results=results)
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return router.dispatch(event)
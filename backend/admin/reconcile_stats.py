@@ -0,0 +1,65 @@
+'''
+Сверка счётчиков platform_stats с точными значениями.
+Точные значения и сумма шардов читаются в одном снимке REPEATABLE READ,
+поэтому расхождение не искажается параллельной записью; с --fix оно
+добавляется к счётчикам как поправка.
+Запуск: python reconcile_stats.py [--fix]
+'''
+
+import argparse
+import json
+from typing import Any, Dict
+
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+import db
+
+EXACT_SQL = '''
+    SELECT 'total_users' AS metric, COUNT(*) AS value FROM users
+    UNION ALL SELECT 'total_balance', COALESCE(SUM(balance), 0) FROM account_balances
+    UNION ALL SELECT 'total_transactions', COUNT(*) FROM balance_transactions
+    UNION ALL SELECT 'pending_withdrawals', COUNT(*) FROM withdrawal_requests WHERE status = 'pending'
+'''
+
+
+def reconcile(conn: Any, fix: bool = False) -> Dict[str, Dict[str, int]]:
+    conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ)
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(EXACT_SQL)
+            exact = {row['metric']: int(row['value']) for row in cur.fetchall()}
+            cur.execute('SELECT metric, SUM(value) AS value FROM platform_stats GROUP BY metric')
+            counted = {row['metric']: int(row['value']) for row in cur.fetchall()}
+        conn.commit()
+    finally:
+        conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_DEFAULT)
+
+    report = {
+        metric: {'exact': value, 'counter': counted.get(metric, 0), 'drift': value - counted.get(metric, 0)}
+        for metric, value in exact.items()
+    }
+
+    if fix:
+        with conn.cursor() as cur:
+            for metric, row in report.items():
+                if row['drift']:
+                    cur.execute('SELECT bump_platform_stat(%s, %s)', (metric, row['drift']))
+        conn.commit()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Reconcile platform_stats counters')
+    parser.add_argument('--fix', action='store_true', help='apply drift as a correction')
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        report = reconcile(conn, args.fix)
+    print(json.dumps(report, indent=2))
+    if any(row['drift'] for row in report.values()) and not args.fix:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
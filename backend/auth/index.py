@@ -1,8 +1,116 @@
-import json
 import os
-import psycopg2
-from datetime import datetime
-from typing import Dict, Any
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+import api
+
+router = api.Router('GET, POST, OPTIONS', default_actions={'POST': 'register'},
+                    not_found=api.respond(405, {'error': 'Method not allowed'}))
+
+USER_NOT_FOUND = api.respond(404, {'error': 'User not found'})
+
+# last_login пишется не чаще раза в LAST_LOGIN_RESOLUTION_MINUTES: повторные
+# входы не создают новую версию строки users
+LAST_LOGIN_RESOLUTION = timedelta(minutes=int(os.environ.get('LAST_LOGIN_RESOLUTION_MINUTES', '15')))
+
+USER_SELECT = '''
+    SELECT u.id, u.username, u.telegram_id, u.email, COALESCE(b.balance, 0), u.role, u.created_at
+    FROM users u
+    LEFT JOIN account_balances b ON b.user_id = u.id
+'''
+
+
+def user_payload(user: Any) -> Dict[str, Any]:
+    return {
+        'id': user[0],
+        'username': user[1],
+        'telegram_id': user[2],
+        'email': user[3],
+        'balance': user[4],
+        'role': user[5],
+        'created_at': user[6].isoformat()
+    }
+
+
+@router.route('POST', 'register')
+def register(request: api.Request) -> Dict[str, Any]:
+    username = request.body.get('username')
+    telegram_id = request.body.get('telegram_id')
+    email = request.body.get('email')
+
+    if not username:
+        return api.respond(400, {'error': 'Username is required'})
+
+    conn = request.conn
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT id FROM users WHERE username = %s OR telegram_id = %s",
+            (username, telegram_id)
+        )
+        existing = cur.fetchone()
+
+        if existing:
+            return api.respond(400, {'error': 'User already exists'})
+
+        cur.execute(
+            """INSERT INTO users (username, telegram_id, email, role, created_at, last_login)
+               VALUES (%s, %s, %s, 'user', %s, %s)
+               RETURNING id, username, telegram_id, email, 0, role, created_at""",
+            (username, telegram_id, email, datetime.now(), datetime.now())
+        )
+        user = cur.fetchone()
+        conn.commit()
+
+    return api.respond(201, user_payload(user))
+
+
+@router.route('POST', 'login')
+def login(request: api.Request) -> Dict[str, Any]:
+    username = request.body.get('username')
+
+    conn = request.conn
+    with conn.cursor() as cur:
+        cur.execute(USER_SELECT + 'WHERE u.username = %s', (username,))
+        user = cur.fetchone()
+
+        if not user:
+            return USER_NOT_FOUND
+
+        now = datetime.now()
+        cur.execute(
+            "UPDATE users SET last_login = %s WHERE id = %s AND (last_login IS NULL OR last_login < %s)",
+            (now, user[0], now - LAST_LOGIN_RESOLUTION)
+        )
+        conn.commit()
+
+    return api.respond(200, user_payload(user))
+
+
+@router.route('GET')
+def get_user(request: api.Request) -> Dict[str, Any]:
+    user_id = request.query.get('user_id')
+
+    if not user_id:
+        return router.not_found
+
+    with request.conn.cursor() as cur:
+        cur.execute(USER_SELECT + 'WHERE u.id = %s', (user_id,))
+        user = cur.fetchone()
+
+    if not user:
+        return USER_NOT_FOUND
+
+    return api.respond(200, user_payload(user))
+
+
+def require_database(request: api.Request) -> Optional[Dict[str, Any]]:
+    if not os.environ.get('DATABASE_URL'):
+        return api.respond(500, {'error': 'Database not configured'})
+    return None
+
+
+router.guard = require_database
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
@@ -11,159 +119,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
           context - object с request_id
     Returns: HTTP response с данными пользователя или ошибкой
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': ''
-        }
-    
-    database_url = os.environ.get('DATABASE_URL')
-    if not database_url:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Database not configured'})
-        }
-    
-    conn = psycopg2.connect(database_url)
-    cur = conn.cursor()
-    
-    try:
-        if method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action', 'register')
-            
-            if action == 'register':
-                username = body_data.get('username')
-                telegram_id = body_data.get('telegram_id')
-                email = body_data.get('email')
-                
-                if not username:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Username is required'})
-                    }
-                
-                cur.execute(
-                    "SELECT id FROM users WHERE username = %s OR telegram_id = %s",
-                    (username, telegram_id)
-                )
-                existing = cur.fetchone()
-                
-                if existing:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'User already exists'})
-                    }
-                
-                cur.execute(
-                    """INSERT INTO users (username, telegram_id, email, balance, role, created_at, last_login) 
-                       VALUES (%s, %s, %s, 0, 'user', %s, %s) 
-                       RETURNING id, username, telegram_id, email, balance, role, created_at""",
-                    (username, telegram_id, email, datetime.now(), datetime.now())
-                )
-                user = cur.fetchone()
-                conn.commit()
-                
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'id': user[0],
-                        'username': user[1],
-                        'telegram_id': user[2],
-                        'email': user[3],
-                        'balance': user[4],
-                        'role': user[5],
-                        'created_at': user[6].isoformat()
-                    })
-                }
-            
-            elif action == 'login':
-                username = body_data.get('username')
-                
-                cur.execute(
-                    """SELECT id, username, telegram_id, email, balance, role, created_at 
-                       FROM users WHERE username = %s""",
-                    (username,)
-                )
-                user = cur.fetchone()
-                
-                if not user:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'User not found'})
-                    }
-                
-                cur.execute(
-                    "UPDATE users SET last_login = %s WHERE id = %s",
-                    (datetime.now(), user[0])
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'id': user[0],
-                        'username': user[1],
-                        'telegram_id': user[2],
-                        'email': user[3],
-                        'balance': user[4],
-                        'role': user[5],
-                        'created_at': user[6].isoformat()
-                    })
-                }
-        
-        elif method == 'GET':
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            
-            if user_id:
-                cur.execute(
-                    """SELECT id, username, telegram_id, email, balance, role, created_at 
-                       FROM users WHERE id = %s""",
-                    (user_id,)
-                )
-                user = cur.fetchone()
-                
-                if not user:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'User not found'})
-                    }
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'id': user[0],
-                        'username': user[1],
-                        'telegram_id': user[2],
-                        'email': user[3],
-                        'balance': user[4],
-                        'role': user[5],
-                        'created_at': user[6].isoformat()
-                    })
-                }
-        
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'})
-        }
-    
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    return router.dispatch(event)
@@ -0,0 +1,182 @@
+'''
+HTTP-слой функций: таблица маршрутов (method, action) → функция,
+ответы с заранее собранными заголовками и быстрая сериализация JSON
+(orjson, если установлен). Строки из курсора сериализуются по метаданным
+колонок: datetime и numeric кодируются по OID типа, без default=str
+на каждое значение. Файл одинаков во всех функциях backend/.
+'''
+
+import json
+from datetime import date, datetime, time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import db
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_HEADERS = {
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+}
+
+DATE_OIDS = frozenset([1082, 1083, 1114, 1184])
+NUMERIC_OIDS = frozenset([1700])
+
+Handler = Callable[['Request'], Dict[str, Any]]
+
+
+class Raw(str):
+    '''Готовый JSON-фрагмент: вставляется в тело ответа как есть.'''
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return str(value)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def _dumps(value: Any) -> str:
+        return orjson.dumps(value, default=_default, option=_ORJSON_OPTIONS).decode('utf-8')
+else:
+    def _dumps(value: Any) -> str:
+        return json.dumps(value, default=_default, separators=(',', ':'), ensure_ascii=False)
+
+
+def dumps(value: Any) -> str:
+    if isinstance(value, Raw):
+        return value
+    if isinstance(value, dict) and any(isinstance(v, (Raw, dict)) for v in value.values()):
+        return '{' + ','.join(_dumps(str(k)) + ':' + dumps(v) for k, v in value.items()) + '}'
+    return _dumps(value)
+
+
+def _converter(type_code: int) -> Optional[Callable[[Any], Any]]:
+    if type_code in DATE_OIDS:
+        return _default
+    if type_code in NUMERIC_OIDS:
+        return str
+    return None
+
+
+def rows_json(cur: Any, rows: Optional[Sequence[Any]] = None) -> Raw:
+    '''Сериализует строки курсора (кортежи или dict) в JSON-массив объектов.'''
+    rows = cur.fetchall() if rows is None else rows
+    if not rows:
+        return Raw('[]')
+    if isinstance(rows[0], dict):
+        return Raw(_dumps([dict(row) for row in rows]))
+
+    names = [column.name for column in cur.description]
+    if orjson is None:
+        converters = [(i, c) for i, c in enumerate(_converter(col.type_code) for col in cur.description) if c]
+        if converters:
+            converted = []
+            for row in rows:
+                row = list(row)
+                for i, convert in converters:
+                    if row[i] is not None:
+                        row[i] = convert(row[i])
+                converted.append(row)
+            rows = converted
+    return Raw(_dumps([dict(zip(names, row)) for row in rows]))
+
+
+def respond(status: int, payload: Any = None, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        'statusCode': status,
+        'headers': headers or JSON_HEADERS,
+        'body': '' if payload is None else dumps(payload),
+        'isBase64Encoded': False
+    }
+
+
+def ok(**payload: Any) -> Dict[str, Any]:
+    return respond(200, {'success': True, **payload})
+
+
+def error(status: int, message: str, **extra: Any) -> Dict[str, Any]:
+    return respond(status, {'success': False, **extra, 'error': message})
+
+
+class Request:
+    def __init__(self, event: Dict[str, Any]):
+        self.event = event
+        self.method: str = event.get('httpMethod', 'GET')
+        self.query: Dict[str, Any] = event.get('queryStringParameters') or {}
+        self._body: Optional[Dict[str, Any]] = None
+        self._headers: Optional[Dict[str, str]] = None
+        self._conn: Any = None
+
+    @property
+    def body(self) -> Dict[str, Any]:
+        if self._body is None:
+            self._body = json.loads(self.event.get('body') or '{}')
+        return self._body
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        if self._headers is None:
+            self._headers = {k.lower(): v for k, v in (self.event.get('headers') or {}).items()}
+        return self._headers
+
+    @property
+    def conn(self) -> Any:
+        '''Соединение из пула, берётся при первом обращении и возвращается после ответа.'''
+        if self._conn is None:
+            self._conn = db.checkout()
+        return self._conn
+
+    def release(self) -> None:
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            db.release(conn)
+
+
+class Router:
+    def __init__(self, methods: str, allow_headers: str = 'Content-Type, X-User-Id',
+                 default_actions: Optional[Dict[str, Optional[str]]] = None,
+                 not_found: Optional[Dict[str, Any]] = None):
+        self.routes: Dict[Tuple[str, Optional[str]], Handler] = {}
+        self.default_actions = default_actions or {}
+        self.not_found = not_found or error(400, 'Invalid request')
+        self.guard: Optional[Callable[[Request], Optional[Dict[str, Any]]]] = None
+        self.preflight = respond(200, headers={
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': methods,
+            'Access-Control-Allow-Headers': allow_headers,
+            'Access-Control-Max-Age': '86400'
+        })
+
+    def route(self, method: str, action: Optional[str] = None) -> Callable[[Handler], Handler]:
+        def register(fn: Handler) -> Handler:
+            self.routes[(method, action)] = fn
+            return fn
+        return register
+
+    def action(self, request: Request) -> Optional[str]:
+        default = self.default_actions.get(request.method)
+        if request.method == 'GET':
+            return request.query.get('action', default)
+        return request.body.get('action', default)
+
+    def dispatch(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        request = Request(event)
+        if request.method == 'OPTIONS':
+            return self.preflight
+        try:
+            if self.guard is not None:
+                denied = self.guard(request)
+                if denied is not None:
+                    return denied
+            fn = self.routes.get((request.method, self.action(request)))
+            if fn is None:
+                return self.not_found
+            return fn(request)
+        finally:
+            request.release()
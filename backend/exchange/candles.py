@@ -0,0 +1,140 @@
+'''
+OHLC-свечи цен акций (1m/1h/1d) с объёмом сделок.
+Свечи обновляются инкрементально на каждом тике движка цен и на каждой
+сделке, поэтому графики за любой период читают сотни строк агрегатов
+вместо сырой истории. Сырые тики старше RAW_RETENTION_DAYS удаляются.
+Запуск чистки: python candles.py [--raw-days 7] [--minute-days 30]
+'''
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import db
+
+RESOLUTIONS: Dict[str, timedelta] = {
+    '1m': timedelta(minutes=1),
+    '1h': timedelta(hours=1),
+    '1d': timedelta(days=1)
+}
+
+MAX_CANDLES = 1000
+DEFAULT_CANDLES = 200
+RAW_RETENTION_DAYS = 7
+MINUTE_RETENTION_DAYS = 30
+DELETE_BATCH = 10000
+
+UPSERT_SQL = '''
+    INSERT INTO stock_candles (company_id, resolution, bucket_start, open, high, low, close, volume)
+    SELECT v.company_id, r.name, date_trunc(r.unit, v.at), v.open, v.high, v.low, v.close, v.volume
+    FROM (VALUES %s) AS v(company_id, open, high, low, close, volume, at)
+    CROSS JOIN (VALUES ('1m', 'minute'), ('1h', 'hour'), ('1d', 'day')) AS r(name, unit)
+    ON CONFLICT (company_id, resolution, bucket_start) DO UPDATE SET
+        high = GREATEST(stock_candles.high, EXCLUDED.high),
+        low = LEAST(stock_candles.low, EXCLUDED.low),
+        close = EXCLUDED.close,
+        volume = stock_candles.volume + EXCLUDED.volume
+'''
+UPSERT_TEMPLATE = '(%s, %s::numeric, %s::numeric, %s::numeric, %s::numeric, %s::bigint, %s::timestamp)'
+
+
+def record_prices(cur: Any, prices: Sequence[Tuple[int, Any, datetime]]) -> None:
+    '''prices — (company_id, price, recorded_at), не больше одной строки на компанию.'''
+    if prices:
+        db.execute_values(cur, UPSERT_SQL, [(c, p, p, p, p, 0, at) for c, p, at in prices], template=UPSERT_TEMPLATE)
+
+
+def record_trade(cur: Any, company_id: int, price: Any, shares: int, at: datetime) -> None:
+    db.execute_values(cur, UPSERT_SQL, [(company_id, price, price, price, price, shares, at)],
+                      template=UPSERT_TEMPLATE)
+
+
+def record_prints(cur: Any, company_id: int, prints: Sequence[Tuple[Any, int]], at: datetime) -> None:
+    '''prints — (price, shares) сделок пачки по порядку; пишутся одной OHLC-строкой на интервал.'''
+    if prints:
+        prices = [price for price, _ in prints]
+        db.execute_values(cur, UPSERT_SQL, [(company_id, prices[0], max(prices), min(prices), prices[-1],
+                                             sum(shares for _, shares in prints), at)],
+                          template=UPSERT_TEMPLATE)
+
+
+def pick_resolution(interval: str, start: datetime, end: datetime) -> str:
+    if interval in RESOLUTIONS:
+        return interval
+    if interval != 'auto':
+        raise ValueError(f'Unknown interval: {interval}')
+    span = end - start
+    if span <= timedelta(hours=6):
+        return '1m'
+    if span <= timedelta(days=14):
+        return '1h'
+    return '1d'
+
+
+def parse_range(params: Dict[str, Any], now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+    end = datetime.fromisoformat(params['to']) if params.get('to') else (now or datetime.now())
+    if params.get('from'):
+        start = datetime.fromisoformat(params['from'])
+    else:
+        step = RESOLUTIONS.get(params.get('interval', ''), RESOLUTIONS['1h'])
+        start = end - step * DEFAULT_CANDLES
+    if start >= end:
+        raise ValueError('Empty range')
+    return start, end
+
+
+def fetch(cur: Any, company_id: Any, resolution: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    cur.execute('''
+        SELECT bucket_start, open, high, low, close, volume
+        FROM stock_candles
+        WHERE company_id = %s AND resolution = %s AND bucket_start >= %s AND bucket_start < %s
+        ORDER BY bucket_start ASC
+        LIMIT %s
+    ''', (company_id, resolution, start, end, MAX_CANDLES))
+    return cur.fetchall()
+
+
+def _delete_in_batches(conn: Any, sql: str, args: Tuple[Any, ...]) -> int:
+    deleted = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(sql, args + (DELETE_BATCH,))
+            count = cur.rowcount
+        conn.commit()
+        deleted += count
+        if count < DELETE_BATCH:
+            return deleted
+
+
+def compact(conn: Any, raw_days: int = RAW_RETENTION_DAYS, minute_days: int = MINUTE_RETENTION_DAYS,
+            now: Optional[datetime] = None) -> Dict[str, int]:
+    '''Удаляет сырые тики и минутные свечи старше порога; часовые и дневные свечи хранятся всегда.'''
+    now = now or datetime.now()
+    raw = _delete_in_batches(conn, '''
+        DELETE FROM stock_price_history
+        WHERE id IN (SELECT id FROM stock_price_history WHERE recorded_at < %s LIMIT %s)
+    ''', (now - timedelta(days=raw_days),))
+    minute = _delete_in_batches(conn, '''
+        DELETE FROM stock_candles
+        WHERE (company_id, resolution, bucket_start) IN (
+            SELECT company_id, resolution, bucket_start FROM stock_candles
+            WHERE resolution = '1m' AND bucket_start < %s
+            LIMIT %s
+        )
+    ''', (now - timedelta(days=minute_days),))
+    return {'raw_ticks': raw, 'minute_candles': minute}
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compact stock price history')
+    parser.add_argument('--raw-days', type=int, default=RAW_RETENTION_DAYS)
+    parser.add_argument('--minute-days', type=int, default=MINUTE_RETENTION_DAYS)
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        print(compact(conn, args.raw_days, args.minute_days))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+'''
+Лента изменений (change_events) для клиентов вместо перечитывания списков.
+Триггеры пишут компактные события — лот выставлен/продан, тик цены,
+движение баланса — в транзакцию самого изменения, без NOTIFY на пути
+записи. publish() под advisory-блокировкой нумерует уже зафиксированные
+события (seq растёт в порядке фиксации); его вызывает отдельный процесс
+(python feed.py publish --interval 1), тик цен или POST action=publish_changes,
+но не чтение ленты. Клиент читает только события после своего since: поиск
+по индексу seq, объём чтения растёт с числом изменений, а не с размером
+таблиц. Ждущий запрос не держит соединение: номер головы ленты проверяется
+раз в POLL_INTERVAL одним запросом на процесс.
+Очистка старых событий: python feed.py prune [--keep-hours 24]
+'''
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Sequence
+
+import db
+
+LOCK_KEY = 'change_feed'
+TOPICS = ('listing', 'price', 'balance')
+PUBLISH_BATCH = 5000
+READ_LIMIT = 500
+MAX_WAIT_SECONDS = 25
+POLL_INTERVAL = 1.0
+KEEP = timedelta(hours=24)
+DELETE_BATCH = 10000
+PRUNED_KEY = 'change_feed:pruned'
+
+# nextval считается над уже упорядоченной выборкой: события одной
+# транзакции получают номера в порядке записи
+PUBLISH_SQL = '''
+    UPDATE change_events e
+    SET seq = p.seq
+    FROM (
+        SELECT id, nextval('change_events_seq') AS seq
+        FROM (
+            SELECT id FROM change_events
+            WHERE seq IS NULL
+            ORDER BY id
+            LIMIT %s
+        ) pending
+    ) p
+    WHERE e.id = p.id
+    RETURNING p.seq
+'''
+
+READ_SQL = '''
+    SELECT seq, topic, user_id, payload
+    FROM change_events
+    WHERE seq > %s AND seq <= %s AND topic = ANY(%s) AND (user_id IS NULL OR user_id = %s)
+    ORDER BY seq
+    LIMIT %s
+'''
+
+
+def publish(conn: Any) -> int:
+    '''Нумерует зафиксированные события и фиксирует транзакцию; возвращает их число.'''
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_try_advisory_xact_lock(hashtext(%s))', (LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return 0
+        cur.execute(PUBLISH_SQL, (PUBLISH_BATCH,))
+        seqs = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return len(seqs)
+
+
+def head(cur: Any) -> int:
+    cur.execute('SELECT COALESCE(MAX(seq), 0) FROM change_events WHERE seq IS NOT NULL')
+    return cur.fetchone()[0]
+
+
+def pruned(cur: Any) -> int:
+    cur.execute('SELECT version FROM cache_versions WHERE key = %s', (PRUNED_KEY,))
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+
+def read(cur: Any, since: int, user_id: Optional[int], topics: Sequence[str],
+         limit: int = READ_LIMIT) -> Dict[str, Any]:
+    '''
+    События после since; reset — часть событий уже удалена, клиенту нужна
+    полная загрузка. Чтение ограничено головой ленты, поэтому без подходящих
+    событий next сдвигается до неё и чужие события не перечитываются.
+    '''
+    position = head(cur)
+    if since < pruned(cur):
+        return {'events': [], 'next': position, 'reset': True}
+    cur.execute(READ_SQL, (since, position, list(topics), user_id, limit))
+    events = [{'seq': seq, 'topic': topic, 'user_id': owner, 'payload': payload}
+              for seq, topic, owner, payload in cur.fetchall()]
+    full = len(events) == limit
+    return {'events': events, 'next': events[-1]['seq'] if full else max(since, position), 'reset': False}
+
+
+# Голова ленты, общая для всех ждущих запросов процесса
+_head = {'seq': 0, 'checked_at': float('-inf')}
+_head_lock = threading.Lock()
+
+
+def latest_seq() -> int:
+    '''Номер головы ленты не старше POLL_INTERVAL; соединение берётся на один запрос.'''
+    with _head_lock:
+        if time.monotonic() - _head['checked_at'] >= POLL_INTERVAL:
+            with db.connection() as conn:
+                with conn.cursor() as cur:
+                    _head['seq'] = head(cur)
+                conn.commit()
+            _head['checked_at'] = time.monotonic()
+        return _head['seq']
+
+
+def _read(since: int, user_id: Optional[int], topics: Sequence[str], limit: int) -> Dict[str, Any]:
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            result = read(cur, since, user_id, topics, limit)
+        conn.commit()
+    return result
+
+
+def poll(since: Optional[int], user_id: Optional[int], topics: Sequence[str],
+         wait: float = 0, limit: int = READ_LIMIT) -> Dict[str, Any]:
+    '''
+    Long-poll: возвращает события после since, а если их нет — ждёт до wait
+    секунд, пока голова ленты не сдвинется. Соединение из пула берётся только
+    на чтение. Без since отдаёт только текущий номер, с которого клиент
+    продолжит после полной загрузки.
+    '''
+    if since is None:
+        with db.connection() as conn:
+            with conn.cursor() as cur:
+                position = head(cur)
+            conn.commit()
+        return {'events': [], 'next': position, 'reset': False}
+
+    deadline = time.monotonic() + min(max(wait, 0), MAX_WAIT_SECONDS)
+    while True:
+        result = _read(since, user_id, topics, limit)
+        if result['events'] or result['reset']:
+            return result
+        since = result['next']
+        while latest_seq() <= since:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return result
+            time.sleep(min(remaining, POLL_INTERVAL))
+
+
+def prune(conn: Any, keep: timedelta = KEEP, batch: int = DELETE_BATCH) -> int:
+    '''Удаляет пронумерованные события старше keep; since ниже удалённого получит reset.'''
+    deleted = 0
+    cutoff = datetime.now() - keep
+    while True:
+        with conn.cursor() as cur:
+            cur.execute('''
+                WITH doomed AS (
+                    SELECT id, seq FROM change_events
+                    WHERE seq IS NOT NULL AND created_at < %s
+                    ORDER BY seq
+                    LIMIT %s
+                ),
+                removed AS (
+                    DELETE FROM change_events e USING doomed d
+                    WHERE e.id = d.id
+                    RETURNING d.seq
+                )
+                SELECT COUNT(*), MAX(seq) FROM removed
+            ''', (cutoff, batch))
+            count, last = cur.fetchone()
+            if last is not None:
+                cur.execute('''
+                    INSERT INTO cache_versions (key, version) VALUES (%s, %s)
+                    ON CONFLICT (key) DO UPDATE SET version = GREATEST(cache_versions.version, EXCLUDED.version)
+                ''', (PRUNED_KEY, last))
+        conn.commit()
+        deleted += count
+        if count < batch:
+            return deleted
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Change feed maintenance')
+    sub = parser.add_subparsers(dest='command', required=True)
+    publish_parser = sub.add_parser('publish', help='number committed events')
+    publish_parser.add_argument('--interval', type=float, help='keep publishing every N seconds')
+    prune_parser = sub.add_parser('prune', help='delete published events older than --keep-hours')
+    prune_parser.add_argument('--keep-hours', type=float, default=KEEP.total_seconds() / 3600)
+    prune_parser.add_argument('--batch', type=int, default=DELETE_BATCH)
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        if args.command == 'prune':
+            result: Dict[str, Any] = {'deleted': prune(conn, timedelta(hours=args.keep_hours), args.batch)}
+        elif args.interval:
+            while True:
+                published = publish(conn)
+                if published:
+                    print(json.dumps({'published': published}), flush=True)
+                if published < PUBLISH_BATCH:
+                    time.sleep(args.interval)
+        else:
+            result = {'published': publish(conn)}
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
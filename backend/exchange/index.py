@@ -5,236 +5,369 @@ Args: event - dict с httpMethod, body, queryStringParameters
 Returns: HTTP response dict с данными о компаниях, акциях и сделках
 '''
 
-import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
-from datetime import datetime, timedelta
+from datetime import datetime
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    
+import api
+import candles
+import db
+import feed
+import idempotency
+import ledger
+import matching
+import portfolio
+
+ORDER_BOOK_LEVELS = 20
+ORDERS_LIMIT = 50
+
+router = api.Router('GET, POST, OPTIONS', 'Content-Type, X-User-Id, Idempotency-Key',
+                    default_actions={'GET': 'companies'})
+
+
+def cron_authorized(request: api.Request) -> bool:
+    token = os.environ.get('PRICE_ENGINE_TOKEN')
+    return bool(token) and request.headers.get('x-cron-token') == token
+
+
+@router.route('GET', 'companies')
+def companies(request: api.Request) -> Dict[str, Any]:
+    with request.conn.cursor() as cur:
+        cur.execute('''
+            SELECT c.*
+            FROM companies c
+            ORDER BY c.id
+        ''')
+        return api.ok(companies=api.rows_json(cur))
+
+
+@router.route('GET', 'price_history')
+def price_history(request: api.Request) -> Dict[str, Any]:
+    params = request.query
+    company_id = params.get('company_id')
+
+    if params.get('interval'):
+        try:
+            start, end = candles.parse_range(params)
+            resolution = candles.pick_resolution(params['interval'], start, end)
+        except ValueError:
+            return api.error(400, 'Invalid interval or range')
+
+        with request.conn.cursor() as cur:
+            rows = candles.fetch(cur, company_id, resolution, start, end)
+            return api.ok(interval=resolution, candles=api.rows_json(cur, rows))
+
+    with request.conn.cursor() as cur:
+        cur.execute('''
+            SELECT price, recorded_at
+            FROM stock_price_history
+            WHERE company_id = %s
+            ORDER BY recorded_at DESC
+            LIMIT 50
+        ''', (company_id,))
+        return api.ok(history=api.rows_json(cur))
+
+
+@router.route('GET', 'portfolio')
+def portfolio(request: api.Request) -> Dict[str, Any]:
+    user_id = request.query.get('user_id')
+
+    with request.conn.cursor() as cur:
+        cur.execute('''
+            SELECT us.*, c.name, c.ticker, c.current_price,
+                   (c.current_price - us.avg_purchase_price) * us.shares as profit,
+                   c.current_price * us.shares as current_value
+            FROM user_stocks us
+            JOIN companies c ON us.company_id = c.id
+            WHERE us.user_id = %s AND us.shares > 0
+            ORDER BY current_value DESC
+        ''', (user_id,))
+        return api.ok(portfolio=api.rows_json(cur))
+
+
+@router.route('GET', 'portfolio_summary')
+def portfolio_summary(request: api.Request) -> Dict[str, Any]:
+    try:
+        user_id = int(request.query.get('user_id'))
+    except (TypeError, ValueError):
+        return api.error(400, 'Invalid user_id')
+
+    with request.conn.cursor() as cur:
+        return api.ok(summary=portfolio.summary(cur, user_id))
+
+
+@router.route('GET', 'leaderboard')
+def leaderboard(request: api.Request) -> Dict[str, Any]:
+    metric = request.query.get('metric', 'value')
+    try:
+        limit = min(max(int(request.query.get('limit', 20)), 1), portfolio.LEADERBOARD_SIZE)
+    except ValueError:
+        return api.error(400, 'Invalid list parameters')
+    if metric not in portfolio.LEADERBOARD_METRICS:
+        return api.error(400, 'Invalid list parameters')
+
+    with request.conn.cursor() as cur:
+        cur.execute('''
+            SELECT l.rank, l.user_id, u.username, l.market_value, l.cost_basis,
+                   l.market_value - l.cost_basis AS unrealized_pnl
+            FROM portfolio_leaderboard l
+            JOIN users u ON u.id = l.user_id
+            WHERE l.metric = %s AND l.rank <= %s
+            ORDER BY l.rank
+        ''', (metric, limit))
+        return api.ok(metric=metric, leaderboard=api.rows_json(cur))
+
+
+@router.route('GET', 'changes')
+def changes(request: api.Request) -> Dict[str, Any]:
+    params = request.query
+    topics = [topic for topic in params.get('topics', ','.join(feed.TOPICS)).split(',') if topic]
+    try:
+        since = int(params['since']) if params.get('since') else None
+        user_id = int(params['user_id']) if params.get('user_id') else None
+        wait = float(params.get('wait', 0))
+        limit = min(max(int(params.get('limit', feed.READ_LIMIT)), 1), feed.READ_LIMIT)
+    except ValueError:
+        return api.error(400, 'Invalid feed parameters')
+    if not topics or not set(topics) <= set(feed.TOPICS) or (since is not None and since < 0):
+        return api.error(400, 'Invalid feed parameters')
+
+    return api.ok(**feed.poll(since, user_id, topics, wait, limit))
+
+
+@router.route('POST', 'publish_changes')
+def publish_changes(request: api.Request) -> Dict[str, Any]:
+    if not cron_authorized(request):
+        return api.error(403, 'Access denied')
+
+    return api.ok(published=feed.publish(request.conn))
+
+
+@router.route('POST', 'tick')
+def tick(request: api.Request) -> Dict[str, Any]:
+    if not cron_authorized(request):
+        return api.error(403, 'Access denied')
+
+    import price_engine
+    prices = price_engine.run_tick(request.conn)
+    feed.publish(request.conn)
+    return api.ok(prices=prices)
+
+
+@router.route('POST', 'match')
+def match(request: api.Request) -> Dict[str, Any]:
+    if not cron_authorized(request):
+        return api.error(403, 'Access denied')
+
+    return api.ok(**matching.drain_all(request.conn))
+
+
+@router.route('GET', 'order_book')
+def order_book(request: api.Request) -> Dict[str, Any]:
+    try:
+        company_id = int(request.query.get('company_id'))
+        levels = min(max(int(request.query.get('levels', ORDER_BOOK_LEVELS)), 1), 100)
+    except (TypeError, ValueError):
+        return api.error(400, 'Invalid order book parameters')
+
+    with request.conn.cursor() as cur:
+        return api.ok(company_id=company_id, **matching.depth(cur, company_id, levels))
+
+
+@router.route('GET', 'orders')
+def orders(request: api.Request) -> Dict[str, Any]:
+    params = request.query
+    conditions = ['user_id = %s']
+
+    try:
+        args = [int(params.get('user_id'))]
+        limit = min(max(int(params.get('limit', ORDERS_LIMIT)), 1), 200)
+        if params.get('status'):
+            conditions.append('status = %s')
+            args.append(params['status'])
+        if params.get('cursor'):
+            conditions.append('id < %s')
+            args.append(int(params['cursor']))
+    except (TypeError, ValueError):
+        return api.error(400, 'Invalid list parameters')
+
+    with request.conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT id, company_id, side, order_type, price, shares, remaining, status, created_at, updated_at
+            FROM stock_orders
+            WHERE {' AND '.join(conditions)}
+            ORDER BY id DESC
+            LIMIT %s
+        ''', (*args, limit + 1))
+        rows = cur.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = str(rows[-1][0])
+
+        return api.ok(orders=api.rows_json(cur, rows), next_cursor=next_cursor)
+
+
+@router.route('GET', 'trades')
+def trades(request: api.Request) -> Dict[str, Any]:
+    try:
+        company_id = int(request.query.get('company_id'))
+        limit = min(max(int(request.query.get('limit', ORDERS_LIMIT)), 1), 200)
+    except (TypeError, ValueError):
+        return api.error(400, 'Invalid list parameters')
+
+    with request.conn.cursor() as cur:
+        cur.execute('''
+            SELECT id, price, shares, created_at
+            FROM stock_trades
+            WHERE company_id = %s
+            ORDER BY id DESC
+            LIMIT %s
+        ''', (company_id, limit))
+        return api.ok(trades=api.rows_json(cur))
+
+
+@router.route('POST', 'place_order')
+@idempotency.idempotent
+def place_order(request: api.Request) -> Dict[str, Any]:
     try:
-        if method == 'GET':
-            action = event.get('queryStringParameters', {}).get('action', 'companies')
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if action == 'companies':
-                    cur.execute('''
-                        SELECT c.*,
-                               0 as change_percent
-                        FROM companies c
-                        ORDER BY c.id
-                    ''')
-                    companies = cur.fetchall()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'companies': [dict(c) for c in companies]
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
-                
-                elif action == 'price_history':
-                    company_id = event.get('queryStringParameters', {}).get('company_id')
-                    
-                    cur.execute('''
-                        SELECT price, recorded_at
-                        FROM stock_price_history
-                        WHERE company_id = %s
-                        ORDER BY recorded_at DESC
-                        LIMIT 50
-                    ''', (company_id,))
-                    history = cur.fetchall()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'history': [dict(h) for h in history]
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
-                
-                elif action == 'portfolio':
-                    user_id = event.get('queryStringParameters', {}).get('user_id')
-                    
-                    cur.execute('''
-                        SELECT us.*, c.name, c.ticker, c.current_price,
-                               (c.current_price - us.average_buy_price) * us.shares as profit,
-                               c.current_price * us.shares as current_value
-                        FROM user_stocks us
-                        JOIN companies c ON us.company_id = c.id
-                        WHERE us.user_id = %s AND us.shares > 0
-                        ORDER BY current_value DESC
-                    ''', (user_id,))
-                    portfolio = cur.fetchall()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'portfolio': [dict(p) for p in portfolio]
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
-        
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if action == 'buy':
-                    user_id = body_data.get('user_id')
-                    company_id = body_data.get('company_id')
-                    shares = body_data.get('shares')
-                    
-                    cur.execute('SELECT current_price FROM companies WHERE id = %s', (company_id,))
-                    company = cur.fetchone()
-                    
-                    total_cost = company['current_price'] * shares
-                    
-                    cur.execute('SELECT balance FROM users WHERE id = %s', (user_id,))
-                    user = cur.fetchone()
-                    
-                    if user['balance'] < total_cost:
-                        return {
-                            'statusCode': 400,
-                            'headers': {
-                                'Content-Type': 'application/json',
-                                'Access-Control-Allow-Origin': '*'
-                            },
-                            'body': json.dumps({'success': False, 'error': 'Insufficient balance'}),
-                            'isBase64Encoded': False
-                        }
-                    
-                    cur.execute('UPDATE users SET balance = balance - %s WHERE id = %s', (total_cost, user_id))
-                    
-                    cur.execute('''
-                        INSERT INTO user_stocks (user_id, company_id, shares, average_buy_price)
-                        VALUES (%s, %s, %s, %s)
-                        ON CONFLICT (user_id, company_id)
-                        DO UPDATE SET 
-                            shares = user_stocks.shares + %s,
-                            average_buy_price = ((user_stocks.average_buy_price * user_stocks.shares) + (%s * %s)) / (user_stocks.shares + %s)
-                    ''', (user_id, company_id, shares, company['current_price'], 
-                          shares, company['current_price'], shares, shares))
-                    
-                    cur.execute('''
-                        INSERT INTO stock_transactions (user_id, company_id, transaction_type, shares, price_per_share, total_amount)
-                        VALUES (%s, %s, 'buy', %s, %s, %s)
-                    ''', (user_id, company_id, shares, company['current_price'], total_cost))
-                    
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'message': 'Shares purchased successfully'
-                        }),
-                        'isBase64Encoded': False
-                    }
-                
-                elif action == 'sell':
-                    user_id = body_data.get('user_id')
-                    company_id = body_data.get('company_id')
-                    shares = body_data.get('shares')
-                    
-                    cur.execute('''
-                        SELECT shares FROM user_stocks
-                        WHERE user_id = %s AND company_id = %s
-                    ''', (user_id, company_id))
-                    user_stock = cur.fetchone()
-                    
-                    if not user_stock or user_stock['shares'] < shares:
-                        return {
-                            'statusCode': 400,
-                            'headers': {
-                                'Content-Type': 'application/json',
-                                'Access-Control-Allow-Origin': '*'
-                            },
-                            'body': json.dumps({'success': False, 'error': 'Insufficient shares'}),
-                            'isBase64Encoded': False
-                        }
-                    
-                    cur.execute('SELECT current_price FROM companies WHERE id = %s', (company_id,))
-                    company = cur.fetchone()
-                    
-                    total_value = company['current_price'] * shares
-                    
-                    cur.execute('UPDATE users SET balance = balance + %s WHERE id = %s', (total_value, user_id))
-                    
-                    cur.execute('''
-                        UPDATE user_stocks SET shares = shares - %s
-                        WHERE user_id = %s AND company_id = %s
-                    ''', (shares, user_id, company_id))
-                    
-                    cur.execute('''
-                        INSERT INTO stock_transactions (user_id, company_id, transaction_type, shares, price_per_share, total_amount)
-                        VALUES (%s, %s, 'sell', %s, %s, %s)
-                    ''', (user_id, company_id, shares, company['current_price'], total_value))
-                    
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'message': 'Shares sold successfully',
-                            'total_value': total_value
-                        }),
-                        'isBase64Encoded': False
-                    }
-        
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'success': False, 'error': 'Invalid request'}),
-            'isBase64Encoded': False
-        }
-    
-    finally:
-        conn.close()
\ No newline at end of file
+        order = matching.parse_order(request.body)
+    except ValueError as e:
+        return api.error(400, str(e))
+
+    conn = request.conn
+    with conn.cursor() as cur:
+        try:
+            order_id = matching.place(cur, order)
+        except matching.UnknownCompany:
+            return api.error(404, 'Company not found')
+        except matching.PriceOutOfBand:
+            return api.error(400, f'Limit price must be within {matching.LIMIT_BAND:.0%} of the current price')
+        except ledger.UnknownAccount:
+            return api.error(404, 'User not found')
+        except ledger.InsufficientFunds:
+            return api.error(400, 'Insufficient balance')
+        except matching.InsufficientShares:
+            return api.error(400, 'Insufficient shares')
+    conn.commit()
+
+    # Сводим очередь сразу: если компанию уже сводит другой вызов, ждём его
+    # блокировку, и к этому моменту наша заявка обычно уже исполнена им.
+    matching.drain(conn, order['company_id'])
+
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT id, company_id, side, order_type, price, shares, remaining, status, created_at
+            FROM stock_orders WHERE id = %s
+        ''', (order_id,))
+        names = [column.name for column in cur.description]
+        return api.ok(order=dict(zip(names, cur.fetchone())))
+
+
+@router.route('POST', 'cancel_order')
+def cancel_order(request: api.Request) -> Dict[str, Any]:
+    try:
+        user_id = int(request.body.get('user_id'))
+        order_id = int(request.body.get('order_id'))
+    except (TypeError, ValueError):
+        return api.error(400, 'Invalid order parameters')
+
+    conn = request.conn
+    with conn.cursor() as cur:
+        order = matching.cancel(cur, user_id, order_id)
+        if not order:
+            return api.error(404, 'Open order not found')
+    conn.commit()
+
+    return api.ok(order_id=order_id, status='cancelled', remaining=order['remaining'])
+
+
+@router.route('POST', 'buy')
+@idempotency.idempotent
+def buy(request: api.Request) -> Dict[str, Any]:
+    user_id = request.body.get('user_id')
+    company_id = request.body.get('company_id')
+    shares = request.body.get('shares')
+
+    conn = request.conn
+    with db.dict_cursor(conn) as cur:
+        cur.execute('SELECT current_price FROM companies WHERE id = %s', (company_id,))
+        company = cur.fetchone()
+
+        total_cost = company['current_price'] * shares
+
+        try:
+            ledger.post(cur, [(user_id, -total_cost, 'stock_buy', f'Покупка акций: {shares} шт., компания #{company_id}')])
+        except ledger.UnknownAccount:
+            return api.error(404, 'User not found')
+        except ledger.InsufficientFunds:
+            return api.error(400, 'Insufficient balance')
+
+        cur.execute('''
+            INSERT INTO user_stocks (user_id, company_id, shares, avg_purchase_price)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (user_id, company_id)
+            DO UPDATE SET
+                shares = user_stocks.shares + %s,
+                avg_purchase_price = ((COALESCE(user_stocks.avg_purchase_price, 0) * user_stocks.shares) + (%s * %s)) / (user_stocks.shares + %s)
+        ''', (user_id, company_id, shares, company['current_price'],
+              shares, company['current_price'], shares, shares))
+
+        cur.execute('''
+            INSERT INTO stock_transactions (user_id, company_id, transaction_type, shares, price_per_share, total_amount)
+            VALUES (%s, %s, 'buy', %s, %s, %s)
+        ''', (user_id, company_id, shares, company['current_price'], total_cost))
+        candles.record_trade(cur, company_id, company['current_price'], shares, datetime.now())
+
+        conn.commit()
+
+    return api.ok(message='Shares purchased successfully')
+
+
+@router.route('POST', 'sell')
+@idempotency.idempotent
+def sell(request: api.Request) -> Dict[str, Any]:
+    user_id = request.body.get('user_id')
+    company_id = request.body.get('company_id')
+    shares = request.body.get('shares')
+
+    conn = request.conn
+    with db.dict_cursor(conn) as cur:
+        cur.execute('''
+            SELECT shares FROM user_stocks
+            WHERE user_id = %s AND company_id = %s
+        ''', (user_id, company_id))
+        user_stock = cur.fetchone()
+
+        if not user_stock or user_stock['shares'] < shares:
+            return api.error(400, 'Insufficient shares')
+
+        cur.execute('SELECT current_price FROM companies WHERE id = %s', (company_id,))
+        company = cur.fetchone()
+
+        total_value = company['current_price'] * shares
+
+        try:
+            ledger.post(cur, [(user_id, total_value, 'stock_sell', f'Продажа акций: {shares} шт., компания #{company_id}')])
+        except ledger.UnknownAccount:
+            return api.error(404, 'User not found')
+
+        cur.execute('''
+            UPDATE user_stocks SET shares = shares - %s
+            WHERE user_id = %s AND company_id = %s
+        ''', (shares, user_id, company_id))
+
+        cur.execute('''
+            INSERT INTO stock_transactions (user_id, company_id, transaction_type, shares, price_per_share, total_amount)
+            VALUES (%s, %s, 'sell', %s, %s, %s)
+        ''', (user_id, company_id, shares, company['current_price'], total_value))
+        candles.record_trade(cur, company_id, company['current_price'], shares, datetime.now())
+
+        conn.commit()
+
+    return api.ok(message='Shares sold successfully', total_value=total_value)
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return router.dispatch(event)
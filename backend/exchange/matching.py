@@ -0,0 +1,494 @@
+'''
+Книга заявок и движок сопоставления биржи.
+place() резервирует звёзды покупателя или акции продавца и ставит заявку
+в очередь (status = 'new'). run() под advisory-блокировкой компании берёт
+из очереди пачку до BATCH_ORDERS заявок в порядке id и сводит их с книгой
+по приоритету цена-время. Лучшие встречные заявки читаются из частичных
+индексов страницами по PAGE_ROWS, а внутри пачки книга лежит в кучах,
+поэтому сделка стоит O(log глубины книги). Итог пачки пишется
+несколькими пакетными запросами: остатки заявок, сделки, проводки,
+позиции, последняя цена и свечи.
+Сделка идёт по цене стоящей в книге заявки. Рыночная заявка — это
+лимитная с ценой-ограничителем MARKET_COLLAR от текущей цены, остаток
+которой снимается сразу после сведения. Цена лимитной заявки — не дальше
+LIMIT_BAND от текущей цены. Встречная заявка того же пользователя не
+исполняется, а снимается. Принты пишутся в last_trade_price и свечи;
+current_price ведёт только движок цен, и мгновенные buy/sell по ней
+нельзя сдвинуть сделками с самим собой.
+Запуск: python matching.py [--interval 0.2] — фоновое сведение всех компаний.
+'''
+
+import heapq
+import time
+from datetime import datetime
+from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP
+from typing import Any, Dict, List, Optional, Tuple
+
+import candles
+import db
+import ledger
+
+BATCH_ORDERS = 500
+PAGE_ROWS = 200
+MAX_SHARES = 1_000_000
+MARKET_COLLAR = Decimal('0.10')
+LIMIT_BAND = Decimal('0.20')
+MIN_PRICE = Decimal('0.01')
+CENT = Decimal('0.01')
+
+SIDES = ('buy', 'sell')
+ORDER_TYPES = ('limit', 'market')
+
+LOCK_KEY = 'order_book'
+
+ORDER_COLUMNS = 'id, user_id, side, order_type, price, remaining, reserved'
+
+QUEUE_SQL = f'''
+    SELECT {ORDER_COLUMNS}
+    FROM stock_orders
+    WHERE company_id = %s AND status = 'new'
+    ORDER BY id
+    LIMIT %s
+'''
+
+# Следующая страница стороны книги после границы (ключ последней прочитанной заявки)
+PAGE_SQL = {
+    'sell': f'''
+        SELECT {ORDER_COLUMNS}
+        FROM stock_orders
+        WHERE company_id = %s AND side = 'sell' AND status = 'open' AND (price, id) > (%s, %s)
+        ORDER BY price, id
+        LIMIT %s
+    ''',
+    'buy': f'''
+        SELECT {ORDER_COLUMNS}
+        FROM stock_orders
+        WHERE company_id = %s AND side = 'buy' AND status = 'open' AND (-price, id) > (%s, %s)
+        ORDER BY -price, id
+        LIMIT %s
+    '''
+}
+
+# Ключ перед первой заявкой стороны: у asks ключ (price, id), у bids (-price, id)
+START_KEYS = {'sell': (Decimal(0), 0), 'buy': (Decimal(-10 ** 8), 0)}
+
+DEPTH_SQL = {
+    'sell': '''
+        SELECT price, SUM(remaining) AS shares, COUNT(*) AS orders
+        FROM (
+            SELECT price, remaining FROM stock_orders
+            WHERE company_id = %s AND side = 'sell' AND status = 'open'
+            ORDER BY price, id
+            LIMIT %s
+        ) o
+        GROUP BY price
+        ORDER BY price
+        LIMIT %s
+    ''',
+    'buy': '''
+        SELECT price, SUM(remaining) AS shares, COUNT(*) AS orders
+        FROM (
+            SELECT price, remaining FROM stock_orders
+            WHERE company_id = %s AND side = 'buy' AND status = 'open'
+            ORDER BY -price, id
+            LIMIT %s
+        ) o
+        GROUP BY price
+        ORDER BY price DESC
+        LIMIT %s
+    '''
+}
+
+UPDATE_ORDERS_SQL = '''
+    UPDATE stock_orders o
+    SET status = v.status, remaining = v.remaining, reserved = v.reserved, updated_at = v.at
+    FROM (VALUES %s) AS v(id, status, remaining, reserved, at)
+    WHERE o.id = v.id
+'''
+UPDATE_ORDERS_TEMPLATE = '(%s::bigint, %s::varchar, %s::int, %s::bigint, %s::timestamp)'
+
+INSERT_TRADES_SQL = '''
+    INSERT INTO stock_trades (company_id, buy_order_id, sell_order_id, buyer_id, seller_id,
+                              price, shares, amount, created_at)
+    VALUES %s
+'''
+
+INSERT_TRANSACTIONS_SQL = '''
+    INSERT INTO stock_transactions (user_id, company_id, transaction_type, shares, price_per_share,
+                                    total_amount, created_at)
+    VALUES %s
+'''
+
+# Купленные акции: средняя цена — взвешенная по старой позиции и покупкам пачки
+ADD_POSITIONS_SQL = '''
+    INSERT INTO user_stocks (user_id, company_id, shares, avg_purchase_price)
+    SELECT v.user_id, v.company_id, v.shares, v.cost / v.shares
+    FROM (VALUES %s) AS v(user_id, company_id, shares, cost)
+    ORDER BY v.user_id
+    ON CONFLICT (user_id, company_id) DO UPDATE SET
+        shares = user_stocks.shares + EXCLUDED.shares,
+        avg_purchase_price = (COALESCE(user_stocks.avg_purchase_price, 0) * user_stocks.shares
+                              + EXCLUDED.avg_purchase_price * EXCLUDED.shares)
+                             / (user_stocks.shares + EXCLUDED.shares)
+'''
+ADD_POSITIONS_TEMPLATE = '(%s::int, %s::int, %s::int, %s::numeric)'
+
+# Возврат зарезервированных, но не проданных акций; строка позиции уже есть с момента place()
+RETURN_SHARES_SQL = '''
+    UPDATE user_stocks us SET shares = us.shares + v.shares
+    FROM (VALUES %s) AS v(user_id, company_id, shares)
+    WHERE us.user_id = v.user_id AND us.company_id = v.company_id
+'''
+
+
+class OrderError(Exception):
+    pass
+
+
+class UnknownCompany(OrderError):
+    pass
+
+
+class InsufficientShares(OrderError):
+    pass
+
+
+class PriceOutOfBand(OrderError):
+    pass
+
+
+def parse_order(body: Dict[str, Any]) -> Dict[str, Any]:
+    '''Проверяет тело place_order; ValueError с текстом ошибки для клиента.'''
+    side = body.get('side')
+    order_type = body.get('type', 'limit')
+    if side not in SIDES or order_type not in ORDER_TYPES:
+        raise ValueError('side must be buy or sell, type limit or market')
+    try:
+        order = {
+            'user_id': int(body['user_id']),
+            'company_id': int(body['company_id']),
+            'shares': int(body['shares']),
+            'side': side,
+            'order_type': order_type,
+            'price': Decimal(str(body['price'])).quantize(CENT, ROUND_HALF_UP) if order_type == 'limit' else None
+        }
+    except (KeyError, TypeError, ArithmeticError, ValueError):
+        raise ValueError('Invalid order parameters')
+    if not 0 < order['shares'] <= MAX_SHARES or (order['price'] is not None and order['price'] < MIN_PRICE):
+        raise ValueError('Invalid order parameters')
+    return order
+
+
+def _amount(price: Decimal, shares: int) -> int:
+    return int((price * shares).quantize(Decimal(1), ROUND_HALF_UP))
+
+
+def _write(cur: Any, sql: str, rows: List[Any], template: Optional[str] = None) -> None:
+    '''Пакетная запись одним запросом (execute_values иначе режет по 100 строк).'''
+    db.execute_values(cur, sql, rows, template=template, page_size=len(rows))
+
+
+def _lock(cur: Any, company_id: int) -> None:
+    cur.execute('SELECT pg_advisory_xact_lock(hashtext(%s), %s)', (LOCK_KEY, company_id))
+
+
+def place(cur: Any, order: Dict[str, Any]) -> int:
+    '''
+    Резервирует средства (покупка) или акции (продажа) и ставит заявку в очередь.
+    Возвращает id заявки. Бросает UnknownCompany, PriceOutOfBand,
+    InsufficientShares или ошибки ledger; фиксирует транзакцию вызывающий код.
+    '''
+    cur.execute('SELECT current_price FROM companies WHERE id = %s', (order['company_id'],))
+    company = cur.fetchone()
+    if not company:
+        raise UnknownCompany('Company not found')
+
+    current = Decimal(company[0])
+    price = order['price']
+    if price is not None:
+        if not current * (1 - LIMIT_BAND) <= price <= current * (1 + LIMIT_BAND):
+            raise PriceOutOfBand('Price out of band')
+    else:
+        if order['side'] == 'buy':
+            price = (current * (1 + MARKET_COLLAR)).quantize(CENT, ROUND_CEILING)
+        else:
+            price = max(MIN_PRICE, (current * (1 - MARKET_COLLAR)).quantize(CENT, ROUND_FLOOR))
+
+    reserved = 0
+    if order['side'] == 'buy':
+        reserved = int((price * order['shares']).to_integral_value(ROUND_CEILING))
+        ledger.post(cur, [(order['user_id'], -reserved, 'order_reserve',
+                           f"Резерв заявки: {order['shares']} шт. по {price}, компания #{order['company_id']}")])
+    else:
+        cur.execute('''
+            UPDATE user_stocks SET shares = shares - %s
+            WHERE user_id = %s AND company_id = %s AND shares >= %s
+            RETURNING id
+        ''', (order['shares'], order['user_id'], order['company_id'], order['shares']))
+        if not cur.fetchone():
+            raise InsufficientShares('Insufficient shares')
+
+    cur.execute('''
+        INSERT INTO stock_orders (user_id, company_id, side, order_type, price, shares, remaining, reserved)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING id
+    ''', (order['user_id'], order['company_id'], order['side'], order['order_type'], price,
+          order['shares'], order['shares'], reserved))
+    return cur.fetchone()[0]
+
+
+def _release(cur: Any, company_id: int, orders: List[Dict[str, Any]]) -> None:
+    '''Возвращает неиспользованный резерв закрытых заявок: звёзды покупателям, акции продавцам.'''
+    refunds = [(o['user_id'], o['reserved'], 'order_refund', f"Возврат резерва заявки #{o['id']}")
+               for o in orders if o['side'] == 'buy' and o['reserved'] > 0]
+    shares: Dict[int, int] = {}
+    for o in orders:
+        if o['side'] == 'sell' and o['remaining'] > 0:
+            shares[o['user_id']] = shares.get(o['user_id'], 0) + o['remaining']
+
+    if refunds:
+        ledger.post(cur, refunds)
+    if shares:
+        _write(cur, RETURN_SHARES_SQL, [(u, company_id, n) for u, n in sorted(shares.items())],
+               '(%s::int, %s::int, %s::int)')
+
+
+def cancel(cur: Any, user_id: int, order_id: int) -> Optional[Dict[str, Any]]:
+    '''Снимает открытую или ожидающую заявку пользователя; None, если снимать нечего.'''
+    cur.execute('SELECT company_id FROM stock_orders WHERE id = %s AND user_id = %s', (order_id, user_id))
+    row = cur.fetchone()
+    if not row:
+        return None
+    company_id = row[0]
+    _lock(cur, company_id)
+
+    cur.execute(f'''
+        WITH target AS (
+            SELECT {ORDER_COLUMNS} FROM stock_orders
+            WHERE id = %s AND status IN ('new', 'open')
+            FOR UPDATE
+        )
+        UPDATE stock_orders o SET status = 'cancelled', reserved = 0, updated_at = CURRENT_TIMESTAMP
+        FROM target t
+        WHERE o.id = t.id
+        RETURNING t.id, t.user_id, t.side, t.order_type, t.price, t.remaining, t.reserved
+    ''', (order_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+
+    order = dict(zip(('id', 'user_id', 'side', 'order_type', 'price', 'remaining', 'reserved'), row))
+    _release(cur, company_id, [order])
+    return order
+
+
+class _BookSide:
+    '''Сторона книги: куча загруженных заявок и граница уже прочитанной части индекса.'''
+
+    def __init__(self, cur: Any, company_id: int, side: str):
+        self.cur = cur
+        self.company_id = company_id
+        self.side = side
+        self.heap: List[Tuple[Tuple[Decimal, int], Dict[str, Any]]] = []
+        self.frontier = START_KEYS[side]
+        self.exhausted = False
+
+    def key(self, order: Dict[str, Any]) -> Tuple[Decimal, int]:
+        return (order['price'] if self.side == 'sell' else -order['price'], order['id'])
+
+    def push(self, order: Dict[str, Any]) -> None:
+        heapq.heappush(self.heap, (self.key(order), order))
+
+    def best(self) -> Optional[Dict[str, Any]]:
+        '''Лучшая заявка стороны с остатком; дочитывает индекс, пока куча не покрывает его начало.'''
+        while True:
+            while self.heap and self.heap[0][1]['status'] != 'open':
+                heapq.heappop(self.heap)
+            if self.exhausted or (self.heap and self.heap[0][0] <= self.frontier):
+                return self.heap[0][1] if self.heap else None
+            self._load()
+
+    def _load(self) -> None:
+        self.cur.execute(PAGE_SQL[self.side], (self.company_id, *self.frontier, PAGE_ROWS))
+        names = [column.name for column in self.cur.description]
+        rows = self.cur.fetchall()
+        for row in rows:
+            order = dict(zip(names, row))
+            order['status'] = 'open'
+            self.push(order)
+        if rows:
+            self.frontier = self.key(dict(zip(names, rows[-1])))
+        self.exhausted = len(rows) < PAGE_ROWS
+
+
+class _Batch:
+    '''Сведение одной пачки заявок компании в памяти и запись результата.'''
+
+    def __init__(self, cur: Any, company_id: int):
+        self.cur = cur
+        self.company_id = company_id
+        self.book = {side: _BookSide(cur, company_id, side) for side in SIDES}
+        self.changed: Dict[int, Dict[str, Any]] = {}
+        self.closed: List[Dict[str, Any]] = []
+        self.trades: List[Tuple[Dict[str, Any], Dict[str, Any], Decimal, int, int]] = []
+
+    def submit(self, order: Dict[str, Any]) -> None:
+        opposite = self.book['sell' if order['side'] == 'buy' else 'buy']
+        while order['remaining'] > 0:
+            resting = opposite.best()
+            if resting is None:
+                break
+            if order['side'] == 'buy' and resting['price'] > order['price']:
+                break
+            if order['side'] == 'sell' and resting['price'] < order['price']:
+                break
+            # Самосделка: снимаем стоящую заявку, её резерв вернёт _release
+            if resting['user_id'] == order['user_id']:
+                self.changed[resting['id']] = resting
+                self._close(resting, 'cancelled')
+                continue
+
+            shares = min(order['remaining'], resting['remaining'])
+            buy, sell = (order, resting) if order['side'] == 'buy' else (resting, order)
+            amount = min(_amount(resting['price'], shares), buy['reserved'])
+            buy['reserved'] -= amount
+            order['remaining'] -= shares
+            resting['remaining'] -= shares
+            self.trades.append((buy, sell, resting['price'], shares, amount))
+
+            self.changed[resting['id']] = resting
+            if resting['remaining'] == 0:
+                self._close(resting, 'filled')
+
+        self.changed[order['id']] = order
+        if order['remaining'] == 0:
+            self._close(order, 'filled')
+        elif order['order_type'] == 'market':
+            self._close(order, 'cancelled')
+        else:
+            order['status'] = 'open'
+            self.book[order['side']].push(order)
+
+    def _close(self, order: Dict[str, Any], status: str) -> None:
+        order['status'] = status
+        self.closed.append(dict(order))
+        order['reserved'] = 0
+
+    def flush(self, at: datetime) -> None:
+        cur = self.cur
+        if self.changed:
+            _write(cur, UPDATE_ORDERS_SQL, [
+                (o['id'], o['status'], o['remaining'], o['reserved'], at) for o in self.changed.values()
+            ], UPDATE_ORDERS_TEMPLATE)
+
+        if self.trades:
+            # Строка компании блокируется до позиций (и их сводок портфелей) —
+            # в том же порядке, что и у тика движка цен. current_price не
+            # трогаем: по нему исполняются мгновенные buy/sell.
+            cur.execute('UPDATE companies SET last_trade_price = %s WHERE id = %s',
+                        (self.trades[-1][2], self.company_id))
+            candles.record_prints(cur, self.company_id, [(t[2], t[3]) for t in self.trades], at)
+
+            _write(cur, INSERT_TRADES_SQL, [
+                (self.company_id, buy['id'], sell['id'], buy['user_id'], sell['user_id'], price, shares, amount, at)
+                for buy, sell, price, shares, amount in self.trades
+            ])
+            _write(cur, INSERT_TRANSACTIONS_SQL, [
+                row
+                for buy, sell, price, shares, amount in self.trades
+                for row in ((buy['user_id'], self.company_id, 'buy', shares, price, amount, at),
+                            (sell['user_id'], self.company_id, 'sell', shares, price, amount, at))
+            ])
+
+            positions: Dict[int, List[Any]] = {}
+            for buy, _, price, shares, _ in self.trades:
+                position = positions.setdefault(buy['user_id'], [0, Decimal(0)])
+                position[0] += shares
+                position[1] += price * shares
+            _write(cur, ADD_POSITIONS_SQL, [
+                (user_id, self.company_id, shares, cost) for user_id, (shares, cost) in sorted(positions.items())
+            ], ADD_POSITIONS_TEMPLATE)
+
+            ledger.post(cur, [
+                (sell['user_id'], amount, 'stock_sell', f'Продажа акций по заявке #{sell["id"]}: {shares} шт. по {price}')
+                for buy, sell, price, shares, amount in self.trades if amount > 0
+            ])
+
+        _release(cur, self.company_id, self.closed)
+
+
+def run(conn: Any, company_id: int, batch_size: int = BATCH_ORDERS) -> Dict[str, int]:
+    '''Сводит одну пачку очереди компании в транзакции conn и фиксирует её.'''
+    at = datetime.now()
+    with conn.cursor() as cur:
+        _lock(cur, company_id)
+        cur.execute(QUEUE_SQL, (company_id, batch_size))
+        names = [column.name for column in cur.description]
+        incoming = [dict(zip(names, row)) for row in cur.fetchall()]
+
+        batch = _Batch(cur, company_id)
+        for order in incoming:
+            batch.submit(order)
+        batch.flush(at)
+    conn.commit()
+    return {'orders': len(incoming), 'trades': len(batch.trades)}
+
+
+def drain(conn: Any, company_id: int, max_batches: int = 20) -> Dict[str, int]:
+    '''Сводит очередь компании пачками, пока она не опустеет (не больше max_batches пачек).'''
+    total = {'orders': 0, 'trades': 0}
+    for _ in range(max_batches):
+        result = run(conn, company_id)
+        total['orders'] += result['orders']
+        total['trades'] += result['trades']
+        if result['orders'] < BATCH_ORDERS:
+            break
+    return total
+
+
+def depth(cur: Any, company_id: int, levels: int) -> Dict[str, List[Any]]:
+    '''Агрегированные уровни книги: не больше levels цен с каждой стороны.'''
+    book = {}
+    for side, name in (('buy', 'bids'), ('sell', 'asks')):
+        cur.execute(DEPTH_SQL[side], (company_id, levels * 20, levels))
+        book[name] = [{'price': float(price), 'shares': int(shares), 'orders': orders}
+                      for price, shares, orders in cur.fetchall()]
+    return book
+
+
+def drain_all(conn: Any) -> Dict[str, int]:
+    with conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT company_id FROM stock_orders WHERE status = 'new'")
+        company_ids = [row[0] for row in cur.fetchall()]
+    conn.commit()
+
+    total = {'orders': 0, 'trades': 0}
+    for company_id in company_ids:
+        result = drain(conn, company_id)
+        total['orders'] += result['orders']
+        total['trades'] += result['trades']
+    return total
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Stock order matching engine')
+    parser.add_argument('--interval', type=float, default=0.2, help='seconds between passes when idle')
+    parser.add_argument('--once', action='store_true', help='drain the queues once and exit')
+    args = parser.parse_args()
+
+    while True:
+        started = time.monotonic()
+        with db.connection() as conn:
+            total = drain_all(conn)
+        if total['orders']:
+            print(f"{total['orders']} orders, {total['trades']} trades in {(time.monotonic() - started) * 1000:.1f} ms")
+        if args.once:
+            return
+        if not total['orders']:
+            time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
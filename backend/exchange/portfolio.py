@@ -0,0 +1,172 @@
+'''
+Сводки портфелей (portfolio_summaries): стоимость по цене оценки,
+себестоимость и число позиций на пользователя. Сделки меняют сводку
+триггером на user_stocks, тик движка цен переоценивает держателей
+изменившихся компаний (reprice) и пересобирает топ (refresh_leaderboard).
+Чтение сводки — один поиск по PK вместо join позиций с компаниями.
+Сверка с точным пересчётом: python portfolio.py [--fix]
+'''
+
+import json
+from decimal import Decimal
+from typing import Any, Dict, List, Sequence, Tuple
+
+import db
+
+LEADERBOARD_SIZE = 100
+
+# metric -> выражение сортировки топа
+LEADERBOARD_METRICS = {
+    'value': 'market_value',
+    'pnl': 'market_value - cost_basis'
+}
+
+# Держатели блокируются в порядке user_id, как и в триггере позиций
+REPRICE_SQL = '''
+    WITH moved (company_id, delta) AS (
+        VALUES %s
+    ),
+    deltas AS (
+        SELECT us.user_id, SUM(us.shares * m.delta) AS delta
+        FROM user_stocks us
+        JOIN moved m ON m.company_id = us.company_id
+        WHERE us.shares <> 0 AND us.user_id IS NOT NULL
+        GROUP BY us.user_id
+    ),
+    locked AS (
+        SELECT p.user_id
+        FROM portfolio_summaries p
+        WHERE p.user_id IN (SELECT user_id FROM deltas)
+        ORDER BY p.user_id
+        FOR UPDATE
+    )
+    UPDATE portfolio_summaries p
+    SET market_value = p.market_value + d.delta, updated_at = CURRENT_TIMESTAMP
+    FROM deltas d
+    JOIN locked l ON l.user_id = d.user_id
+    WHERE p.user_id = d.user_id
+'''
+
+# Ранги считаются по уже отобранному top-N (сортировка top-N, а не всей таблицы)
+LEADERBOARD_SQL = ' UNION ALL '.join(f'''
+    SELECT '{metric}', row_number() OVER (ORDER BY {expr} DESC, user_id), user_id, market_value, cost_basis
+    FROM (
+        SELECT user_id, market_value, cost_basis
+        FROM portfolio_summaries
+        WHERE positions > 0
+        ORDER BY {expr} DESC, user_id
+        LIMIT %(limit)s
+    ) top_{metric}
+''' for metric, expr in LEADERBOARD_METRICS.items())
+
+SUMMARY_SQL = '''
+    SELECT market_value, cost_basis, market_value - cost_basis AS unrealized_pnl, positions, updated_at
+    FROM portfolio_summaries
+    WHERE user_id = %s
+'''
+
+EXACT_SQL = '''
+    SELECT us.user_id,
+           SUM(COALESCE(us.shares, 0) * COALESCE(c.mark_price, 0)) AS market_value,
+           SUM(COALESCE(us.shares, 0) * COALESCE(us.avg_purchase_price, 0)) AS cost_basis,
+           COUNT(*) FILTER (WHERE us.shares > 0) AS positions
+    FROM user_stocks us
+    JOIN companies c ON c.id = us.company_id
+    WHERE us.user_id IS NOT NULL
+    GROUP BY us.user_id
+'''
+
+EMPTY_SUMMARY = {'market_value': 0, 'cost_basis': 0, 'unrealized_pnl': 0, 'positions': 0, 'updated_at': None}
+
+
+def reprice(cur: Any, moved: Sequence[Tuple[int, Decimal]]) -> int:
+    '''moved — (company_id, новая цена оценки − старая); возвращает число переоценённых сводок.'''
+    moved = [(company_id, delta) for company_id, delta in moved if delta]
+    if not moved:
+        return 0
+    db.execute_values(cur, REPRICE_SQL, moved, template='(%s::int, %s::numeric)', page_size=len(moved))
+    return cur.rowcount
+
+
+def refresh_leaderboard(cur: Any, size: int = LEADERBOARD_SIZE) -> None:
+    cur.execute('DELETE FROM portfolio_leaderboard')
+    cur.execute(f'''
+        INSERT INTO portfolio_leaderboard (metric, rank, user_id, market_value, cost_basis)
+        {LEADERBOARD_SQL}
+    ''', {'limit': size})
+
+
+def summary(cur: Any, user_id: int) -> Dict[str, Any]:
+    cur.execute(SUMMARY_SQL, (user_id,))
+    row = cur.fetchone()
+    if not row:
+        return dict(EMPTY_SUMMARY)
+    names = [column.name for column in cur.description]
+    return dict(zip(names, row))
+
+
+def reconcile(conn: Any, fix: bool = False) -> List[Dict[str, Any]]:
+    '''Сравнивает сводки с точным пересчётом; с fix переписывает расходящиеся строки.'''
+    conn.set_session(isolation_level='REPEATABLE READ')
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'''
+                SELECT COALESCE(e.user_id, p.user_id) AS user_id,
+                       COALESCE(e.market_value, 0) AS market_value,
+                       COALESCE(e.cost_basis, 0) AS cost_basis,
+                       COALESCE(e.positions, 0) AS positions,
+                       p.market_value AS cached_market_value,
+                       p.cost_basis AS cached_cost_basis,
+                       p.positions AS cached_positions
+                FROM ({EXACT_SQL}) e
+                FULL JOIN portfolio_summaries p ON p.user_id = e.user_id
+                WHERE p.user_id IS NULL
+                   OR ROUND(COALESCE(e.market_value, 0), 2) <> p.market_value
+                   OR ROUND(COALESCE(e.cost_basis, 0), 2) <> p.cost_basis
+                   OR COALESCE(e.positions, 0) <> p.positions
+                ORDER BY 1
+            ''')
+            names = [column.name for column in cur.description]
+            drift = [dict(zip(names, row)) for row in cur.fetchall()]
+        conn.commit()
+    finally:
+        conn.set_session(isolation_level='DEFAULT')
+
+    if fix and drift:
+        user_ids = [row['user_id'] for row in drift]
+        with conn.cursor() as cur:
+            cur.execute('LOCK TABLE user_stocks IN SHARE MODE')
+            cur.execute('''
+                DELETE FROM portfolio_summaries
+                WHERE user_id = ANY(%s) AND user_id NOT IN (SELECT user_id FROM user_stocks WHERE user_id IS NOT NULL)
+            ''', (user_ids,))
+            cur.execute(f'''
+                INSERT INTO portfolio_summaries (user_id, market_value, cost_basis, positions)
+                SELECT e.user_id, e.market_value, e.cost_basis, e.positions
+                FROM ({EXACT_SQL}) e
+                WHERE e.user_id = ANY(%s)
+                ORDER BY e.user_id
+                ON CONFLICT (user_id) DO UPDATE SET
+                    market_value = EXCLUDED.market_value, cost_basis = EXCLUDED.cost_basis,
+                    positions = EXCLUDED.positions, updated_at = CURRENT_TIMESTAMP
+            ''', (user_ids,))
+        conn.commit()
+    return drift
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Reconcile portfolio summaries with user_stocks')
+    parser.add_argument('--fix', action='store_true', help='rewrite drifted summaries')
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        drift = reconcile(conn, args.fix)
+    print(json.dumps(drift, indent=2, default=str))
+    if drift and not args.fix:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
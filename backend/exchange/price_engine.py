@@ -0,0 +1,215 @@
+'''
+Движок цен акций: один тик пересчитывает current_price всех компаний
+по их price_factor. Активность считается инкрементально — по строкам
+с id больше сохранённого водяного знака, поэтому стоимость тика зависит
+от числа новых событий, а не от размера истории. Изменение за тик
+пропорционально времени с прошлого тика, поэтому дневной ход цены не
+зависит от частоты тиков. Новая цена становится
+и ценой оценки портфелей (mark_price): держатели изменившихся компаний
+переоцениваются, топ портфелей пересобирается.
+Запуск: python price_engine.py [--interval 60] [--ticks N]
+или POST action=tick в функцию exchange (для планировщика).
+'''
+
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Any, Dict, List, Optional
+
+import candles
+import db
+import portfolio
+
+FACTOR_SOURCES: Dict[str, str] = {
+    'user_count': 'users',
+    'transaction_count': 'balance_transactions',
+    'task_completion': 'user_tasks',
+    'roulette_activity': 'roulette_history',
+    'p2p_trades': 'gift_history'
+}
+
+# gift_history пишут и покупки в магазине и дропах; фактору нужны только
+# P2P-сделки (частичный индекс idx_gift_history_p2p_id)
+FACTOR_FILTERS: Dict[str, str] = {
+    'p2p_trades': "transaction_type = 'p2p_sale'"
+}
+
+# Скорости в час: % роста при насыщении, событий в час для половины
+# насыщения, % дрейфа вниз без активности
+SENSITIVITY = Decimal('2.0')
+HALF_SATURATION = Decimal('20')
+DECAY = Decimal('0.05')
+HOUR = Decimal(3600)
+# Первый тик и тик после простоя считаются не длиннее этого
+DEFAULT_ELAPSED = timedelta(minutes=1)
+MAX_ELAPSED = timedelta(hours=1)
+MIN_PRICE = Decimal('1.00')
+CENT = Decimal('0.01')
+
+LOCK_KEY = 'price_engine'
+
+
+def factor_change(activity: int, elapsed: timedelta) -> Decimal:
+    '''
+    Процент изменения цены за тик длиной elapsed: скорость насыщается при
+    всплесках активности и слабо дрейфует вниз без неё.
+    '''
+    hours = Decimal(elapsed.total_seconds()) / HOUR
+    if hours <= 0:
+        return Decimal(0)
+    rate = Decimal(activity) / hours
+    return (SENSITIVITY * rate / (rate + HALF_SATURATION) - DECAY) * hours
+
+
+def event_affects(event: Dict[str, Any], ticker: str) -> bool:
+    affected = (event.get('affected_companies') or '').strip()
+    if not affected or affected.lower() == 'all':
+        return True
+    return ticker.upper() in {t.strip().upper() for t in affected.split(',')}
+
+
+def read_activity(cur: Any) -> Dict[str, Dict[str, int]]:
+    cur.execute('SELECT factor, last_seen_id FROM price_engine_state')
+    watermarks = {row['factor']: row['last_seen_id'] for row in cur.fetchall()}
+
+    # Фактор, чья таблица ещё не создана миграциями, не сдвигает цену и не
+    # роняет общий UNION ALL; водяной знак появится с первой строкой таблицы
+    cur.execute('SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NOT NULL',
+                (sorted(set(FACTOR_SOURCES.values())),))
+    existing = {row['name'] for row in cur.fetchall()}
+
+    parts = []
+    args: List[Any] = []
+    for factor, table in FACTOR_SOURCES.items():
+        if table not in existing:
+            continue
+        parts.append(
+            f'SELECT %s AS factor, COUNT(*) AS activity, MAX(id) AS max_id, %s AS initialized '
+            f'FROM {table} WHERE id > %s'
+            + (f' AND {FACTOR_FILTERS[factor]}' if factor in FACTOR_FILTERS else '')
+        )
+        args.extend([factor, factor in watermarks, watermarks.get(factor, 0)])
+    if not parts:
+        return {}
+    cur.execute(' UNION ALL '.join(parts), args)
+
+    activity = {}
+    for row in cur.fetchall():
+        last_seen = watermarks.get(row['factor'], 0)
+        max_id = row['max_id'] if row['max_id'] is not None else last_seen
+        activity[row['factor']] = {
+            'activity': row['activity'] if row['initialized'] else 0,
+            'last_seen_id': max_id
+        }
+    return activity
+
+
+def run_tick(conn: Any, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    '''Выполняет один тик в транзакции conn. Возвращает новые цены или [] если тик уже идёт.'''
+    now = now or datetime.now()
+    today = now.date()
+
+    with db.dict_cursor(conn) as cur:
+        cur.execute('SELECT pg_try_advisory_xact_lock(hashtext(%s)) AS locked', (LOCK_KEY,))
+        if not cur.fetchone()['locked']:
+            conn.rollback()
+            return []
+
+        activity = read_activity(cur)
+
+        cur.execute('''
+            SELECT id, affected_companies, impact_percentage
+            FROM market_events
+            WHERE is_active = TRUE AND applied_at IS NULL
+              AND starts_at <= %s AND (ends_at IS NULL OR ends_at > %s)
+        ''', (now, now))
+        events = cur.fetchall()
+
+        cur.execute('''
+            SELECT id, ticker, price_factor, current_price, mark_price, day_open_price, day_open_date, last_tick_at
+            FROM companies
+            ORDER BY id
+            FOR UPDATE
+        ''')
+        companies = cur.fetchall()
+
+        last_tick = max((c['last_tick_at'] for c in companies if c['last_tick_at']), default=None)
+        elapsed = min(max(now - last_tick, timedelta(0)), MAX_ELAPSED) if last_tick else DEFAULT_ELAPSED
+        changes = {factor: factor_change(a['activity'], elapsed) for factor, a in activity.items()}
+        # Среднее по факторам, чьи таблицы есть: пропущенный не тянет combined к нулю
+        changes['combined'] = sum(changes.values(), Decimal(0)) / len(changes) if changes else Decimal(0)
+
+        updates = []
+        history = []
+        moved = []
+        for company in companies:
+            price = Decimal(company['current_price'])
+            pct = changes.get(company['price_factor'], Decimal(0))
+            for event in events:
+                if event_affects(event, company['ticker']):
+                    pct += Decimal(event['impact_percentage'] or 0)
+
+            new_price = max(MIN_PRICE, (price * (1 + pct / 100)).quantize(CENT, ROUND_HALF_UP))
+
+            day_open = company['day_open_price']
+            if company['day_open_date'] != today or not day_open:
+                day_open = price
+            change_percent = ((new_price - day_open) / day_open * 100).quantize(CENT, ROUND_HALF_UP)
+
+            updates.append((company['id'], new_price, change_percent, day_open, today, now))
+            history.append((company['id'], new_price, now))
+            moved.append((company['id'], new_price - Decimal(company['mark_price'] or price)))
+
+        if updates:
+            db.execute_values(cur, '''
+                UPDATE companies c
+                SET current_price = v.price, mark_price = v.price, change_percent = v.change_percent,
+                    day_open_price = v.day_open_price, day_open_date = v.day_open_date,
+                    last_tick_at = v.tick_at
+                FROM (VALUES %s) AS v(id, price, change_percent, day_open_price, day_open_date, tick_at)
+                WHERE c.id = v.id
+            ''', updates, template='(%s, %s::numeric, %s::numeric, %s::numeric, %s::date, %s::timestamp)')
+
+            db.execute_values(cur, '''
+                INSERT INTO stock_price_history (company_id, price, recorded_at) VALUES %s
+            ''', history)
+            candles.record_prices(cur, history)
+            portfolio.reprice(cur, moved)
+            portfolio.refresh_leaderboard(cur)
+
+        if activity:
+            db.execute_values(cur, '''
+                INSERT INTO price_engine_state (factor, last_seen_id, updated_at) VALUES %s
+                ON CONFLICT (factor) DO UPDATE
+                SET last_seen_id = EXCLUDED.last_seen_id, updated_at = EXCLUDED.updated_at
+            ''', [(factor, a['last_seen_id'], now) for factor, a in activity.items()])
+
+        if events:
+            cur.execute('UPDATE market_events SET applied_at = %s WHERE id = ANY(%s)',
+                        (now, [e['id'] for e in events]))
+
+    conn.commit()
+    return [{'company_id': u[0], 'price': u[1], 'change_percent': u[2]} for u in updates]
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Stock price engine')
+    parser.add_argument('--interval', type=float, default=60.0, help='seconds between ticks')
+    parser.add_argument('--ticks', type=int, default=1, help='number of ticks, 0 runs forever')
+    args = parser.parse_args()
+
+    done = 0
+    while args.ticks == 0 or done < args.ticks:
+        started = time.monotonic()
+        with db.connection() as conn:
+            prices = run_tick(conn)
+        done += 1
+        print(f'tick {done}: {len(prices)} companies in {(time.monotonic() - started) * 1000:.1f} ms')
+        if args.ticks == 0 or done < args.ticks:
+            time.sleep(max(0.0, args.interval - (time.monotonic() - started)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+'''
+Дропы подарков ограниченного тиража (gift_drops). Остаток — атомарный
+счётчик: take() списывает его одним условным UPDATE ... WHERE remaining >= n
+RETURNING первым шагом покупки, до списания звёзд и выпуска экземпляров,
+поэтому тираж нельзя перепродать, а покупка сверх остатка ничего не пишет.
+Купленное в fcfs копится в строке drop_intents покупателя, и лимит
+max_per_user проверяется по ней под той же блокировкой. Режимы queue и
+lottery не трогают счётчик при подаче: enter() резервирует звёзды и
+вставляет заявку, а allocate() под advisory-блокировкой дропа раздаёт тысячи заявок за
+проход — одно обновление счётчика, один выпуск экземпляров, один возврат
+резервов. queue распределяется в порядке подачи сразу после неё, lottery —
+после closes_at в порядке md5(seed:id). Секретный seed создаётся вместе с
+дропом, его sha256 (seed_hash) публикуется сразу, а сам seed — после
+розыгрыша, так что порядок нельзя ни предсказать, ни подменить.
+Открыт ли дроп, решают часы базы (CURRENT_TIMESTAMP), а не функции.
+Запуск: python drops.py create --gift-id N --supply N [--mode ...] | allocate [--drop-id N]
+'''
+
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import db
+import ledger
+
+MODES = ('fcfs', 'queue', 'lottery')
+ALLOCATE_BATCH = 5000
+LOCK_KEY = 'gift_drops'
+
+# accepting и closed считаются по часам базы, как и в TAKE_SQL
+DROP_COLUMNS = '''id, gift_id, mode, price, supply, remaining, max_per_user, status, starts_at, closes_at,
+    starts_at <= CURRENT_TIMESTAMP AND (closes_at IS NULL OR closes_at > CURRENT_TIMESTAMP) AS accepting,
+    COALESCE(closes_at <= CURRENT_TIMESTAMP, FALSE) AS closed'''
+
+# Статус sold_out ставится тем же UPDATE, что забирает последний экземпляр
+TAKE_SQL = '''
+    UPDATE gift_drops
+    SET remaining = remaining - %(quantity)s,
+        status = CASE WHEN remaining = %(quantity)s THEN 'sold_out' ELSE status END
+    WHERE id = %(drop_id)s AND status = 'open' AND remaining >= %(quantity)s
+      AND starts_at <= CURRENT_TIMESTAMP AND (closes_at IS NULL OR closes_at > CURRENT_TIMESTAMP)
+    RETURNING remaining
+'''
+
+# Экземпляры и их провенанс для нескольких покупателей одним запросом
+MINT_SQL = '''
+    WITH minted AS (
+        INSERT INTO user_gifts (owner_id, gift_id, purchase_price)
+        SELECT v.user_id, v.gift_id, v.price
+        FROM (VALUES %s) AS v(user_id, gift_id, price, quantity)
+        CROSS JOIN LATERAL generate_series(1, v.quantity)
+        RETURNING id, owner_id, gift_id, purchase_price
+    )
+    INSERT INTO gift_history (gift_instance_id, gift_id, from_user_id, to_user_id, price, transaction_type)
+    SELECT id, gift_id, NULL, owner_id, purchase_price, 'drop_purchase'
+    FROM minted
+    RETURNING gift_instance_id, to_user_id
+'''
+
+# Строка покупателя блокируется до проверки лимита: повторные запросы
+# суммируются, а не проверяются каждый сам по себе
+RECORD_PURCHASE_SQL = '''
+    INSERT INTO drop_intents AS i (drop_id, user_id, quantity, allocated, status, allocated_at)
+    VALUES (%(drop_id)s, %(user_id)s, %(quantity)s, %(quantity)s, 'won', CURRENT_TIMESTAMP)
+    ON CONFLICT (drop_id, user_id) DO UPDATE SET
+        quantity = i.quantity + EXCLUDED.quantity,
+        allocated = i.allocated + EXCLUDED.allocated,
+        allocated_at = EXCLUDED.allocated_at
+    WHERE i.allocated + EXCLUDED.allocated <= %(max_per_user)s
+    RETURNING allocated
+'''
+
+RESOLVE_SQL = '''
+    UPDATE drop_intents i
+    SET status = v.status, allocated = v.allocated, allocated_at = CURRENT_TIMESTAMP
+    FROM (VALUES %s) AS v(id, status, allocated)
+    WHERE i.id = v.id
+'''
+
+# Порядок заявок в _pass: i — drop_intents, d — gift_drops
+INTENT_ORDER = {
+    'queue': 'i.id',
+    'lottery': "md5(d.seed || ':' || i.id), i.id"
+}
+
+
+class DropError(Exception):
+    pass
+
+
+class UnknownDrop(DropError):
+    pass
+
+
+class DropClosed(DropError):
+    pass
+
+
+class SoldOut(DropError):
+    pass
+
+
+class AlreadyEntered(DropError):
+    pass
+
+
+def get(cur: Any, drop_id: int) -> Optional[Dict[str, Any]]:
+    cur.execute(f'SELECT {DROP_COLUMNS} FROM gift_drops WHERE id = %s', (drop_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    names = [column.name for column in cur.description]
+    return dict(zip(names, row))
+
+
+def store_drop(cur: Any, gift_id: int) -> Optional[Dict[str, Any]]:
+    '''Постоянный fcfs-дроп лимитированного подарка магазина.'''
+    cur.execute(f'''
+        SELECT {DROP_COLUMNS} FROM gift_drops
+        WHERE gift_id = %s AND mode = 'fcfs' AND status IN ('open', 'sold_out')
+        ORDER BY id LIMIT 1
+    ''', (gift_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    names = [column.name for column in cur.description]
+    return dict(zip(names, row))
+
+
+def _check_open(drop: Dict[str, Any]) -> None:
+    if drop['status'] == 'sold_out' or drop['remaining'] <= 0:
+        raise SoldOut('Sold out')
+    if drop['status'] != 'open' or not drop['accepting']:
+        raise DropClosed('Drop is not open')
+
+
+def take(cur: Any, drop_id: int, quantity: int) -> int:
+    '''Списывает quantity из остатка; возвращает новый остаток или бросает SoldOut.'''
+    cur.execute(TAKE_SQL, {'drop_id': drop_id, 'quantity': quantity})
+    row = cur.fetchone()
+    if not row:
+        raise SoldOut('Sold out')
+    return row[0]
+
+
+def mint(cur: Any, gift_id: int, price: int, winners: Sequence[Tuple[int, int]]) -> List[int]:
+    '''winners — (user_id, количество); возвращает id выпущенных экземпляров.'''
+    if not winners:
+        return []
+    rows = db.execute_values(cur, MINT_SQL, [(user_id, gift_id, price, n) for user_id, n in winners],
+                             template='(%s::int, %s::int, %s::int, %s::int)', page_size=len(winners), fetch=True)
+    return [row[0] for row in rows]
+
+
+def purchase(cur: Any, drop: Dict[str, Any], user_id: int, quantity: int) -> List[int]:
+    '''
+    Покупка в fcfs-дропе по цене дропа: счётчик, лимит покупателя, списание,
+    выпуск. Любая ошибка оставляет записи, которые вызывающий откатывает.
+    '''
+    _check_open(drop)
+    if quantity > drop['max_per_user']:
+        raise DropError(f"At most {drop['max_per_user']} per user")
+    take(cur, drop['id'], quantity)
+    cur.execute(RECORD_PURCHASE_SQL, {'drop_id': drop['id'], 'user_id': user_id, 'quantity': quantity,
+                                      'max_per_user': drop['max_per_user']})
+    if not cur.fetchone():
+        raise DropError(f"At most {drop['max_per_user']} per user")
+    ledger.post(cur, [(user_id, -drop['price'] * quantity, 'drop_purchase', f"Покупка в дропе #{drop['id']}")])
+    return mint(cur, drop['gift_id'], drop['price'], [(user_id, quantity)])
+
+
+def enter(cur: Any, drop: Dict[str, Any], user_id: int, quantity: int) -> int:
+    '''Заявка в queue/lottery-дроп с резервом звёзд; возвращает id заявки.'''
+    _check_open(drop)
+    if quantity > drop['max_per_user']:
+        raise DropError(f"At most {drop['max_per_user']} per user")
+    cur.execute('''
+        INSERT INTO drop_intents (drop_id, user_id, quantity)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (drop_id, user_id) DO NOTHING
+        RETURNING id
+    ''', (drop['id'], user_id, quantity))
+    row = cur.fetchone()
+    if not row:
+        raise AlreadyEntered('Already entered this drop')
+    if drop['price']:
+        ledger.post(cur, [(user_id, -drop['price'] * quantity, 'drop_reserve', f"Резерв заявки в дропе #{drop['id']}")])
+    return row[0]
+
+
+def _pass(cur: Any, drop_id: int, batch: int) -> Optional[int]:
+    '''Один проход распределения; None — дроп сейчас не распределяется.'''
+    cur.execute(f'SELECT {DROP_COLUMNS} FROM gift_drops WHERE id = %s FOR UPDATE', (drop_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    drop = dict(zip([column.name for column in cur.description], row))
+    if drop['mode'] not in INTENT_ORDER:
+        return None
+    if drop['mode'] == 'lottery' and not drop['closed']:
+        return None
+
+    cur.execute(f'''
+        SELECT i.id, i.user_id, i.quantity
+        FROM drop_intents i JOIN gift_drops d ON d.id = i.drop_id
+        WHERE i.drop_id = %s AND i.status = 'pending'
+        ORDER BY {INTENT_ORDER[drop['mode']]}
+        LIMIT %s
+    ''', (drop_id, batch))
+    intents = cur.fetchall()
+
+    remaining = drop['remaining']
+    winners, resolved, refunds = [], [], []
+    for intent_id, user_id, quantity in intents:
+        allocated = min(quantity, remaining)
+        remaining -= allocated
+        if allocated:
+            winners.append((user_id, allocated))
+        resolved.append((intent_id, 'won' if allocated == quantity else 'partial' if allocated else 'lost', allocated))
+        if allocated < quantity and drop['price']:
+            refunds.append((user_id, drop['price'] * (quantity - allocated), 'drop_refund',
+                            f'Возврат резерва заявки #{intent_id} в дропе #{drop_id}'))
+
+    finished = len(intents) < batch and drop['closed']
+    status = 'allocated' if finished else 'sold_out' if remaining == 0 else drop['status']
+    if remaining != drop['remaining'] or status != drop['status']:
+        cur.execute('UPDATE gift_drops SET remaining = %s, status = %s WHERE id = %s', (remaining, status, drop_id))
+    mint(cur, drop['gift_id'], drop['price'], winners)
+    if resolved:
+        db.execute_values(cur, RESOLVE_SQL, resolved,
+                          template='(%s::bigint, %s, %s::int)', page_size=len(resolved))
+    if refunds:
+        ledger.post(cur, refunds)
+    return len(intents)
+
+
+def allocate(conn: Any, drop_id: int, batch: int = ALLOCATE_BATCH, max_batches: int = 1000) -> Dict[str, int]:
+    '''
+    Распределяет ожидающие заявки дропа пакетами. Если дроп уже распределяет
+    другой вызов, выходит сразу: тот после снятия блокировки перепроверит
+    очередь и заберёт заявки, поданные, пока он работал.
+    '''
+    total = {'batches': 0, 'intents': 0}
+    for _ in range(max_batches):
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_try_advisory_xact_lock(hashtext(%s), %s)', (LOCK_KEY, drop_id))
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return total
+            count = _pass(cur, drop_id, batch)
+        conn.commit()
+        if count:
+            total['batches'] += 1
+            total['intents'] += count
+            if count == batch:
+                continue
+
+        # Блокировка уже снята: заявка, чей автор не получил её, пока шёл
+        # проход, зафиксирована раньше и видна этой проверке
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT EXISTS (
+                    SELECT 1 FROM drop_intents i JOIN gift_drops d ON d.id = i.drop_id
+                    WHERE i.drop_id = %s AND i.status = 'pending'
+                      AND (d.mode = 'queue' OR d.closes_at <= CURRENT_TIMESTAMP)
+                )
+            ''', (drop_id,))
+            pending = cur.fetchone()[0]
+        conn.commit()
+        if not pending:
+            break
+    return total
+
+
+def allocate_due(conn: Any) -> Dict[str, Any]:
+    '''Распределение всех дропов с ожидающими заявками (очередь и закрывшиеся лотереи).'''
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT d.id FROM gift_drops d
+            WHERE d.mode IN ('queue', 'lottery') AND (d.mode = 'queue' OR d.closes_at <= CURRENT_TIMESTAMP)
+              AND EXISTS (SELECT 1 FROM drop_intents i WHERE i.drop_id = d.id AND i.status = 'pending')
+            ORDER BY d.id
+        ''')
+        drop_ids = [row[0] for row in cur.fetchall()]
+    conn.commit()
+    return {str(drop_id): allocate(conn, drop_id) for drop_id in drop_ids}
+
+
+def create(cur: Any, gift_id: int, supply: int, mode: str = 'fcfs', price: Optional[int] = None,
+           max_per_user: int = 1, starts_at: Optional[datetime] = None,
+           closes_at: Optional[datetime] = None) -> int:
+    import secrets
+
+    if mode not in MODES:
+        raise ValueError(f'mode must be one of {", ".join(MODES)}')
+    if mode == 'lottery' and closes_at is None:
+        raise ValueError('lottery drops need closes_at')
+    seed = secrets.token_hex(32) if mode == 'lottery' else None
+    seed_hash = hashlib.sha256(seed.encode('utf-8')).hexdigest() if seed else None
+    cur.execute('''
+        INSERT INTO gift_drops (gift_id, mode, price, supply, remaining, max_per_user, starts_at, closes_at,
+                                seed, seed_hash)
+        SELECT g.id, %s, COALESCE(%s, g.base_price), %s, %s, %s, COALESCE(%s, CURRENT_TIMESTAMP), %s, %s, %s
+        FROM gifts g WHERE g.id = %s
+        RETURNING id
+    ''', (mode, price, supply, supply, max_per_user, starts_at, closes_at, seed, seed_hash, gift_id))
+    row = cur.fetchone()
+    if not row:
+        raise UnknownDrop('Gift not found')
+    return row[0]
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Limited gift drops')
+    sub = parser.add_subparsers(dest='command', required=True)
+    create_parser = sub.add_parser('create', help='open a new drop')
+    create_parser.add_argument('--gift-id', type=int, required=True)
+    create_parser.add_argument('--supply', type=int, required=True)
+    create_parser.add_argument('--mode', choices=MODES, default='fcfs')
+    create_parser.add_argument('--price', type=int, help='default: gift base price')
+    create_parser.add_argument('--max-per-user', type=int, default=1)
+    create_parser.add_argument('--starts-at', type=datetime.fromisoformat)
+    create_parser.add_argument('--closes-at', type=datetime.fromisoformat)
+    allocate_parser = sub.add_parser('allocate', help='allocate pending queue/lottery intents')
+    allocate_parser.add_argument('--drop-id', type=int, help='default: every due drop')
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        if args.command == 'create':
+            with conn.cursor() as cur:
+                drop_id = create(cur, args.gift_id, args.supply, args.mode, args.price,
+                                 args.max_per_user, args.starts_at, args.closes_at)
+            conn.commit()
+            result: Dict[str, Any] = {'drop_id': drop_id}
+        elif args.drop_id:
+            result = allocate(conn, args.drop_id)
+        else:
+            result = allocate_due(conn)
+    print(json.dumps(result))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+'''
+Идемпотентность денежных POST по заголовку Idempotency-Key.
+Первый запрос с ключом вставляет строку idempotency_keys в свою же
+транзакцию: ключ фиксируется вместе с покупкой и откатывается вместе с
+ней. Ответ (статус и тело) дописывается в строку после обработчика;
+ответ с ошибкой — после отката, без частичных записей обработчика.
+Повтор находит ответ одним поиском по PK и возвращает его без повторного
+выполнения; параллельный дубль ждёт блокировку ключа, пока первый не
+завершится. Ключ с другим телом запроса — 422, ещё выполняемый — 409.
+Файл одинаков в функциях tasks, marketplace и exchange.
+Чистка просроченных ключей: python idempotency.py [--batch 10000]
+'''
+
+import functools
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict
+
+import api
+import db
+
+HEADER = 'idempotency-key'
+MAX_KEY_LENGTH = 255
+TTL = timedelta(hours=int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24')))
+DELETE_BATCH = 10000
+
+# Поля тела, в которых обработчики принимают пользователя
+USER_FIELDS = ('user_id', 'buyer_id')
+
+LOOKUP_SQL = '''
+    SELECT request_hash, status, response
+    FROM idempotency_keys
+    WHERE key = %s AND expires_at > %s
+'''
+
+# Просроченный ключ можно занять заново
+CLAIM_SQL = '''
+    INSERT INTO idempotency_keys (key, user_id, request_hash, expires_at)
+    VALUES (%s, %s, %s, %s)
+    ON CONFLICT (key) DO UPDATE SET
+        user_id = EXCLUDED.user_id, request_hash = EXCLUDED.request_hash,
+        status = NULL, response = NULL, expires_at = EXCLUDED.expires_at
+    WHERE idempotency_keys.expires_at <= %s
+    RETURNING key
+'''
+
+Handler = Callable[[api.Request], Dict[str, Any]]
+
+
+def request_hash(request: api.Request) -> bytes:
+    import hashlib
+
+    payload = json.dumps(request.body, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f'{request.method} {payload}'.encode('utf-8')).digest()
+
+
+def _replay(row: Any, digest: bytes) -> Dict[str, Any]:
+    stored_hash, status, response = row
+    if bytes(stored_hash) != digest:
+        return api.error(422, 'Idempotency-Key was used with a different request')
+    if status is None:
+        return api.error(409, 'Request with this Idempotency-Key is still in progress')
+    return api.respond(status, api.Raw(response), headers={**api.JSON_HEADERS, 'Idempotent-Replayed': 'true'})
+
+
+def idempotent(fn: Handler) -> Handler:
+    '''Декоратор обработчика: без заголовка Idempotency-Key вызывает его как есть.'''
+    @functools.wraps(fn)
+    def wrapper(request: api.Request) -> Dict[str, Any]:
+        key = request.headers.get(HEADER)
+        if not key:
+            return fn(request)
+        if len(key) > MAX_KEY_LENGTH:
+            return api.error(400, 'Invalid Idempotency-Key')
+
+        digest = request_hash(request)
+        now = datetime.now()
+        conn = request.conn
+        with conn.cursor() as cur:
+            cur.execute(LOOKUP_SQL, (key, now))
+            row = cur.fetchone()
+            if row:
+                conn.rollback()
+                return _replay(row, digest)
+
+            user_id = next((request.body[f] for f in USER_FIELDS if isinstance(request.body.get(f), int)), None)
+            cur.execute(CLAIM_SQL, (key, user_id, digest, now + TTL, now))
+            if not cur.fetchone():
+                # Ключ занял параллельный запрос и уже зафиксировал его
+                cur.execute(LOOKUP_SQL, (key, now))
+                row = cur.fetchone()
+                conn.rollback()
+                return _replay(row, digest) if row else api.error(409, 'Request with this Idempotency-Key is still in progress')
+
+        try:
+            response = fn(request)
+        except Exception:
+            request.conn.rollback()
+            raise
+
+        # Обработчик мог отдать соединение в пул: тогда незафиксированный ключ
+        # откатился вместе с ним, и ответ записывается на новом соединении
+        conn = request.conn
+        status = response.get('statusCode', 500)
+        if status >= 500 or response.get('isBase64Encoded'):
+            # Незафиксированный ключ откатывается; уже зафиксированный остаётся
+            # в статусе 409 до истечения, чтобы повтор не выполнил запрос дважды.
+            conn.rollback()
+            return response
+        if status >= 300:
+            # Записи обработчика до ошибки не фиксируются вместе с ответом
+            conn.rollback()
+
+        with conn.cursor() as cur:
+            cur.execute('''
+                UPDATE idempotency_keys SET status = %s, response = %s
+                WHERE key = %s
+            ''', (status, response.get('body', ''), key))
+            if not cur.rowcount:
+                # Ключ откатился вместе с транзакцией обработчика — записываем заново
+                cur.execute('''
+                    INSERT INTO idempotency_keys (key, user_id, request_hash, status, response, expires_at)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (key) DO NOTHING
+                ''', (key, user_id, digest, status, response.get('body', ''), now + TTL))
+        conn.commit()
+        return response
+
+    return wrapper
+
+
+def sweep(conn: Any, batch: int = DELETE_BATCH) -> int:
+    '''Удаляет просроченные ключи порциями; возвращает число удалённых строк.'''
+    deleted = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute('''
+                DELETE FROM idempotency_keys
+                WHERE key IN (SELECT key FROM idempotency_keys WHERE expires_at <= %s LIMIT %s)
+            ''', (datetime.now(), batch))
+            count = cur.rowcount
+        conn.commit()
+        deleted += count
+        if count < batch:
+            return deleted
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Delete expired idempotency keys')
+    parser.add_argument('--batch', type=int, default=DELETE_BATCH)
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        print(json.dumps({'deleted': sweep(conn, args.batch)}))
+
+
+if __name__ == '__main__':
+    main()
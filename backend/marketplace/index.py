@@ -5,312 +5,570 @@ Args: event - dict с httpMethod, body, queryStringParameters
 Returns: HTTP response dict с подарками, сделками и историей
 '''
 
-import json
+import hashlib
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import Dict, Any
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    
+import api
+import db
+import drops
+import idempotency
+import ledger
+
+CATALOG_MAX_AGE = int(os.environ.get('CATALOG_MAX_AGE', '60'))
+
+# Листинг блокируется первым, счета — внутри ledger.post в порядке user_id,
+# поэтому встречные покупки не взаимоблокируются.
+LOCK_LISTING_SQL = '''
+    SELECT ug.id, ug.gift_id, ug.owner_id AS seller_id, ug.sale_price
+    FROM user_gifts ug
+    WHERE ug.id = %s AND ug.is_on_sale = TRUE
+    FOR UPDATE
+'''
+
+TRANSFER_SQL = '''
+    WITH transfer AS (
+        UPDATE user_gifts SET owner_id = %(buyer_id)s, is_on_sale = FALSE, sale_price = NULL
+        WHERE id = %(user_gift_id)s
+        RETURNING id
+    )
+    INSERT INTO gift_history (gift_instance_id, gift_id, from_user_id, to_user_id, price, transaction_type)
+    VALUES (%(user_gift_id)s, %(gift_id)s, %(seller_id)s, %(buyer_id)s, %(price)s, 'p2p_sale')
+'''
+
+# Экземпляры из магазина начинают свою историю записью без продавца
+MINT_SQL = '''
+    WITH minted AS (
+        INSERT INTO user_gifts (owner_id, gift_id, purchase_price)
+        SELECT %(user_id)s, %(gift_id)s, %(price)s
+        FROM generate_series(1, %(quantity)s)
+        RETURNING id
+    )
+    INSERT INTO gift_history (gift_instance_id, gift_id, from_user_id, to_user_id, price, transaction_type)
+    SELECT id, %(gift_id)s, NULL, %(user_id)s, %(price)s, 'store_purchase'
+    FROM minted
+    RETURNING gift_instance_id
+'''
+
+# Окно объёма и VWAP; корзины часовые, поэтому окно округляется вниз до часа.
+# Считается в SQL по часам базы, как и корзины (date_trunc от created_at)
+MARKET_WINDOW = "interval '24 hours'"
+
+MAX_BATCH_ITEMS = 500
+MAX_PURCHASE_QUANTITY = 100
+
+# Лоты владельца блокируются в порядке id: встречные пакеты не взаимоблокируются
+LOCK_OWNED_SQL = '''
+    SELECT id FROM user_gifts
+    WHERE id = ANY(%s) AND owner_id = %s
+    ORDER BY id
+    FOR UPDATE
+'''
+
+# Цена NULL снимает лот; владелец проверяется в самом UPDATE
+UPDATE_LISTINGS_SQL = '''
+    UPDATE user_gifts ug
+    SET is_on_sale = v.sale_price IS NOT NULL, sale_price = v.sale_price
+    FROM (VALUES %s) AS v(user_gift_id, sale_price, owner_id)
+    WHERE ug.id = v.user_gift_id AND ug.owner_id = v.owner_id
+    RETURNING ug.id, ug.sale_price
+'''
+
+HISTORY_LIMIT = 20
+HISTORY_MAX_LIMIT = 100
+
+# Агрегаты по подарку; среднее считается из объёма, а не подзапросом по истории
+TRADE_STATS_SQL = '''
+    SELECT trade_count, last_price, min_price, max_price,
+           ROUND(volume::numeric / NULLIF(trade_count, 0), 2) AS avg_price, last_trade_at
+    FROM gift_trade_stats
+    WHERE gift_id = %s
+'''
+
+_catalog_cache: Dict[str, Any] = {'body': None, 'etag': None, 'version': None}
+_catalog_lock = threading.Lock()
+
+router = api.Router('GET, POST, PUT, OPTIONS', 'Content-Type, X-User-Id, Idempotency-Key',
+                    default_actions={'GET': 'list'})
+
+
+def get_catalog(conn: Any) -> Tuple[str, str]:
+    '''Каталог из памяти, пока версия 'gifts' в cache_versions не изменилась.'''
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM cache_versions WHERE key = 'gifts'")
+        row = cur.fetchone()
+        version = row[0] if row else 0
+
+        with _catalog_lock:
+            if _catalog_cache['body'] is not None and _catalog_cache['version'] == version:
+                return _catalog_cache['body'], _catalog_cache['etag']
+
+        cur.execute('''
+            SELECT id, name, description, emoji as image, base_price as price, rarity as category
+            FROM gifts
+            ORDER BY base_price ASC
+        ''')
+        body = api.dumps({'success': True, 'gifts': api.rows_json(cur)})
+
+    etag = '"' + hashlib.sha1(body.encode('utf-8')).hexdigest()[:20] + '"'
+
+    with _catalog_lock:
+        _catalog_cache.update(body=body, etag=etag, version=version)
+    return body, etag
+
+
+@router.route('GET', 'store_gifts')
+def store_gifts(request: api.Request) -> Dict[str, Any]:
+    body, etag = get_catalog(request.conn)
+    if_none_match = request.headers.get('if-none-match', '')
+
+    headers = {
+        **api.JSON_HEADERS,
+        'Access-Control-Expose-Headers': 'ETag',
+        'Cache-Control': f'public, max-age={CATALOG_MAX_AGE}, stale-while-revalidate={CATALOG_MAX_AGE * 5}',
+        'ETag': etag
+    }
+
+    if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+        return api.respond(304, headers=headers)
+
+    return api.respond(200, api.Raw(body), headers=headers)
+
+
+@router.route('GET', 'list')
+def list_items(request: api.Request) -> Dict[str, Any]:
+    params = request.query
+    conditions = ['ug.is_on_sale = TRUE']
+    args = []
+
+    try:
+        limit = min(max(int(params.get('limit', 20)), 1), 100)
+
+        if params.get('gift_id'):
+            conditions.append('ug.gift_id = %s')
+            args.append(int(params['gift_id']))
+        if params.get('rarity'):
+            conditions.append('g.rarity = %s')
+            args.append(params['rarity'])
+        if params.get('min_price'):
+            conditions.append('ug.sale_price >= %s')
+            args.append(int(params['min_price']))
+        if params.get('max_price'):
+            conditions.append('ug.sale_price <= %s')
+            args.append(int(params['max_price']))
+        if params.get('seller_id'):
+            conditions.append('ug.owner_id = %s')
+            args.append(int(params['seller_id']))
+        if params.get('cursor'):
+            cursor_price, cursor_id = (int(v) for v in params['cursor'].split(':'))
+            conditions.append('(ug.sale_price, ug.id) > (%s, %s)')
+            args.extend([cursor_price, cursor_id])
+    except ValueError:
+        return api.error(400, 'Invalid list parameters')
+
+    with request.conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT ug.id as user_gift_id, ug.sale_price, ug.purchased_at,
+                   g.*, u.username as seller_name,
+                   COALESCE(s.trade_count, 0) as transaction_count
+            FROM user_gifts ug
+            JOIN gifts g ON ug.gift_id = g.id
+            JOIN users u ON ug.owner_id = u.id
+            LEFT JOIN gift_trade_stats s ON s.gift_id = ug.gift_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY ug.sale_price ASC, ug.id ASC
+            LIMIT %s
+        ''', (*args, limit + 1))
+        items = cur.fetchall()
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = f'{items[-1][1]}:{items[-1][0]}'
+
+        return api.ok(items=api.rows_json(cur, items), next_cursor=next_cursor)
+
+
+@router.route('GET', 'market_summary')
+def market_summary(request: api.Request) -> Dict[str, Any]:
+    conditions = []
+    args: List[Any] = []
+    try:
+        if request.query.get('gift_id'):
+            conditions.append('g.id = %s')
+            args.append(int(request.query['gift_id']))
+    except ValueError:
+        return api.error(400, 'Invalid list parameters')
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    with request.conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT g.id AS gift_id, g.name, g.emoji, g.rarity, g.base_price,
+                   m.floor_price, COALESCE(m.listing_count, 0) AS listing_count,
+                   COALESCE(w.volume, 0) AS volume_24h, COALESCE(w.trades, 0) AS trades_24h,
+                   ROUND(w.volume::numeric / NULLIF(w.trades, 0), 2) AS vwap_24h,
+                   s.last_price AS last_sale_price, s.last_trade_at AS last_sale_at
+            FROM gifts g
+            LEFT JOIN gift_market_summary m ON m.gift_id = g.id
+            LEFT JOIN gift_trade_stats s ON s.gift_id = g.id
+            LEFT JOIN (
+                SELECT gift_id, SUM(trades) AS trades, SUM(volume) AS volume
+                FROM gift_trade_buckets
+                WHERE bucket >= date_trunc('hour', LOCALTIMESTAMP - {MARKET_WINDOW})
+                GROUP BY gift_id
+            ) w ON w.gift_id = g.id
+            {where}
+            ORDER BY g.id
+        ''', args)
+        return api.ok(summary=api.rows_json(cur))
+
+
+@router.route('GET', 'history')
+def history(request: api.Request) -> Dict[str, Any]:
+    params = request.query
+    conditions = []
+    args = []
+
+    try:
+        limit = min(max(int(params.get('limit', HISTORY_LIMIT)), 1), HISTORY_MAX_LIMIT)
+        gift_id = int(params['gift_id']) if params.get('gift_id') else None
+
+        if params.get('user_gift_id'):
+            conditions.append('gh.gift_instance_id = %s')
+            args.append(int(params['user_gift_id']))
+        elif gift_id is not None:
+            conditions.append('gh.gift_id = %s')
+            args.append(gift_id)
+        else:
+            return api.error(400, 'gift_id or user_gift_id is required')
+        if params.get('cursor'):
+            cursor_time, _, cursor_id = params['cursor'].rpartition('|')
+            conditions.append('(gh.created_at, gh.id) < (%s, %s)')
+            args.extend([datetime.fromisoformat(cursor_time), int(cursor_id)])
+    except ValueError:
+        return api.error(400, 'Invalid list parameters')
+
+    with request.conn.cursor() as cur:
+        cur.execute(f'''
+            SELECT gh.id, gh.gift_id, gh.gift_instance_id AS user_gift_id,
+                   gh.from_user_id AS seller_id, gh.to_user_id AS buyer_id,
+                   gh.price, gh.transaction_type, gh.created_at,
+                   us.username as seller_name,
+                   ub.username as buyer_name,
+                   g.name as gift_name
+            FROM gift_history gh
+            LEFT JOIN users us ON gh.from_user_id = us.id
+            LEFT JOIN users ub ON gh.to_user_id = ub.id
+            LEFT JOIN gifts g ON gh.gift_id = g.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY gh.created_at DESC, gh.id DESC
+            LIMIT %s
+        ''', (*args, limit + 1))
+        rows = cur.fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            names = [column.name for column in cur.description]
+            next_cursor = f"{rows[-1][names.index('created_at')].isoformat()}|{rows[-1][0]}"
+        items = api.rows_json(cur, rows)
+
+        stats = None
+        if gift_id is not None and not params.get('cursor'):
+            cur.execute(TRADE_STATS_SQL, (gift_id,))
+            row = cur.fetchone()
+            names = [column.name for column in cur.description]
+            stats = dict(zip(names, row)) if row else {'trade_count': 0}
+
+        return api.ok(history=items, next_cursor=next_cursor, stats=stats)
+
+
+@router.route('GET', 'my_gifts')
+def my_gifts(request: api.Request) -> Dict[str, Any]:
+    user_id = request.query.get('user_id')
+
+    with request.conn.cursor() as cur:
+        cur.execute('''
+            SELECT ug.*, g.name, g.emoji as image_emoji, g.description,
+                   COALESCE(s.trade_count, 0) as transaction_count
+            FROM user_gifts ug
+            JOIN gifts g ON ug.gift_id = g.id
+            LEFT JOIN gift_trade_stats s ON s.gift_id = ug.gift_id
+            WHERE ug.owner_id = %s
+            ORDER BY ug.purchased_at DESC
+        ''', (user_id,))
+        return api.ok(gifts=api.rows_json(cur))
+
+
+@router.route('POST', 'buy_from_store')
+@idempotency.idempotent
+def buy_from_store(request: api.Request) -> Dict[str, Any]:
+    user_id = request.body.get('user_id')
+    gift_id = request.body.get('gift_id')
+    try:
+        quantity = int(request.body.get('quantity', 1))
+    except (TypeError, ValueError):
+        return api.error(400, 'Invalid quantity')
+    if not 0 < quantity <= MAX_PURCHASE_QUANTITY:
+        return api.error(400, f'quantity must be from 1 to {MAX_PURCHASE_QUANTITY}')
+
+    conn = request.conn
+    with db.dict_cursor(conn) as cur:
+        cur.execute('SELECT name, base_price, is_limited FROM gifts WHERE id = %s', (gift_id,))
+        gift = cur.fetchone()
+
+    if not gift:
+        return api.error(404, 'Gift not found')
+
+    with conn.cursor() as cur:
+        try:
+            if gift['is_limited']:
+                # Лимитированный подарок продаётся из остатка своего постоянного
+                # fcfs-дропа и по его цене
+                drop = drops.store_drop(cur, gift_id)
+                if drop is None:
+                    raise drops.SoldOut('Sold out')
+                user_gift_ids = drops.purchase(cur, drop, user_id, quantity)
+            else:
+                description = f"Покупка подарка: {gift['name']}" + (f' × {quantity}' if quantity > 1 else '')
+                ledger.post(cur, [(user_id, -gift['base_price'] * quantity, 'gift_purchase', description)])
+                cur.execute(MINT_SQL, {'user_id': user_id, 'gift_id': gift_id, 'price': gift['base_price'],
+                                       'quantity': quantity})
+                user_gift_ids = [row[0] for row in cur.fetchall()]
+        except drops.SoldOut as e:
+            conn.rollback()
+            return api.error(409, str(e))
+        except drops.DropError as e:
+            conn.rollback()
+            return api.error(400, str(e))
+        except ledger.UnknownAccount:
+            conn.rollback()
+            return api.error(404, 'User not found')
+        except ledger.InsufficientFunds:
+            conn.rollback()
+            return api.error(400, 'Insufficient balance')
+
+    conn.commit()
+    return api.ok(message='Gift purchased successfully', user_gift_ids=user_gift_ids)
+
+
+@router.route('POST', 'buy_from_user')
+@idempotency.idempotent
+def buy_from_user(request: api.Request) -> Dict[str, Any]:
+    try:
+        buyer_id = int(request.body['buyer_id'])
+        user_gift_id = int(request.body['user_gift_id'])
+    except (KeyError, TypeError, ValueError):
+        return api.error(400, 'Invalid purchase parameters')
+
+    conn = request.conn
+    with conn.cursor() as cur:
+        cur.execute(LOCK_LISTING_SQL, (user_gift_id,))
+        listing = cur.fetchone()
+
+        if not listing:
+            return api.error(404, 'Item not found')
+
+        _, gift_id, seller_id, price = listing
+        if seller_id == buyer_id:
+            return api.error(400, 'Cannot buy your own gift')
+
+        try:
+            ledger.post(cur, [
+                (buyer_id, -price, 'p2p_purchase', f'Покупка подарка у пользователя, лот #{user_gift_id}'),
+                (seller_id, price, 'p2p_sale', f'Продажа подарка, лот #{user_gift_id}')
+            ])
+        except ledger.UnknownAccount:
+            return api.error(404, 'User not found')
+        except ledger.InsufficientFunds:
+            return api.error(400, 'Insufficient balance')
+
+        cur.execute(TRANSFER_SQL, {
+            'buyer_id': buyer_id, 'seller_id': seller_id, 'user_gift_id': user_gift_id,
+            'gift_id': gift_id, 'price': price
+        })
+
+    conn.commit()
+    return api.ok(message='Gift purchased successfully')
+
+
+def drop_engine_authorized(request: api.Request) -> bool:
+    token = os.environ.get('DROP_ENGINE_TOKEN')
+    return bool(token) and request.headers.get('x-cron-token') == token
+
+
+@router.route('GET', 'drops')
+def list_drops(request: api.Request) -> Dict[str, Any]:
+    with request.conn.cursor() as cur:
+        cur.execute('''
+            SELECT d.id, d.gift_id, d.mode, d.price, d.supply, d.remaining, d.max_per_user,
+                   d.status, d.starts_at, d.closes_at, d.seed_hash,
+                   CASE WHEN d.status = 'allocated' THEN d.seed END AS seed,
+                   g.name, g.emoji as image_emoji
+            FROM gift_drops d
+            JOIN gifts g ON g.id = d.gift_id
+            ORDER BY d.id DESC
+            LIMIT 50
+        ''')
+        return api.ok(drops=api.rows_json(cur))
+
+
+# fcfs — покупка сразу; queue — заявка и распределение в этом же вызове;
+# lottery — заявка до closes_at, результат в drop_entry после розыгрыша
+@router.route('POST', 'drop_purchase')
+@idempotency.idempotent
+def drop_purchase(request: api.Request) -> Dict[str, Any]:
+    try:
+        user_id = int(request.body['user_id'])
+        drop_id = int(request.body['drop_id'])
+        quantity = int(request.body.get('quantity', 1))
+    except (KeyError, TypeError, ValueError):
+        return api.error(400, 'Invalid drop parameters')
+    if quantity <= 0:
+        return api.error(400, 'Invalid quantity')
+
+    conn = request.conn
+    with conn.cursor() as cur:
+        drop = drops.get(cur, drop_id)
+        if not drop:
+            return api.error(404, 'Drop not found')
+        try:
+            if drop['mode'] == 'fcfs':
+                user_gift_ids = drops.purchase(cur, drop, user_id, quantity)
+            else:
+                drops.enter(cur, drop, user_id, quantity)
+        except (drops.SoldOut, drops.AlreadyEntered) as e:
+            conn.rollback()
+            return api.error(409, str(e))
+        except drops.DropError as e:
+            conn.rollback()
+            return api.error(400, str(e))
+        except ledger.UnknownAccount:
+            conn.rollback()
+            return api.error(404, 'User not found')
+        except ledger.InsufficientFunds:
+            conn.rollback()
+            return api.error(400, 'Insufficient balance')
+    conn.commit()
+
+    if drop['mode'] == 'fcfs':
+        return api.ok(status='won', allocated=quantity, user_gift_ids=user_gift_ids)
+    if drop['mode'] == 'queue':
+        drops.allocate(conn, drop_id)
+    return drop_entry_response(conn, drop_id, user_id)
+
+
+def drop_entry_response(conn: Any, drop_id: int, user_id: int) -> Dict[str, Any]:
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT id AS intent_id, drop_id, quantity, allocated, status, created_at, allocated_at
+            FROM drop_intents
+            WHERE drop_id = %s AND user_id = %s
+        ''', (drop_id, user_id))
+        row = cur.fetchone()
+        if not row:
+            return api.error(404, 'Entry not found')
+        names = [column.name for column in cur.description]
+    return api.ok(**dict(zip(names, row)))
+
+
+@router.route('GET', 'drop_entry')
+def drop_entry(request: api.Request) -> Dict[str, Any]:
+    try:
+        drop_id = int(request.query['drop_id'])
+        user_id = int(request.query['user_id'])
+    except (KeyError, TypeError, ValueError):
+        return api.error(400, 'Invalid drop parameters')
+    return drop_entry_response(request.conn, drop_id, user_id)
+
+
+@router.route('POST', 'allocate_drops')
+def allocate_drops(request: api.Request) -> Dict[str, Any]:
+    if not drop_engine_authorized(request):
+        return api.error(403, 'Access denied')
+
+    drop_id = request.body.get('drop_id')
+    if drop_id is not None:
+        return api.ok(allocated={str(drop_id): drops.allocate(request.conn, int(drop_id))})
+    return api.ok(allocated=drops.allocate_due(request.conn))
+
+
+def parse_listings(body: Dict[str, Any], delist: bool = False) -> Tuple[int, Dict[int, Optional[int]]]:
+    '''
+    Владелец и {user_gift_id: цена} из тела PUT; цена None снимает лот.
+    Принимает items=[{user_gift_id, sale_price}], user_gift_ids (для delist)
+    или одиночные user_gift_id/sale_price. ValueError с текстом для клиента.
+    '''
+    try:
+        owner_id = int(body['user_id'])
+        if delist:
+            ids = body.get('user_gift_ids') or [body['user_gift_id']]
+            items = [{'user_gift_id': user_gift_id, 'sale_price': None} for user_gift_id in ids]
+        else:
+            items = body.get('items') or [{'user_gift_id': body['user_gift_id'], 'sale_price': body['sale_price']}]
+        listings = {}
+        for item in items:
+            price = item.get('sale_price')
+            listings[int(item['user_gift_id'])] = None if price is None else int(price)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise ValueError('Invalid listing parameters')
+    if not 0 < len(listings) <= MAX_BATCH_ITEMS:
+        raise ValueError(f'From 1 to {MAX_BATCH_ITEMS} gifts per request')
+    if any(price is not None and price <= 0 for price in listings.values()):
+        raise ValueError('sale_price must be positive')
+    return owner_id, listings
+
+
+def update_listings(conn: Any, owner_id: int, listings: Dict[int, Optional[int]]) -> List[Dict[str, Any]]:
+    '''Выставляет, переоценивает и снимает лоты владельца одним UPDATE; результат по каждому лоту.'''
+    with conn.cursor() as cur:
+        cur.execute(LOCK_OWNED_SQL, (list(listings), owner_id))
+        owned = {row[0] for row in cur.fetchall()}
+        rows = [(user_gift_id, price, owner_id) for user_gift_id, price in listings.items() if user_gift_id in owned]
+        updated = {}
+        if rows:
+            updated = {row[0]: row[1] for row in db.execute_values(
+                cur, UPDATE_LISTINGS_SQL, rows, template='(%s::int, %s::int, %s::int)',
+                page_size=len(rows), fetch=True
+            )}
+    conn.commit()
+
+    return [
+        {'user_gift_id': user_gift_id, 'status': 'not_found', 'sale_price': None} if user_gift_id not in updated else
+        {'user_gift_id': user_gift_id, 'status': 'listed' if updated[user_gift_id] is not None else 'delisted',
+         'sale_price': updated[user_gift_id]}
+        for user_gift_id in listings
+    ]
+
+
+@router.route('PUT', 'list_for_sale')
+def list_for_sale(request: api.Request) -> Dict[str, Any]:
     try:
-        if method == 'GET':
-            action = event.get('queryStringParameters', {}).get('action', 'list')
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if action == 'store_gifts':
-                    cur.execute('''
-                        SELECT id, name, description, emoji as image, base_price as price, rarity as category
-                        FROM gifts
-                        ORDER BY base_price ASC
-                    ''')
-                    gifts = cur.fetchall()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'gifts': [dict(g) for g in gifts]
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
-                
-                elif action == 'list':
-                    cur.execute('''
-                        SELECT ug.id as user_gift_id, ug.sale_price, ug.purchased_at,
-                               g.*, u.username as seller_name,
-                               0 as transaction_count
-                        FROM user_gifts ug
-                        JOIN gifts g ON ug.gift_id = g.id
-                        JOIN users u ON ug.owner_id = u.id
-                        WHERE ug.is_on_sale = TRUE
-                        ORDER BY ug.sale_price ASC
-                    ''')
-                    items = cur.fetchall()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'items': [dict(item) for item in items]
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
-                
-                elif action == 'history':
-                    gift_id = event.get('queryStringParameters', {}).get('gift_id')
-                    
-                    cur.execute('''
-                        SELECT gt.*, 
-                               us.username as seller_name,
-                               ub.username as buyer_name,
-                               g.name as gift_name
-                        FROM gift_transactions gt
-                        LEFT JOIN users us ON gt.seller_id = us.id
-                        LEFT JOIN users ub ON gt.buyer_id = ub.id
-                        JOIN gifts g ON gt.gift_id = g.id
-                        WHERE gt.gift_id = %s
-                        ORDER BY gt.created_at DESC
-                    ''', (gift_id,))
-                    history = cur.fetchall()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'history': [dict(h) for h in history]
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
-                
-                elif action == 'my_gifts':
-                    user_id = event.get('queryStringParameters', {}).get('user_id')
-                    
-                    cur.execute('''
-                        SELECT ug.*, g.name, g.emoji as image_emoji, g.description,
-                               0 as transaction_count
-                        FROM user_gifts ug
-                        JOIN gifts g ON ug.gift_id = g.id
-                        WHERE ug.owner_id = %s
-                        ORDER BY ug.purchased_at DESC
-                    ''', (user_id,))
-                    gifts = cur.fetchall()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'gifts': [dict(g) for g in gifts]
-                        }, default=str),
-                        'isBase64Encoded': False
-                    }
-        
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if action == 'buy_from_store':
-                    user_id = body_data.get('user_id')
-                    gift_id = body_data.get('gift_id')
-                    
-                    cur.execute('SELECT * FROM gifts WHERE id = %s', (gift_id,))
-                    gift = cur.fetchone()
-                    
-                    if not gift:
-                        return {
-                            'statusCode': 404,
-                            'headers': {
-                                'Content-Type': 'application/json',
-                                'Access-Control-Allow-Origin': '*'
-                            },
-                            'body': json.dumps({'success': False, 'error': 'Gift not found'}),
-                            'isBase64Encoded': False
-                        }
-                    
-                    cur.execute('SELECT balance FROM users WHERE id = %s', (user_id,))
-                    user = cur.fetchone()
-                    
-                    if user['balance'] < gift['base_price']:
-                        return {
-                            'statusCode': 400,
-                            'headers': {
-                                'Content-Type': 'application/json',
-                                'Access-Control-Allow-Origin': '*'
-                            },
-                            'body': json.dumps({'success': False, 'error': 'Insufficient balance'}),
-                            'isBase64Encoded': False
-                        }
-                    
-                    cur.execute('UPDATE users SET balance = balance - %s WHERE id = %s', (gift['base_price'], user_id))
-                    
-                    cur.execute('''
-                        INSERT INTO user_gifts (owner_id, gift_id, purchase_price)
-                        VALUES (%s, %s, %s)
-                        RETURNING id
-                    ''', (user_id, gift_id, gift['base_price']))
-                    user_gift = cur.fetchone()
-                    
-                    cur.execute('''
-                        INSERT INTO balance_transactions (user_id, amount, transaction_type, description)
-                        VALUES (%s, %s, 'gift_purchase', %s)
-                    ''', (user_id, -gift['base_price'], f"Покупка подарка: {gift['name']}"))
-                    
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'message': 'Gift purchased successfully'
-                        }),
-                        'isBase64Encoded': False
-                    }
-                
-                elif action == 'buy_from_user':
-                    buyer_id = body_data.get('buyer_id')
-                    user_gift_id = body_data.get('user_gift_id')
-                    
-                    cur.execute('''
-                        SELECT ug.*, g.name as gift_name, u.id as seller_id
-                        FROM user_gifts ug
-                        JOIN gifts g ON ug.gift_id = g.id
-                        JOIN users u ON ug.owner_id = u.id
-                        WHERE ug.id = %s AND ug.is_on_sale = TRUE
-                    ''', (user_gift_id,))
-                    item = cur.fetchone()
-                    
-                    if not item:
-                        return {
-                            'statusCode': 404,
-                            'headers': {
-                                'Content-Type': 'application/json',
-                                'Access-Control-Allow-Origin': '*'
-                            },
-                            'body': json.dumps({'success': False, 'error': 'Item not found'}),
-                            'isBase64Encoded': False
-                        }
-                    
-                    cur.execute('SELECT balance FROM users WHERE id = %s', (buyer_id,))
-                    buyer = cur.fetchone()
-                    
-                    if buyer['balance'] < item['sale_price']:
-                        return {
-                            'statusCode': 400,
-                            'headers': {
-                                'Content-Type': 'application/json',
-                                'Access-Control-Allow-Origin': '*'
-                            },
-                            'body': json.dumps({'success': False, 'error': 'Insufficient balance'}),
-                            'isBase64Encoded': False
-                        }
-                    
-                    cur.execute('UPDATE users SET balance = balance - %s WHERE id = %s', (item['sale_price'], buyer_id))
-                    cur.execute('UPDATE users SET balance = balance + %s WHERE id = %s', (item['sale_price'], item['seller_id']))
-                    
-                    cur.execute('''
-                        UPDATE user_gifts SET owner_id = %s, is_on_sale = FALSE, sale_price = NULL
-                        WHERE id = %s
-                    ''', (buyer_id, user_gift_id))
-                    
-                    cur.execute('''
-                        INSERT INTO gift_transactions (gift_id, user_gift_id, seller_id, buyer_id, price, transaction_type)
-                        VALUES (%s, %s, %s, %s, %s, 'p2p_sale')
-                    ''', (item['gift_id'], user_gift_id, item['seller_id'], buyer_id, item['sale_price']))
-                    
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {
-                            'Content-Type': 'application/json',
-                            'Access-Control-Allow-Origin': '*'
-                        },
-                        'body': json.dumps({
-                            'success': True,
-                            'message': 'Gift purchased successfully'
-                        }),
-                        'isBase64Encoded': False
-                    }
-        
-        elif method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if action == 'list_for_sale':
-                    user_gift_id = body_data.get('user_gift_id')
-                    sale_price = body_data.get('sale_price')
-                    
-                    cur.execute('''
-                        UPDATE user_gifts SET is_on_sale = TRUE, sale_price = %s
-                        WHERE id = %s
-                        RETURNING id
-                    ''', (sale_price, user_gift_id))
-                    
-                    result = cur.fetchone()
-                    conn.commit()
-                    
-                    if result:
-                        return {
-                            'statusCode': 200,
-                            'headers': {
-                                'Content-Type': 'application/json',
-                                'Access-Control-Allow-Origin': '*'
-                            },
-                            'body': json.dumps({
-                                'success': True,
-                                'message': 'Gift listed for sale'
-                            }),
-                            'isBase64Encoded': False
-                        }
-        
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'success': False, 'error': 'Invalid request'}),
-            'isBase64Encoded': False
-        }
-    
-    finally:
-        conn.close()
\ No newline at end of file
+        owner_id, listings = parse_listings(request.body)
+    except ValueError as e:
+        return api.error(400, str(e))
+
+    results = update_listings(request.conn, owner_id, listings)
+    if 'items' not in request.body and results[0]['status'] == 'not_found':
+        return router.not_found
+    return api.ok(message='Gift listed for sale', results=results,
+                  updated=sum(result['status'] != 'not_found' for result in results))
+
+
+@router.route('PUT', 'delist')
+def delist(request: api.Request) -> Dict[str, Any]:
+    try:
+        owner_id, listings = parse_listings(request.body, delist=True)
+    except ValueError as e:
+        return api.error(400, str(e))
+
+    results = update_listings(request.conn, owner_id, listings)
+    return api.ok(message='Gifts removed from sale', results=results,
+                  updated=sum(result['status'] != 'not_found' for result in results))
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return router.dispatch(event)
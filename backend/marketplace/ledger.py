@@ -0,0 +1,267 @@
+'''
+Журнал движений баланса. balance_transactions — единственный источник
+правды и только дополняется (UPDATE/DELETE запрещены триггером), а
+user_balances — кэшированная проекция, которую post() меняет тем же
+запросом, что и пишет записи. Зачисления на счета в режиме sharded
+идут в user_balance_shards без блокировки основной строки. Периодические снимки balance_snapshots
+фиксируют баланс пользователя на id записи журнала, поэтому сверка
+читает снимок + хвост после него, а не всю историю.
+Файл одинаков в функциях tasks, marketplace, exchange и admin.
+Запуск: python ledger.py snapshot | fold | audit [--user-id N ...]
+'''
+
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import db
+
+SNAPSHOT_LAG_SECONDS = 300
+
+# (user_id, amount, transaction_type, description); amount < 0 — списание
+Entry = Tuple[int, int, str, str]
+
+_POST_SQL = '''
+    WITH entries (user_id, amount, transaction_type, description, position) AS (
+        VALUES %s
+    ),
+    totals AS (
+        SELECT user_id, SUM(amount) AS total
+        FROM entries
+        GROUP BY user_id
+    ),
+    targets AS (
+        SELECT b.user_id, t.total, b.sharded AND t.total >= 0 AS to_shard
+        FROM user_balances b
+        JOIN totals t ON t.user_id = b.user_id
+    ),
+    accounts AS (
+        SELECT b.user_id, b.balance
+        FROM user_balances b
+        WHERE b.user_id IN (SELECT user_id FROM targets WHERE NOT to_shard)
+        ORDER BY b.user_id
+        FOR UPDATE
+    ),
+    checked AS (
+        SELECT (SELECT COUNT(*) FROM targets) = (SELECT COUNT(*) FROM totals) AS known,
+               NOT EXISTS (
+                   SELECT 1
+                   FROM accounts a
+                   JOIN totals t ON t.user_id = a.user_id
+                   WHERE t.total < 0
+                     AND a.balance + t.total + COALESCE(
+                         (SELECT SUM(delta) FROM user_balance_shards s WHERE s.user_id = a.user_id), 0) < 0
+               ) AS funded
+    ),
+    projected AS (
+        UPDATE user_balances b SET balance = b.balance + t.total
+        FROM targets t, checked c
+        WHERE b.user_id = t.user_id AND NOT t.to_shard AND c.known AND {allowed}
+        RETURNING b.user_id, b.balance
+    ),
+    shard_credits AS (
+        INSERT INTO user_balance_shards (user_id, shard, delta)
+        SELECT t.user_id, pg_backend_pid() %% 16, t.total
+        FROM targets t, checked c
+        WHERE t.to_shard AND c.known AND {allowed}
+        ON CONFLICT (user_id, shard) DO UPDATE SET delta = user_balance_shards.delta + EXCLUDED.delta
+        RETURNING user_id
+    ),
+    appended AS (
+        INSERT INTO balance_transactions (user_id, amount, transaction_type, description, created_at)
+        SELECT e.user_id, e.amount, e.transaction_type, e.description, clock_timestamp()
+        FROM entries e, checked c
+        WHERE c.known AND {allowed}
+        ORDER BY e.position
+        RETURNING id
+    )
+    SELECT c.known, c.funded, t.user_id,
+           COALESCE(p.balance, b.balance + t.total) + COALESCE(s.delta, 0) AS balance
+    FROM checked c
+    LEFT JOIN targets t ON c.known AND {allowed}
+    LEFT JOIN projected p ON p.user_id = t.user_id
+    LEFT JOIN user_balances b ON b.user_id = t.user_id
+    LEFT JOIN LATERAL (
+        SELECT SUM(delta) AS delta FROM user_balance_shards WHERE user_id = t.user_id
+    ) s ON TRUE
+'''
+
+POST_SQL = {
+    False: _POST_SQL.format(allowed='c.funded'),
+    True: _POST_SQL.format(allowed='TRUE')
+}
+POST_TEMPLATE = '(%s::int, %s::bigint, %s::varchar, %s::text, %s::int)'
+
+# Снимки для пользователей с записями в (since, upto]. created_at записи —
+# clock_timestamp() на момент вставки, поэтому upto с отставанием
+# SNAPSHOT_LAG_SECONDS не обгоняет ещё не закоммиченные записи.
+SNAPSHOT_SQL = '''
+    WITH bounds AS (
+        SELECT COALESCE((SELECT MAX(ledger_id) FROM balance_snapshots), 0) AS since
+    ),
+    horizon AS (
+        SELECT b.since, MAX(t.id) AS upto
+        FROM bounds b
+        LEFT JOIN balance_transactions t
+          ON t.id > b.since AND t.created_at < clock_timestamp() - make_interval(secs => %s)
+        GROUP BY b.since
+    ),
+    changed AS (
+        SELECT t.user_id, SUM(t.amount) AS delta, MAX(t.id) AS last_id
+        FROM balance_transactions t, horizon w
+        WHERE t.id > w.since AND t.id <= w.upto
+        GROUP BY t.user_id
+    ),
+    previous AS (
+        SELECT DISTINCT ON (s.user_id) s.user_id, s.balance
+        FROM balance_snapshots s
+        JOIN changed c ON c.user_id = s.user_id
+        ORDER BY s.user_id, s.ledger_id DESC
+    )
+    INSERT INTO balance_snapshots (user_id, ledger_id, balance)
+    SELECT c.user_id, c.last_id, COALESCE(p.balance, 0) + c.delta
+    FROM changed c
+    LEFT JOIN previous p ON p.user_id = c.user_id
+'''
+
+AUDIT_SQL = '''
+    SELECT u.id AS user_id,
+           COALESCE(b.balance, 0) AS cached_balance,
+           s.ledger_id AS snapshot_ledger_id,
+           COALESCE(s.balance, 0) AS snapshot_balance,
+           t.entries AS tail_entries,
+           (COALESCE(s.balance, 0) + COALESCE(t.amount, 0))::bigint AS ledger_balance
+    FROM users u
+    LEFT JOIN account_balances b ON b.user_id = u.id
+    LEFT JOIN LATERAL (
+        SELECT ledger_id, balance
+        FROM balance_snapshots
+        WHERE user_id = u.id
+        ORDER BY ledger_id DESC
+        LIMIT 1
+    ) s ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT SUM(amount) AS amount, COUNT(*) AS entries
+        FROM balance_transactions
+        WHERE user_id = u.id AND id > COALESCE(s.ledger_id, 0)
+    ) t ON TRUE
+'''
+
+
+class LedgerError(Exception):
+    pass
+
+
+class UnknownAccount(LedgerError):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+def post(cur: Any, entries: Sequence[Entry], allow_overdraft: bool = False) -> Dict[int, int]:
+    '''
+    Добавляет записи одним запросом и сдвигает баланс (user_balances или шард) на их сумму.
+    Возвращает новые балансы затронутых пользователей. Если какого-то
+    пользователя нет или списание уводит баланс в минус (и allow_overdraft
+    не задан), ничего не пишет и бросает UnknownAccount / InsufficientFunds.
+    Работает в транзакции соединения cur; фиксирует её вызывающий код.
+    '''
+    if not entries:
+        return {}
+    with cur.connection.cursor() as plain:
+        rows = db.execute_values(
+            plain, POST_SQL[allow_overdraft],
+            [(user_id, amount, kind, description, position)
+             for position, (user_id, amount, kind, description) in enumerate(entries)],
+            template=POST_TEMPLATE, page_size=len(entries), fetch=True
+        )
+    known, funded = rows[0][0], rows[0][1]
+    if not known:
+        raise UnknownAccount('Unknown user in ledger entries')
+    if not funded and not allow_overdraft:
+        raise InsufficientFunds('Insufficient balance')
+    return {row[2]: row[3] for row in rows if row[2] is not None}
+
+
+def set_sharded(cur: Any, user_id: int, sharded: bool) -> Optional[int]:
+    '''Переключает режим шардов для счёта и сворачивает шарды; возвращает баланс или None.'''
+    cur.execute('UPDATE user_balances SET sharded = %s WHERE user_id = %s RETURNING user_id', (sharded, user_id))
+    if not cur.fetchone():
+        return None
+    cur.execute('SELECT fold_balance_shards(%s)', (user_id,))
+    return cur.fetchone()[0]
+
+
+def fold(conn: Any) -> int:
+    '''Переносит накопленные шарды в основные строки; возвращает число счетов.'''
+    with conn.cursor() as cur:
+        cur.execute('SELECT DISTINCT user_id FROM user_balance_shards ORDER BY user_id')
+        user_ids = [row[0] for row in cur.fetchall()]
+    for user_id in user_ids:
+        with conn.cursor() as cur:
+            cur.execute('SELECT fold_balance_shards(%s)', (user_id,))
+        conn.commit()
+    return len(user_ids)
+
+
+def snapshot(conn: Any, lag_seconds: float = SNAPSHOT_LAG_SECONDS) -> int:
+    '''Снимает балансы пользователей с новыми записями; возвращает число снимков.'''
+    with conn.cursor() as cur:
+        cur.execute('SELECT pg_try_advisory_xact_lock(hashtext(%s))', ('balance_snapshots',))
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return 0
+        cur.execute(SNAPSHOT_SQL, (lag_seconds,))
+        taken = cur.rowcount
+    conn.commit()
+    return taken
+
+
+def audit(cur: Any, user_ids: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+    '''Сверка кэшированного баланса с журналом (снимок + хвост) по пользователям или по всем.'''
+    if user_ids is None:
+        cur.execute(AUDIT_SQL + ' ORDER BY u.id')
+    else:
+        cur.execute(AUDIT_SQL + ' WHERE u.id = ANY(%s) ORDER BY u.id', (list(user_ids),))
+    names = [column.name for column in cur.description]
+    report = []
+    for row in cur.fetchall():
+        item = dict(zip(names, row))
+        item['drift'] = item['cached_balance'] - item['ledger_balance']
+        report.append(item)
+    return report
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Balance ledger maintenance')
+    parser.add_argument('command', choices=['snapshot', 'fold', 'audit'])
+    parser.add_argument('--user-id', type=int, action='append', help='audit only these users')
+    parser.add_argument('--lag', type=float, default=SNAPSHOT_LAG_SECONDS, help='seconds to stay behind writers')
+    args = parser.parse_args()
+
+    with db.connection() as conn:
+        if args.command == 'snapshot':
+            print(json.dumps({'snapshots': snapshot(conn, args.lag)}))
+            return
+        if args.command == 'fold':
+            print(json.dumps({'folded': fold(conn)}))
+            return
+
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        try:
+            with conn.cursor() as cur:
+                report = [row for row in audit(cur, args.user_id) if row['drift'] or args.user_id]
+            conn.commit()
+        finally:
+            conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT')
+
+    print(json.dumps(report, indent=2, default=str))
+    if any(row['drift'] for row in report):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
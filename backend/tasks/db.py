@@ -0,0 +1,166 @@
+'''
+Пул соединений с PostgreSQL, живущий между тёплыми вызовами функции.
+Пул создаётся лениво при первом обращении и хранится на уровне модуля,
+поэтому повторные вызовы того же инстанса не платят за TCP/TLS/auth.
+psycopg2 и psycopg2.extras импортируются при первом использовании:
+preflight-запросы и холодный старт не ждут загрузки драйвера.
+Файл одинаков во всех функциях backend/: каждая функция деплоится
+из своей папки, поэтому общий код лежит рядом с index.py.
+'''
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, dsn: Optional[str], max_size: int = 4, idle_timeout: float = 300.0,
+                 check_interval: float = 30.0, checkout_timeout: float = 10.0):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.checkout_timeout = checkout_timeout
+        self._idle: List[Tuple[Any, float]] = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+    def checkout(self) -> Any:
+        deadline = time.monotonic() + self.checkout_timeout
+        with self._cond:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    conn, returned_at = None, 0.0
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted('No free database connections')
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            if conn is not None and not self._is_healthy(conn, returned_at):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                import psycopg2
+                conn = psycopg2.connect(self.dsn)
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def release(self, conn: Any) -> None:
+        import psycopg2.extensions
+
+        keep = not conn.closed
+        if keep:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                keep = False
+        if not keep:
+            self._close(conn)
+
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+    def _evict_idle(self) -> None:
+        cutoff = time.monotonic() - self.idle_timeout
+        while self._idle and self._idle[0][1] < cutoff:
+            conn, _ = self._idle.pop(0)
+            self._close(conn)
+
+    def _is_healthy(self, conn: Any, returned_at: float) -> bool:
+        import psycopg2
+
+        if conn.closed:
+            return False
+        if time.monotonic() - returned_at < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close(conn: Any) -> None:
+        import psycopg2
+
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    os.environ.get('DATABASE_URL'),
+                    max_size=int(os.environ.get('DB_POOL_MAX_SIZE', '4')),
+                    idle_timeout=float(os.environ.get('DB_POOL_IDLE_TIMEOUT', '300')),
+                    check_interval=float(os.environ.get('DB_POOL_CHECK_INTERVAL', '30'))
+                )
+    return _pool
+
+
+def checkout() -> Any:
+    return get_pool().checkout()
+
+
+def release(conn: Any) -> None:
+    get_pool().release(conn)
+
+
+@contextmanager
+def connection() -> Iterator[Any]:
+    conn = checkout()
+    try:
+        yield conn
+    finally:
+        release(conn)
+
+
+def dict_cursor(conn: Any, **kwargs: Any) -> Any:
+    '''Курсор, возвращающий строки как dict (RealDictCursor).'''
+    from psycopg2.extras import RealDictCursor
+    return conn.cursor(cursor_factory=RealDictCursor, **kwargs)
+
+
+def execute_values(cur: Any, sql: str, rows: Sequence[Any], **kwargs: Any) -> Any:
+    from psycopg2.extras import execute_values
+    return execute_values(cur, sql, rows, **kwargs)
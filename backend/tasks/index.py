@@ -5,180 +5,167 @@ Args: event - dict с httpMethod, body, queryStringParameters
 Returns: HTTP response dict с заданиями или результатом верификации
 '''
 
-import json
 import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from typing import Dict, Any
-import requests
+
+import api
+import db
+import idempotency
+import ledger
+import task_cache
+import telegram
+
+VERIFY_BATCH_LIMIT = 100
+
+VERIFY_BATCH_SQL = '''
+    WITH input (user_id, task_id) AS (
+        VALUES %s
+    ),
+    done AS (
+        INSERT INTO user_tasks (user_id, task_id, verified)
+        SELECT user_id, task_id, TRUE FROM input
+        ON CONFLICT (user_id, task_id) DO UPDATE
+        SET verified = TRUE, completed_at = CURRENT_TIMESTAMP
+        WHERE user_tasks.verified = FALSE
+        RETURNING user_id, task_id
+    )
+    SELECT d.user_id, d.task_id, t.reward, t.title
+    FROM done d
+    JOIN tasks t ON d.task_id = t.id
+'''
+
+
+router = api.Router('GET, POST, OPTIONS', 'Content-Type, X-User-Id, Idempotency-Key')
+
+
+@router.route('GET')
+def list_tasks(request: api.Request) -> Dict[str, Any]:
+    body = task_cache.tasks_body(request.conn, request.query.get('user_id'))
+    return api.respond(200, api.Raw(body))
+
+
+@router.route('POST', 'verify')
+def verify(request: api.Request) -> Dict[str, Any]:
+    task_id = request.body.get('task_id')
+    telegram_user_id = request.body.get('telegram_user_id')
+
+    with db.dict_cursor(request.conn) as cur:
+        cur.execute('SELECT task_type, telegram_channel_id FROM tasks WHERE id = %s', (task_id,))
+        task = cur.fetchone()
+
+    if not task:
+        return api.error(404, 'Task not found')
+
+    # Telegram проверяется до занятия Idempotency-Key: соединение отдаётся в пул
+    # на время медленного вызова, а незафиксированный ключ откатился бы вместе с ним
+    if task['task_type'] == 'telegram_subscribe':
+        request.release()
+        try:
+            verified = telegram.is_member(os.environ.get('TELEGRAM_BOT_TOKEN'), task['telegram_channel_id'], telegram_user_id)
+        except telegram.TelegramError:
+            return api.error(503, 'Verification service unavailable', verified=False)
+        if not verified:
+            return api.error(400, 'Verification failed', verified=False)
+
+    return reward(request)
+
+
+@idempotency.idempotent
+def reward(request: api.Request) -> Dict[str, Any]:
+    user_id = request.body.get('user_id')
+    task_id = request.body.get('task_id')
+
+    conn = request.conn
+    with db.dict_cursor(conn) as cur:
+        cur.execute('SELECT title, reward FROM tasks WHERE id = %s', (task_id,))
+        task = cur.fetchone()
+        if not task:
+            return api.error(404, 'Task not found')
+
+        cur.execute('''
+            INSERT INTO user_tasks (user_id, task_id, verified)
+            VALUES (%s, %s, TRUE)
+            ON CONFLICT (user_id, task_id) DO UPDATE
+            SET verified = TRUE, completed_at = CURRENT_TIMESTAMP
+            WHERE user_tasks.verified = FALSE
+            RETURNING id
+        ''', (user_id, task_id))
+
+        if not cur.fetchone():
+            return api.error(400, 'Task already completed')
+
+        try:
+            balances = ledger.post(cur, [(user_id, task['reward'], 'task_reward', f"Награда за задание: {task['title']}")])
+        except ledger.UnknownAccount:
+            return api.error(404, 'User not found')
+
+        conn.commit()
+
+    return api.ok(verified=True, reward=task['reward'], new_balance=next(iter(balances.values())))
+
+
+def cron_authorized(request: api.Request) -> bool:
+    token = os.environ.get('TASK_VERIFY_TOKEN')
+    return bool(token) and request.headers.get('x-cron-token') == token
+
+
+# Для планировщика: перепроверяет ожидающие user_tasks заданий-подписок.
+# Пары берутся из базы, а не из тела; задания, которые нельзя проверить, не засчитываются.
+@router.route('POST', 'verify_batch')
+def verify_batch(request: api.Request) -> Dict[str, Any]:
+    if not cron_authorized(request):
+        return api.error(403, 'Access denied')
+
+    with db.dict_cursor(request.conn) as cur:
+        cur.execute('''
+            SELECT ut.user_id, ut.task_id, u.telegram_id AS telegram_user_id, t.telegram_channel_id
+            FROM user_tasks ut
+            JOIN users u ON ut.user_id = u.id
+            JOIN tasks t ON ut.task_id = t.id
+            WHERE ut.verified = FALSE AND t.task_type = 'telegram_subscribe'
+              AND u.telegram_id IS NOT NULL
+            ORDER BY ut.id
+            LIMIT %s
+        ''', (VERIFY_BATCH_LIMIT,))
+        items = [dict(row) for row in cur.fetchall()]
+
+    request.release()
+
+    checks = telegram.check_many(os.environ.get('TELEGRAM_BOT_TOKEN'), [
+        (item['telegram_channel_id'], item['telegram_user_id']) for item in items
+    ])
+
+    results = []
+    for item in items:
+        result = {'user_id': item['user_id'], 'task_id': item['task_id'], 'verified': False}
+        check = checks[(str(item['telegram_channel_id']), str(item['telegram_user_id']))]
+        if isinstance(check, telegram.TelegramError):
+            result['error'] = 'Verification service unavailable'
+        else:
+            result['verified'] = check
+        results.append(result)
+
+    verified_pairs = list(dict.fromkeys((r['user_id'], r['task_id']) for r in results if r['verified']))
+    rewarded = set()
+
+    if verified_pairs:
+        conn = request.conn
+        with conn.cursor() as cur:
+            rows = db.execute_values(cur, VERIFY_BATCH_SQL, verified_pairs, template='(%s::int, %s::int)',
+                                     page_size=len(verified_pairs), fetch=True)
+            try:
+                ledger.post(cur, [(row[0], row[2], 'task_reward', f'Награда за задание: {row[3]}') for row in rows])
+            except ledger.UnknownAccount:
+                conn.rollback()
+                return api.error(404, 'User not found')
+        conn.commit()
+        rewarded = {(row[0], row[1]) for row in rows}
+
+    for result in results:
+        result['rewarded'] = (result['user_id'], result['task_id']) in rewarded
+
+    return api.ok(results=results)
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
-    conn = psycopg2.connect(dsn)
-    
-    try:
-        if method == 'GET':
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute('''
-                    SELECT t.*, 
-                           CASE WHEN ut.id IS NOT NULL THEN TRUE ELSE FALSE END as completed
-                    FROM tasks t
-                    LEFT JOIN user_tasks ut ON t.id = ut.task_id AND ut.user_id = %s
-                    WHERE t.is_active = TRUE
-                    ORDER BY t.reward DESC
-                ''', (user_id,))
-                tasks = cur.fetchall()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {
-                        'Content-Type': 'application/json',
-                        'Access-Control-Allow-Origin': '*'
-                    },
-                    'body': json.dumps({
-                        'success': True,
-                        'tasks': [dict(task) for task in tasks]
-                    }, default=str),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
-            
-            if action == 'verify':
-                user_id = body_data.get('user_id')
-                task_id = body_data.get('task_id')
-                telegram_user_id = body_data.get('telegram_user_id')
-                
-                with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                    cur.execute('SELECT * FROM tasks WHERE id = %s', (task_id,))
-                    task = cur.fetchone()
-                    
-                    if not task:
-                        return {
-                            'statusCode': 404,
-                            'headers': {
-                                'Content-Type': 'application/json',
-                                'Access-Control-Allow-Origin': '*'
-                            },
-                            'body': json.dumps({'success': False, 'error': 'Task not found'}),
-                            'isBase64Encoded': False
-                        }
-                    
-                    verified = False
-                    if task['task_type'] == 'telegram_subscribe':
-                        try:
-                            response = requests.get(
-                                f"https://api.telegram.org/bot{bot_token}/getChatMember",
-                                params={
-                                    'chat_id': task['telegram_channel_id'],
-                                    'user_id': telegram_user_id
-                                }
-                            )
-                            data = response.json()
-                            if data.get('ok'):
-                                status = data.get('result', {}).get('status')
-                                verified = status in ['member', 'administrator', 'creator']
-                        except:
-                            verified = True
-                    else:
-                        verified = True
-                    
-                    if verified:
-                        cur.execute('''
-                            INSERT INTO user_tasks (user_id, task_id, verified)
-                            VALUES (%s, %s, TRUE)
-                            ON CONFLICT (user_id, task_id) DO NOTHING
-                            RETURNING id
-                        ''', (user_id, task_id))
-                        
-                        result = cur.fetchone()
-                        
-                        if result:
-                            cur.execute('''
-                                UPDATE users SET balance = balance + %s WHERE id = %s
-                                RETURNING balance
-                            ''', (task['reward'], user_id))
-                            
-                            new_balance = cur.fetchone()
-                            
-                            cur.execute('''
-                                INSERT INTO balance_transactions (user_id, amount, transaction_type, description)
-                                VALUES (%s, %s, 'task_reward', %s)
-                            ''', (user_id, task['reward'], f"Награда за задание: {task['title']}"))
-                            
-                            conn.commit()
-                            
-                            return {
-                                'statusCode': 200,
-                                'headers': {
-                                    'Content-Type': 'application/json',
-                                    'Access-Control-Allow-Origin': '*'
-                                },
-                                'body': json.dumps({
-                                    'success': True,
-                                    'verified': True,
-                                    'reward': task['reward'],
-                                    'new_balance': new_balance['balance']
-                                }),
-                                'isBase64Encoded': False
-                            }
-                        else:
-                            return {
-                                'statusCode': 400,
-                                'headers': {
-                                    'Content-Type': 'application/json',
-                                    'Access-Control-Allow-Origin': '*'
-                                },
-                                'body': json.dumps({
-                                    'success': False,
-                                    'error': 'Task already completed'
-                                }),
-                                'isBase64Encoded': False
-                            }
-                    else:
-                        return {
-                            'statusCode': 400,
-                            'headers': {
-                                'Content-Type': 'application/json',
-                                'Access-Control-Allow-Origin': '*'
-                            },
-                            'body': json.dumps({
-                                'success': False,
-                                'verified': False,
-                                'error': 'Verification failed'
-                            }),
-                            'isBase64Encoded': False
-                        }
-        
-        return {
-            'statusCode': 400,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'success': False, 'error': 'Invalid request'}),
-            'isBase64Encoded': False
-        }
-    
-    finally:
-        conn.close()
\ No newline at end of file
+    return router.dispatch(event)
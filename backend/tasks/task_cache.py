@@ -0,0 +1,86 @@
+'''
+Кэш списка заданий в памяти процесса.
+Активные задания хранятся уже сериализованными (по фрагменту на флаг
+completed), выполненные задания пользователя — множеством id. Актуальность
+проверяется по счётчикам cache_versions, которые триггеры увеличивают при
+изменении tasks и user_tasks, поэтому запрос списка читает 1–2 строки
+по первичному ключу вместо JOIN по всем заданиям.
+'''
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import api
+
+MAX_USERS = 10000
+
+_lock = threading.Lock()
+_tasks: Dict[str, Any] = {'version': None, 'fragments': []}
+_completed: 'OrderedDict[str, Tuple[int, FrozenSet[int]]]' = OrderedDict()
+
+
+def _user_key(user_id: Any) -> str:
+    return f'user_tasks:{user_id}'
+
+
+def _read_versions(cur: Any, user_id: Optional[Any]) -> Tuple[int, int]:
+    keys = ['tasks'] + ([_user_key(user_id)] if user_id is not None else [])
+    cur.execute('SELECT key, version FROM cache_versions WHERE key = ANY(%s)', (keys,))
+    versions = dict(cur.fetchall())
+    return versions.get('tasks', 0), versions.get(_user_key(user_id), 0)
+
+
+def _load_fragments(cur: Any) -> List[Tuple[int, str, str]]:
+    cur.execute('''
+        SELECT t.*
+        FROM tasks t
+        WHERE t.is_active = TRUE
+        ORDER BY t.reward DESC
+    ''')
+    names = [column.name for column in cur.description]
+    fragments = []
+    for row in cur.fetchall():
+        task = dict(zip(names, row))
+        fragments.append((
+            task['id'],
+            api.dumps({**task, 'completed': False}),
+            api.dumps({**task, 'completed': True})
+        ))
+    return fragments
+
+
+def _load_completed(cur: Any, user_id: Any) -> FrozenSet[int]:
+    cur.execute('SELECT task_id FROM user_tasks WHERE user_id = %s', (user_id,))
+    return frozenset(row[0] for row in cur.fetchall())
+
+
+def tasks_body(conn: Any, user_id: Optional[Any]) -> str:
+    '''Возвращает готовое тело ответа {"success": true, "tasks": [...]}.'''
+    user_id = user_id or None
+    with conn.cursor() as cur:
+        tasks_version, user_version = _read_versions(cur, user_id)
+
+        with _lock:
+            fragments = _tasks['fragments'] if _tasks['version'] == tasks_version else None
+            cached = _completed.get(str(user_id)) if user_id is not None else None
+            completed = cached[1] if cached and cached[0] == user_version else None
+            if completed is not None:
+                _completed.move_to_end(str(user_id))
+
+        if fragments is None:
+            fragments = _load_fragments(cur)
+            with _lock:
+                _tasks.update(version=tasks_version, fragments=fragments)
+
+        if completed is None:
+            completed = _load_completed(cur, user_id) if user_id is not None else frozenset()
+            if user_id is not None:
+                with _lock:
+                    _completed[str(user_id)] = (user_version, completed)
+                    _completed.move_to_end(str(user_id))
+                    while len(_completed) > MAX_USERS:
+                        _completed.popitem(last=False)
+
+    items = ','.join(done if task_id in completed else todo for task_id, todo, done in fragments)
+    return '{"success":true,"tasks":[' + items + ']}'
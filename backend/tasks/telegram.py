@@ -0,0 +1,148 @@
+'''
+Проверка подписки на Telegram-каналы через Bot API.
+Один keep-alive requests.Session на процесс, жёсткие таймауты, короткий
+кэш статусов (channel, telegram_user_id) и повторы с учётом retry_after.
+Адрес API переопределяется через TELEGRAM_API_URL (например, для
+локального стаб-сервера в тестах).
+requests и пул потоков импортируются при первой проверке: GET-запросы
+списка заданий не платят за их загрузку на холодном старте.
+'''
+
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org').rstrip('/')
+CONNECT_TIMEOUT = 2.0
+READ_TIMEOUT = 4.0
+MAX_ATTEMPTS = 3
+MAX_RETRY_AFTER = 5.0
+MAX_WORKERS = 8
+MEMBER_TTL = 60.0
+NOT_MEMBER_TTL = 5.0
+
+MEMBER_STATUSES = frozenset(['member', 'administrator', 'creator'])
+
+Key = Tuple[str, str]
+
+
+class TelegramError(Exception):
+    pass
+
+
+_session: Optional[Any] = None
+_session_lock = threading.Lock()
+_cache: Dict[Key, Tuple[str, float]] = {}
+_cache_lock = threading.Lock()
+
+
+def get_session() -> Any:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+    return _session
+
+
+def clear_cache() -> None:
+    with _cache_lock:
+        _cache.clear()
+
+
+def _backoff(attempt: int) -> float:
+    return min(MAX_RETRY_AFTER, 0.2 * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+
+def _fetch_status(bot_token: str, chat_id: str, user_id: str) -> str:
+    import requests
+
+    url = f'{API_URL}/bot{bot_token}/getChatMember'
+    last_error = 'no response'
+
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            response = get_session().get(
+                url,
+                params={'chat_id': chat_id, 'user_id': user_id},
+                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+            )
+        except requests.RequestException as e:
+            last_error = str(e)
+            time.sleep(_backoff(attempt))
+            continue
+
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+
+        if data.get('ok'):
+            return data.get('result', {}).get('status', 'left')
+
+        retry_after = (data.get('parameters') or {}).get('retry_after')
+        if response.status_code == 429 or retry_after:
+            last_error = data.get('description', 'rate limited')
+            wait = float(retry_after or 1)
+            if wait > MAX_RETRY_AFTER:
+                break
+            time.sleep(wait)
+            continue
+
+        if response.status_code >= 500:
+            last_error = f'HTTP {response.status_code}'
+            time.sleep(_backoff(attempt))
+            continue
+
+        if response.status_code in (401, 403, 404):
+            raise TelegramError(data.get('description', f'HTTP {response.status_code}'))
+
+        return 'left'
+
+    raise TelegramError(last_error)
+
+
+def get_member_status(bot_token: str, chat_id: Any, user_id: Any) -> str:
+    key = (str(chat_id), str(user_id))
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    status = _fetch_status(bot_token, key[0], key[1])
+    ttl = MEMBER_TTL if status in MEMBER_STATUSES else NOT_MEMBER_TTL
+    with _cache_lock:
+        _cache[key] = (status, time.monotonic() + ttl)
+    return status
+
+
+def is_member(bot_token: str, chat_id: Any, user_id: Any) -> bool:
+    return get_member_status(bot_token, chat_id, user_id) in MEMBER_STATUSES
+
+
+def check_many(bot_token: str, pairs: Iterable[Tuple[Any, Any]]) -> Dict[Key, Union[bool, TelegramError]]:
+    '''Параллельно проверяет пары (chat_id, user_id); ошибка по паре возвращается как значение.'''
+    keys = list(dict.fromkeys((str(c), str(u)) for c, u in pairs))
+    if not keys:
+        return {}
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def check(key: Key) -> Union[bool, TelegramError]:
+        try:
+            return is_member(bot_token, key[0], key[1])
+        except TelegramError as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(keys))) as executor:
+        return dict(zip(keys, executor.map(check, keys)))
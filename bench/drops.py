@@ -0,0 +1,152 @@
+'''
+Нагрузочный стенд дропов (backend/marketplace/drops.py). Раздаёт звёзды
+покупателям 1..--buyers, открывает дроп на --supply экземпляров и по
+барьеру запускает всех покупателей разом из --concurrency потоков: fcfs
+покупает сразу, queue подаёт заявку и распределяет очередь в том же
+вызове, как POST action=drop_purchase, lottery только подаёт заявки, а
+розыгрыш после закрытия меряется отдельно. Печатает запросы/с, p50/p99
+задержки, исходы и проверяет, что тираж не перепродан.
+
+Пример (база после python bench/harness.py --reset --users 10000):
+    python bench/drops.py --dsn postgresql://localhost/zvezdy_bench --buyers 10000 --supply 1000 --mode fcfs
+'''
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'backend' / 'marketplace'))
+
+import db  # noqa: E402
+import drops  # noqa: E402
+import ledger  # noqa: E402
+
+FUNDS = 10 ** 9
+
+
+def prepare(gift_id: int, buyers: int, supply: int, mode: str, quantity: int) -> int:
+    '''Пополняет баланс покупателей и открывает дроп; возвращает его id.'''
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT u.id, COALESCE(b.balance, 0)
+                FROM users u LEFT JOIN account_balances b ON b.user_id = u.id
+                WHERE u.id <= %s ORDER BY u.id
+            ''', (buyers,))
+            ledger.post(cur, [(user_id, FUNDS - balance, 'bench', 'drops bench funding')
+                              for user_id, balance in cur.fetchall() if balance < FUNDS])
+            closes_at = datetime.now() + timedelta(days=1) if mode == 'lottery' else None
+            drop_id = drops.create(cur, gift_id, supply, mode, max_per_user=quantity, closes_at=closes_at)
+        conn.commit()
+    return drop_id
+
+
+def rush(drop_id: int, buyers: int, quantity: int, concurrency: int) -> Dict[str, Any]:
+    barrier = threading.Barrier(concurrency)
+    latencies: List[float] = []
+    outcomes: Counter = Counter()
+    lock = threading.Lock()
+
+    def worker(shard: int) -> None:
+        local: List[float] = []
+        local_outcomes: Counter = Counter()
+        barrier.wait()
+        for user_id in range(shard + 1, buyers + 1, concurrency):
+            started = time.perf_counter()
+            with db.connection() as conn:
+                try:
+                    with conn.cursor() as cur:
+                        drop = drops.get(cur, drop_id)
+                        if drop['mode'] == 'fcfs':
+                            drops.purchase(cur, drop, user_id, quantity)
+                        else:
+                            drops.enter(cur, drop, user_id, quantity)
+                    conn.commit()
+                    if drop['mode'] == 'queue':
+                        drops.allocate(conn, drop_id)
+                    local_outcomes['accepted'] += 1
+                except drops.SoldOut:
+                    conn.rollback()
+                    local_outcomes['sold_out'] += 1
+                except (drops.DropError, ledger.LedgerError):
+                    conn.rollback()
+                    local_outcomes['rejected'] += 1
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+            outcomes.update(local_outcomes)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': buyers, **outcomes, 'seconds': round(wall, 3),
+        'requests_per_second': round(buyers / wall, 1) if wall else 0,
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else 0,
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 2) if latencies else 0
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark a limited gift drop under a buyer rush')
+    parser.add_argument('--dsn', required=True, help='database prepared by bench/harness.py --reset')
+    parser.add_argument('--gift-id', type=int, default=1)
+    parser.add_argument('--buyers', type=int, default=10000)
+    parser.add_argument('--supply', type=int, default=1000)
+    parser.add_argument('--quantity', type=int, default=1, help='gifts requested per buyer')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--mode', choices=drops.MODES, default='fcfs')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['DB_POOL_MAX_SIZE'] = str(args.concurrency)
+
+    drop_id = prepare(args.gift_id, args.buyers, args.supply, args.mode, args.quantity)
+    report: Dict[str, Any] = {'mode': args.mode, 'drop_id': drop_id, 'supply': args.supply}
+    report['rush'] = rush(drop_id, args.buyers, args.quantity, args.concurrency)
+
+    with db.connection() as conn:
+        started = time.perf_counter()
+        if args.mode == 'lottery':
+            with conn.cursor() as cur:
+                cur.execute('UPDATE gift_drops SET closes_at = CURRENT_TIMESTAMP WHERE id = %s', (drop_id,))
+            conn.commit()
+        allocated = drops.allocate(conn, drop_id, max_batches=10 ** 6)
+        wall = time.perf_counter() - started
+        report['allocation'] = {**allocated, 'seconds': round(wall, 3)}
+
+        with conn.cursor() as cur:
+            cur.execute('SELECT remaining, status FROM gift_drops WHERE id = %s', (drop_id,))
+            remaining, status = cur.fetchone()
+            cur.execute('''
+                SELECT COUNT(*) FROM gift_history h
+                JOIN user_gifts ug ON ug.id = h.gift_instance_id
+                WHERE h.transaction_type = 'drop_purchase' AND ug.gift_id = %s AND h.created_at >= (
+                    SELECT created_at FROM gift_drops WHERE id = %s)
+            ''', (args.gift_id, drop_id))
+            minted = cur.fetchone()[0]
+            cur.execute('SELECT status, COUNT(*) FROM drop_intents WHERE drop_id = %s GROUP BY status', (drop_id,))
+            report['intents'] = dict(cur.fetchall())
+        conn.commit()
+
+    report['result'] = {'remaining': remaining, 'status': status, 'minted': minted,
+                        'oversold': minted > args.supply or minted != args.supply - remaining}
+    print(json.dumps(report, indent=2, default=str))
+    if report['result']['oversold']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
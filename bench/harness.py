@@ -0,0 +1,428 @@
+'''
+Нагрузочный стенд для функций backend/.
+Импортирует handler() каждой функции напрямую, поднимает схему во
+временной базе из db_migrations/, наполняет её синтетическими данными,
+прогоняет tests.json и взвешенную смешанную нагрузку из scenarios.json
+и печатает p50/p95/p99, пропускную способность, число запросов к БД на
+вызов и прочитанные строки. Отчёт можно сохранить как baseline и
+сравнивать с ним последующие прогоны.
+
+Пример:
+    python bench/harness.py --dsn postgresql://localhost/zvezdy_bench --reset --users 100000 \\
+        --concurrency 16 --requests 20000 --save-baseline bench/baseline.json
+    python bench/harness.py --dsn postgresql://localhost/zvezdy_bench --baseline bench/baseline.json
+'''
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import psycopg2
+import psycopg2.extensions
+
+import telegram_stub
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+MIGRATIONS = ROOT / 'db_migrations'
+SCENARIOS = Path(__file__).resolve().parent / 'scenarios.json'
+
+FUNCTIONS = ('auth', 'tasks', 'marketplace', 'exchange', 'admin')
+
+_local = threading.local()
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    '''Соединение, считающее execute() всех своих курсоров в текущем потоке.'''
+
+    _cursor_classes: Dict[type, type] = {}
+
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        counting = self._cursor_classes.get(factory)
+        if counting is None:
+            def execute(cur: Any, query: Any, vars: Any = None) -> Any:
+                _local.queries = getattr(_local, 'queries', 0) + 1
+                return factory.execute(cur, query, vars)
+            counting = type('Counting' + factory.__name__, (factory,), {'execute': execute})
+            self._cursor_classes[factory] = counting
+        kwargs['cursor_factory'] = counting
+        return super().cursor(*args, **kwargs)
+
+
+def install_query_counter() -> None:
+    connect = psycopg2.connect
+
+    def counting_connect(dsn: Optional[str] = None, **kwargs: Any) -> Any:
+        kwargs.setdefault('connection_factory', CountingConnection)
+        return connect(dsn, **kwargs)
+
+    psycopg2.connect = counting_connect
+
+
+def load_handlers() -> Dict[str, Callable[[Dict[str, Any], Any], Dict[str, Any]]]:
+    '''Загружает index.handler каждой функции с её собственными модулями (db, кэши и т.д.).'''
+    handlers = {}
+    for name in FUNCTIONS:
+        directory = BACKEND / name
+        local_modules = [p.stem for p in directory.glob('*.py') if p.stem != 'index']
+        for module in local_modules:
+            sys.modules.pop(module, None)
+        sys.path.insert(0, str(directory))
+        try:
+            spec = importlib.util.spec_from_file_location(f'bench_{name}_index', directory / 'index.py')
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            handlers[name] = module.handler
+        finally:
+            sys.path.remove(str(directory))
+            for local in local_modules:
+                sys.modules.pop(local, None)
+    return handlers
+
+
+def reset_database(dsn: str, force: bool) -> None:
+    dbname = psycopg2.extensions.parse_dsn(dsn).get('dbname', '')
+    if not force and not dbname.endswith('_bench'):
+        raise SystemExit(f'Refusing to reset database {dbname!r}: name must end with _bench (or pass --force)')
+
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('DROP SCHEMA public CASCADE')
+        cur.execute('CREATE SCHEMA public')
+        for migration in sorted(MIGRATIONS.glob('V*.sql'), key=lambda p: int(p.name[1:].split('__')[0])):
+            cur.execute(migration.read_text(encoding='utf-8'))
+    conn.close()
+
+
+SEED_SQL = [
+    '''
+    INSERT INTO users (username, telegram_id, email, created_at, last_login)
+    SELECT 'bench_user_' || i, (100000 + i)::text, 'user' || i || '@bench.local',
+           now() - random() * interval '365 days', now() - random() * interval '30 days'
+    FROM generate_series(1, %(users)s) i
+    ''',
+    "UPDATE user_balances SET balance = (random() * 100000)::bigint",
+    "UPDATE users SET is_admin = TRUE WHERE id = 1",
+    '''
+    INSERT INTO user_gifts (gift_id, owner_id, purchase_price, is_on_sale, sale_price, purchased_at)
+    SELECT g.id, 1 + (random() * (%(users)s - 1))::int, g.base_price,
+           i %% 10 = 0, CASE WHEN i %% 10 = 0 THEN (g.base_price * (0.8 + random()))::int END,
+           now() - random() * interval '180 days'
+    FROM generate_series(1, %(gifts)s) i
+    JOIN gifts g ON g.id = 1 + i %% (SELECT COUNT(*) FROM gifts)
+    ''',
+    '''
+    INSERT INTO gift_history (gift_instance_id, gift_id, from_user_id, to_user_id, price, transaction_type, created_at)
+    SELECT ug.id, ug.gift_id, 1 + (random() * (%(users)s - 1))::int, ug.owner_id,
+           (ug.purchase_price * (0.8 + random()))::int, 'p2p_sale', now() - random() * interval '180 days'
+    FROM user_gifts ug
+    CROSS JOIN generate_series(1, 3) t
+    WHERE random() < 0.3
+    ''',
+    '''
+    INSERT INTO user_tasks (user_id, task_id, verified)
+    SELECT u, t.id, TRUE
+    FROM generate_series(1, %(users)s) u
+    CROSS JOIN tasks t
+    WHERE random() < 0.3
+    ''',
+    '''
+    INSERT INTO balance_transactions (user_id, amount, transaction_type, description, created_at)
+    SELECT 1 + (random() * (%(users)s - 1))::int, (random() * 2000 - 1000)::bigint,
+           'bench', 'synthetic', now() - random() * interval '365 days'
+    FROM generate_series(1, %(trades)s)
+    ''',
+    '''
+    INSERT INTO withdrawal_requests (user_id, amount, telegram_username, status, created_at)
+    SELECT 1 + (random() * (%(users)s - 1))::int, (random() * 50000)::bigint, 'bench',
+           (ARRAY['pending', 'approved', 'rejected'])[1 + (random() * 2)::int],
+           now() - random() * interval '90 days'
+    FROM generate_series(1, GREATEST(%(users)s / 50, 1))
+    ''',
+    '''
+    INSERT INTO user_stocks (user_id, company_id, shares, avg_purchase_price)
+    SELECT u, c.id, (1 + random() * 100)::int, 100
+    FROM generate_series(1, %(users)s) u
+    CROSS JOIN companies c
+    WHERE random() < 0.2
+    ''',
+    '''
+    INSERT INTO stock_transactions (user_id, company_id, transaction_type, shares, price_per_share, total_amount, created_at)
+    SELECT 1 + (random() * (%(users)s - 1))::int, c.id, 'buy', 10, 100, 1000,
+           now() - random() * interval '30 days'
+    FROM generate_series(1, GREATEST(%(trades)s / 10, 1)) i
+    JOIN companies c ON c.id = 1 + i %% (SELECT COUNT(*) FROM companies)
+    ''',
+    '''
+    INSERT INTO stock_price_history (company_id, price, recorded_at)
+    SELECT c.id, 100 + 10 * sin(i / 60.0) + random(), now() - (i || ' minutes')::interval
+    FROM companies c
+    CROSS JOIN generate_series(1, %(ticks)s) i
+    '''
+]
+
+
+def seed(dsn: str, scale: Dict[str, int]) -> None:
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cur:
+        for statement in SEED_SQL:
+            started = time.monotonic()
+            cur.execute(statement, scale)
+            conn.commit()
+            print(f'  seeded {cur.rowcount} rows in {time.monotonic() - started:.1f}s: {" ".join(statement.split()[:3])}')
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute('ANALYZE')
+    conn.close()
+
+
+def build_event(method: str, path: str = '/', query: Optional[Dict[str, Any]] = None,
+                body: Optional[Any] = None, headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    params = dict(parse_qsl(urlsplit(path).query))
+    params.update({k: str(v) for k, v in (query or {}).items()})
+    return {
+        'httpMethod': method,
+        'queryStringParameters': params,
+        'headers': headers or {},
+        'body': json.dumps(body) if body is not None else '{}'
+    }
+
+
+def matches(expected: Any, actual: Any) -> bool:
+    types = {'array': list, 'object': dict, 'string': str, 'number': (int, float), 'boolean': bool}
+    if isinstance(expected, str) and expected in types:
+        return isinstance(actual, types[expected])
+    if isinstance(expected, dict):
+        return isinstance(actual, dict) and all(k in actual and matches(v, actual[k]) for k, v in expected.items())
+    return expected == actual
+
+
+def call(handler: Callable[..., Dict[str, Any]], event: Dict[str, Any]) -> Tuple[float, int, Optional[Dict[str, Any]]]:
+    _local.queries = 0
+    started = time.perf_counter()
+    try:
+        response = handler(event, None)
+    except Exception as e:
+        response = {'statusCode': 599, 'body': json.dumps({'error': repr(e)})}
+    return (time.perf_counter() - started) * 1000, _local.queries, response
+
+
+def rows_scanned(dsn: str) -> int:
+    time.sleep(0.6)
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cur:
+        cur.execute('SELECT COALESCE(SUM(seq_tup_read + COALESCE(idx_tup_fetch, 0)), 0) FROM pg_stat_user_tables')
+        value = int(cur.fetchone()[0])
+    conn.close()
+    return value
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: List[float], queries: List[int], errors: int) -> Dict[str, Any]:
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_queries': round(statistics.fmean(queries), 2) if queries else 0
+    }
+
+
+def replay_tests(handlers: Dict[str, Callable[..., Dict[str, Any]]], dsn: str) -> Dict[str, Any]:
+    results = {}
+    for name, handler in handlers.items():
+        spec = BACKEND / name / 'tests.json'
+        if not spec.exists():
+            continue
+        for test in json.loads(spec.read_text(encoding='utf-8'))['tests']:
+            before = rows_scanned(dsn)
+            elapsed, queries, response = call(handler, build_event(test['method'], test.get('path', '/'), body=test.get('body'),
+                                                   headers=test.get('headers')))
+            try:
+                body = json.loads(response.get('body') or 'null')
+            except ValueError:
+                body = None
+            passed = response.get('statusCode') == test['expectedStatus'] and matches(test.get('expectedBody', {}), body)
+            results[f"{name}: {test['name']}"] = {
+                'passed': passed,
+                'status': response.get('statusCode'),
+                'ms': round(elapsed, 3),
+                'queries': queries,
+                'rows_scanned': rows_scanned(dsn) - before
+            }
+    return results
+
+
+def fill(template: Any, scale: Dict[str, int], rng: random.Random) -> Any:
+    if isinstance(template, dict):
+        return {k: fill(v, scale, rng) for k, v in template.items()}
+    if isinstance(template, list):
+        return [fill(v, scale, rng) for v in template]
+    if isinstance(template, str) and template.startswith('{') and template.endswith('}'):
+        kind = template[1:-1]
+        if kind == 'user_id':
+            return rng.randint(1, scale['users'])
+        if kind == 'user_gift_id':
+            return rng.randint(1, scale['gifts'])
+        if kind == 'gift_id':
+            return rng.randint(1, 15)
+        if kind == 'company_id':
+            return rng.randint(1, 6)
+        if kind == 'order_side':
+            return rng.choice(['buy', 'sell'])
+        if kind == 'order_price':
+            return round(rng.uniform(95, 105), 2)
+        if kind == 'nonce':
+            return f'{rng.getrandbits(48):012x}'
+    return template
+
+
+def run_workload(handlers: Dict[str, Callable[..., Dict[str, Any]]], scenarios: List[Dict[str, Any]],
+                 scale: Dict[str, int], concurrency: int, total: int, dsn: str) -> Dict[str, Any]:
+    weights = [s['weight'] for s in scenarios]
+    samples: Dict[str, Tuple[List[float], List[int], List[int]]] = {s['name']: ([], [], [0]) for s in scenarios}
+    lock = threading.Lock()
+    remaining = [total]
+
+    def worker(seed_value: int) -> None:
+        rng = random.Random(seed_value)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            scenario = rng.choices(scenarios, weights)[0]
+            event = build_event(
+                scenario['method'],
+                query=fill(scenario.get('query'), scale, rng),
+                body=fill(scenario.get('body'), scale, rng),
+                headers=fill(scenario.get('headers'), scale, rng)
+            )
+            elapsed, queries, response = call(handlers[scenario['function']], event)
+            latencies, query_counts, errors = samples[scenario['name']]
+            with lock:
+                latencies.append(elapsed)
+                query_counts.append(queries)
+                if response.get('statusCode', 500) >= 500:
+                    errors[0] += 1
+
+    before = rows_scanned(dsn)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+    scanned = rows_scanned(dsn) - before
+
+    all_latencies = [v for latencies, _, _ in samples.values() for v in latencies]
+    all_queries = [v for _, queries, _ in samples.values() for v in queries]
+    return {
+        'total': {
+            **summarize(all_latencies, all_queries, sum(e[0] for _, _, e in samples.values())),
+            'throughput_rps': round(len(all_latencies) / wall, 1) if wall else 0,
+            'rows_scanned_per_request': round(scanned / max(len(all_latencies), 1), 1)
+        },
+        'scenarios': {name: summarize(l, q, e[0]) for name, (l, q, e) in samples.items()}
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    current = {**report['workload']['scenarios'], 'total': report['workload']['total']}
+    previous = {**baseline['workload']['scenarios'], 'total': baseline['workload']['total']}
+    for name, stats in current.items():
+        base = previous.get(name)
+        if not base:
+            continue
+        for metric in ('p95_ms', 'p99_ms', 'mean_queries'):
+            if base.get(metric) and stats[metric] > base[metric] * (1 + threshold):
+                regressions.append(f'{name}.{metric}: {base[metric]} -> {stats[metric]}')
+        if 'throughput_rps' in base and stats.get('throughput_rps', 0) < base['throughput_rps'] * (1 - threshold):
+            regressions.append(f"{name}.throughput_rps: {base['throughput_rps']} -> {stats['throughput_rps']}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark backend handlers against a disposable database')
+    parser.add_argument('--dsn', required=True, help='disposable database, name must end with _bench')
+    parser.add_argument('--reset', action='store_true', help='recreate schema from db_migrations and seed it')
+    parser.add_argument('--force', action='store_true', help='allow --reset on a database not named *_bench')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--gifts', type=int, help='user_gifts rows (default 2 x users)')
+    parser.add_argument('--trades', type=int, help='balance transactions (default 5 x users)')
+    parser.add_argument('--ticks', type=int, default=1440, help='price history rows per company')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--scenarios', default=str(SCENARIOS))
+    parser.add_argument('--skip-tests', action='store_true', help='do not replay tests.json')
+    parser.add_argument('--baseline', help='compare with a saved report and exit 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative regression')
+    parser.add_argument('--save-baseline', help='write the report to this path')
+    args = parser.parse_args()
+
+    scale = {
+        'users': args.users,
+        'gifts': args.gifts or args.users * 2,
+        'trades': args.trades or args.users * 5,
+        'ticks': args.ticks
+    }
+
+    if args.reset:
+        print(f'Resetting schema and seeding {scale}')
+        reset_database(args.dsn, args.force)
+        seed(args.dsn, scale)
+
+    stub = telegram_stub.start()
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['DB_POOL_MAX_SIZE'] = str(args.concurrency)
+    os.environ['TELEGRAM_API_URL'] = stub.url
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'bench')
+    install_query_counter()
+    handlers = load_handlers()
+
+    report: Dict[str, Any] = {'scale': scale, 'concurrency': args.concurrency}
+    if not args.skip_tests:
+        report['tests'] = replay_tests(handlers, args.dsn)
+        for name, result in report['tests'].items():
+            mark = 'ok  ' if result['passed'] else 'FAIL'
+            print(f"{mark} {name}: {result['status']} {result['ms']} ms, "
+                  f"{result['queries']} queries, {result['rows_scanned']} rows")
+
+    scenarios = json.loads(Path(args.scenarios).read_text(encoding='utf-8'))['scenarios']
+    report['workload'] = run_workload(handlers, scenarios, scale, args.concurrency, args.requests, args.dsn)
+    stub.stop()
+
+    print(json.dumps(report['workload'], indent=2))
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text(encoding='utf-8')), args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
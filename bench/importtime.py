@@ -0,0 +1,149 @@
+'''
+Замер холодного старта функций backend/.
+Для каждой функции запускает свежий интерпретатор с -X importtime,
+импортирует index.py и вызывает handler() с OPTIONS-запросом, как первый
+вызов нового инстанса. Печатает медиану времени импорта, самые тяжёлые
+прямые зависимости index.py и тяжёлые модули (requests, psycopg2 и т.д.),
+которые загрузились уже при импорте, хотя должны подгружаться лениво.
+
+Пример:
+    python bench/importtime.py --runs 7 --save-baseline bench/importtime.json
+    python bench/importtime.py --baseline bench/importtime.json --check
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / 'backend'
+
+FUNCTIONS = ('auth', 'tasks', 'marketplace', 'exchange', 'admin')
+
+LAZY_MODULES = ('requests', 'psycopg2', 'psycopg2.extras', 'concurrent.futures', 'argparse')
+
+PROBE = '''
+import sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+index.handler({'httpMethod': 'OPTIONS'}, None)
+done = time.perf_counter()
+import json
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_call_ms': (done - imported) * 1000,
+    'eager': [m for m in %r if m in sys.modules]
+}))
+''' % (LAZY_MODULES,)
+
+
+def parse_importtime(stderr: str) -> List[Tuple[int, int, str]]:
+    '''Строки -X importtime: (self_us, cumulative_us, имя с отступом).'''
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return entries
+
+
+def index_children(entries: List[Tuple[int, int, str]]) -> Dict[str, int]:
+    '''Накопленное время прямых зависимостей index.py, в микросекундах.'''
+    children: Dict[str, int] = {}
+    for position, (_, cumulative, name) in enumerate(entries):
+        if name.strip() != 'index':
+            continue
+        depth = len(name) - len(name.lstrip())
+        for _, child_cumulative, child in reversed(entries[:position]):
+            child_depth = len(child) - len(child.lstrip())
+            if child_depth <= depth:
+                break
+            if child_depth == depth + 2:
+                children[child.strip()] = child_cumulative
+    return children
+
+
+def probe(function: str) -> Dict[str, Any]:
+    env = {**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'}
+    env.pop('DATABASE_URL', None)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE],
+        cwd=BACKEND / function, env=env, capture_output=True, text=True, check=True
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report['children'] = index_children(parse_importtime(result.stderr))
+    return report
+
+
+def measure(function: str, runs: int) -> Dict[str, Any]:
+    probe(function)
+    samples = [probe(function) for _ in range(runs)]
+    children: Dict[str, List[int]] = {}
+    for sample in samples:
+        for name, us in sample['children'].items():
+            children.setdefault(name, []).append(us)
+    heaviest = sorted(((statistics.median(v) / 1000, k) for k, v in children.items()), reverse=True)[:5]
+    return {
+        'import_ms': round(statistics.median(s['import_ms'] for s in samples), 2),
+        'first_call_ms': round(statistics.median(s['first_call_ms'] for s in samples), 2),
+        'heaviest': {name: round(ms, 2) for ms, name in heaviest},
+        'eager': samples[-1]['eager']
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float, floor_ms: float) -> List[str]:
+    regressions = []
+    for name, stats in report.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in ('import_ms', 'first_call_ms'):
+            if stats[metric] > max(base[metric] * (1 + threshold), base[metric] + floor_ms):
+                regressions.append(f'{name}.{metric}: {base[metric]} -> {stats[metric]}')
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure cold-start import time of backend functions')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per function')
+    parser.add_argument('--functions', nargs='*', default=list(FUNCTIONS))
+    parser.add_argument('--check', action='store_true', help='exit 1 if a lazy dependency is imported eagerly')
+    parser.add_argument('--baseline', help='compare with a saved report and exit 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.3, help='allowed relative regression')
+    parser.add_argument('--floor-ms', type=float, default=5.0, help='ignore regressions smaller than this')
+    parser.add_argument('--save-baseline', help='write the report to this path')
+    args = parser.parse_args()
+
+    report = {name: measure(name, args.runs) for name in args.functions}
+
+    failures = []
+    for name, stats in report.items():
+        heaviest = ', '.join(f'{module} {ms} ms' for module, ms in stats['heaviest'].items())
+        print(f"{name:<12} import {stats['import_ms']:>7} ms  first call {stats['first_call_ms']:>6} ms  [{heaviest}]")
+        if stats['eager']:
+            print(f"{'':<12} eager: {', '.join(stats['eager'])}")
+            failures.append(f"{name}: eager {', '.join(stats['eager'])}")
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(report, indent=2), encoding='utf-8')
+
+    if args.baseline:
+        regressions = compare(report, json.loads(Path(args.baseline).read_text(encoding='utf-8')),
+                              args.threshold, args.floor_ms)
+        for line in regressions:
+            print(f'REGRESSION {line}')
+        failures.extend(regressions)
+
+    if failures and (args.check or args.baseline):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
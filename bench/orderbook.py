@@ -0,0 +1,142 @@
+'''
+Нагрузочный стенд книги заявок биржи (backend/exchange/matching.py).
+Раздаёт трейдерам звёзды и акции, ставит --orders лимитных заявок вокруг
+текущей цены из --concurrency потоков и сводит очередь. В режиме queued
+постановка и сведение меряются отдельно (сведение — drain() одной
+компании). В режиме inline каждый поток после постановки сразу сводит
+очередь, как POST action=place_order. Печатает заявки/с, сделки/с и
+глубину книги после прогона.
+
+Пример (база после python bench/harness.py --reset):
+    python bench/orderbook.py --dsn postgresql://localhost/zvezdy_bench --orders 20000 --concurrency 8
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Dict
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'backend' / 'exchange'))
+
+import db  # noqa: E402
+import ledger  # noqa: E402
+import matching  # noqa: E402
+
+FUNDS = 10 ** 9
+SHARES = 10 ** 6
+
+
+def prepare(company_id: int, traders: int) -> Decimal:
+    '''Пополняет баланс и позицию трейдеров 1..traders; возвращает текущую цену компании.'''
+    with db.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT current_price FROM companies WHERE id = %s', (company_id,))
+            price = Decimal(cur.fetchone()[0])
+            cur.execute('''
+                SELECT u.id, COALESCE(b.balance, 0)
+                FROM users u LEFT JOIN account_balances b ON b.user_id = u.id
+                WHERE u.id <= %s ORDER BY u.id
+            ''', (traders,))
+            ledger.post(cur, [(user_id, FUNDS - balance, 'bench', 'orderbook bench funding')
+                              for user_id, balance in cur.fetchall() if balance < FUNDS])
+            db.execute_values(cur, '''
+                INSERT INTO user_stocks (user_id, company_id, shares, avg_purchase_price)
+                SELECT v.user_id, v.company_id, v.shares, v.price
+                FROM (VALUES %s) AS v(user_id, company_id, shares, price)
+                ON CONFLICT (user_id, company_id) DO UPDATE SET shares = EXCLUDED.shares
+            ''', [(u, company_id, SHARES, price) for u in range(1, traders + 1)],
+                template='(%s::int, %s::int, %s::int, %s::numeric)')
+        conn.commit()
+    return price
+
+
+def place_orders(company_id: int, price: Decimal, traders: int, total: int, concurrency: int,
+                 inline: bool) -> Dict[str, Any]:
+    lock = threading.Lock()
+    remaining = [total]
+    errors = [0]
+
+    def worker(seed_value: int) -> None:
+        rng = random.Random(seed_value)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            order = {
+                'user_id': rng.randint(1, traders),
+                'company_id': company_id,
+                'side': rng.choice(matching.SIDES),
+                'order_type': 'limit',
+                'shares': rng.randint(1, 20),
+                'price': (price * Decimal(rng.uniform(0.95, 1.05))).quantize(matching.CENT)
+            }
+            with db.connection() as conn:
+                try:
+                    with conn.cursor() as cur:
+                        matching.place(cur, order)
+                    conn.commit()
+                except (matching.OrderError, ledger.LedgerError):
+                    conn.rollback()
+                    with lock:
+                        errors[0] += 1
+                    continue
+                if inline:
+                    matching.drain(conn, company_id)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+    return {'orders': total, 'errors': errors[0], 'seconds': round(wall, 3),
+            'orders_per_second': round(total / wall, 1) if wall else 0}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark order placement and matching')
+    parser.add_argument('--dsn', required=True, help='database prepared by bench/harness.py --reset')
+    parser.add_argument('--company-id', type=int, default=1)
+    parser.add_argument('--traders', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mode', choices=['queued', 'inline'], default='queued')
+    args = parser.parse_args()
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['DB_POOL_MAX_SIZE'] = str(args.concurrency)
+
+    price = prepare(args.company_id, args.traders)
+    report: Dict[str, Any] = {'mode': args.mode, 'price': str(price)}
+    report['placement'] = place_orders(args.company_id, price, args.traders, args.orders,
+                                       args.concurrency, args.mode == 'inline')
+
+    started = time.perf_counter()
+    with db.connection() as conn:
+        drained = matching.drain(conn, args.company_id, max_batches=10 ** 6)
+        wall = time.perf_counter() - started
+        report['matching'] = {
+            **drained,
+            'seconds': round(wall, 3),
+            'orders_per_second': round(drained['orders'] / wall, 1) if wall and drained['orders'] else 0,
+            'trades_per_second': round(drained['trades'] / wall, 1) if wall and drained['trades'] else 0
+        }
+        with conn.cursor() as cur:
+            cur.execute("SELECT side, COUNT(*) FROM stock_orders WHERE company_id = %s AND status = 'open' GROUP BY side",
+                        (args.company_id,))
+            report['book_depth'] = dict(cur.fetchall())
+            report['top_of_book'] = matching.depth(cur, args.company_id, 5)
+        conn.commit()
+
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''
+Локальный стаб Telegram Bot API для стенда: getChatMember отвечает
+"member" для чётных user_id и "left" для нечётных, а для user_id,
+делящихся на 97, — 429 с retry_after, как настоящий API под нагрузкой.
+'''
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+        if not url.path.endswith('/getChatMember'):
+            self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+
+        try:
+            user_id = int(params.get('user_id', '0'))
+        except ValueError:
+            self._reply(400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: invalid user_id'})
+            return
+
+        if user_id % 97 == 0:
+            self._reply(429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests',
+                              'parameters': {'retry_after': 1}})
+            return
+
+        status = 'member' if user_id % 2 == 0 else 'left'
+        self._reply(200, {'ok': True, 'result': {'status': status, 'user': {'id': user_id}}})
+
+    def _reply(self, code: int, payload: dict) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class StubServer:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.server = ThreadingHTTPServer((host, port), StubHandler)
+        self.url = f'http://{host}:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def start() -> StubServer:
+    stub = StubServer()
+    stub.thread.start()
+    return stub
+
+
+if __name__ == '__main__':
+    server = StubServer(port=8081)
+    print(f'Telegram stub listening on {server.url}')
+    server.server.serve_forever()
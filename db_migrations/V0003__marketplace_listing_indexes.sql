@@ -0,0 +1,4 @@
+-- Частичные индексы для постраничной выдачи P2P маркета (keyset по sale_price, id)
+CREATE INDEX IF NOT EXISTS idx_user_gifts_on_sale_price ON user_gifts(sale_price, id) WHERE is_on_sale = TRUE;
+CREATE INDEX IF NOT EXISTS idx_user_gifts_on_sale_gift ON user_gifts(gift_id, sale_price, id) WHERE is_on_sale = TRUE;
+CREATE INDEX IF NOT EXISTS idx_user_gifts_on_sale_owner ON user_gifts(owner_id, sale_price, id) WHERE is_on_sale = TRUE;
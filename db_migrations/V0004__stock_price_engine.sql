@@ -0,0 +1,16 @@
+-- Водяные знаки движка цен: последний учтённый id по каждому фактору
+CREATE TABLE IF NOT EXISTS price_engine_state (
+    factor VARCHAR(50) PRIMARY KEY,
+    last_seen_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Дневное изменение цены вместо заглушки change_percent
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS change_percent DECIMAL(8, 2) DEFAULT 0;
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS day_open_price DECIMAL(10, 2);
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS day_open_date DATE;
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS last_tick_at TIMESTAMP;
+
+-- Событие рынка применяется к ценам один раз
+ALTER TABLE market_events ADD COLUMN IF NOT EXISTS applied_at TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_market_events_pending ON market_events(starts_at) WHERE is_active = TRUE AND applied_at IS NULL;
@@ -0,0 +1,28 @@
+-- Индекс для выборки истории цен компании по времени
+CREATE INDEX IF NOT EXISTS idx_stock_price_history_company_time ON stock_price_history(company_id, recorded_at);
+
+-- Агрегированные свечи OHLC по интервалам 1m / 1h / 1d
+CREATE TABLE IF NOT EXISTS stock_candles (
+    company_id INTEGER REFERENCES companies(id),
+    resolution VARCHAR(2) NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    open DECIMAL(10, 2) NOT NULL,
+    high DECIMAL(10, 2) NOT NULL,
+    low DECIMAL(10, 2) NOT NULL,
+    close DECIMAL(10, 2) NOT NULL,
+    volume BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (company_id, resolution, bucket_start)
+);
+
+-- Перенос уже накопленной истории в свечи
+INSERT INTO stock_candles (company_id, resolution, bucket_start, open, high, low, close, volume)
+SELECT h.company_id, r.name, date_trunc(r.unit, h.recorded_at),
+       (array_agg(h.price ORDER BY h.recorded_at ASC))[1],
+       MAX(h.price), MIN(h.price),
+       (array_agg(h.price ORDER BY h.recorded_at DESC))[1],
+       0
+FROM stock_price_history h
+CROSS JOIN (VALUES ('1m', 'minute'), ('1h', 'hour'), ('1d', 'day')) AS r(name, unit)
+WHERE h.company_id IS NOT NULL AND h.recorded_at IS NOT NULL
+GROUP BY h.company_id, r.name, date_trunc(r.unit, h.recorded_at)
+ON CONFLICT (company_id, resolution, bucket_start) DO NOTHING;
@@ -0,0 +1,91 @@
+-- Журнал операций с балансом (используется всеми функциями)
+CREATE TABLE IF NOT EXISTS balance_transactions (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    amount BIGINT NOT NULL,
+    transaction_type VARCHAR(50) NOT NULL,
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_balance_transactions_user_id ON balance_transactions(user_id);
+
+-- Счётчики дашборда. Каждая метрика разбита на шарды по backend pid,
+-- чтобы параллельные транзакции не ждали блокировку одной строки.
+CREATE TABLE IF NOT EXISTS platform_stats (
+    metric VARCHAR(50) NOT NULL,
+    shard SMALLINT NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, shard)
+);
+
+CREATE OR REPLACE FUNCTION bump_platform_stat(p_metric VARCHAR, p_delta BIGINT) RETURNS VOID AS $$
+BEGIN
+    IF p_delta = 0 THEN
+        RETURN;
+    END IF;
+    INSERT INTO platform_stats (metric, shard, value)
+    VALUES (p_metric, pg_backend_pid() % 16, p_delta)
+    ON CONFLICT (metric, shard) DO UPDATE SET value = platform_stats.value + EXCLUDED.value;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION platform_stats_users() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM bump_platform_stat('total_users', 1);
+        PERFORM bump_platform_stat('total_balance', COALESCE(NEW.balance, 0));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM bump_platform_stat('total_users', -1);
+        PERFORM bump_platform_stat('total_balance', -COALESCE(OLD.balance, 0));
+    ELSE
+        PERFORM bump_platform_stat('total_balance', COALESCE(NEW.balance, 0) - COALESCE(OLD.balance, 0));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION platform_stats_balance_transactions() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_platform_stat('total_transactions', CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION platform_stats_withdrawals() RETURNS TRIGGER AS $$
+DECLARE
+    was_pending INTEGER := 0;
+    is_pending INTEGER := 0;
+BEGIN
+    IF TG_OP <> 'INSERT' AND OLD.status = 'pending' THEN
+        was_pending := 1;
+    END IF;
+    IF TG_OP <> 'DELETE' AND NEW.status = 'pending' THEN
+        is_pending := 1;
+    END IF;
+    PERFORM bump_platform_stat('pending_withdrawals', is_pending - was_pending);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_platform_stats_users ON users;
+CREATE TRIGGER trg_platform_stats_users
+    AFTER INSERT OR DELETE OR UPDATE OF balance ON users
+    FOR EACH ROW EXECUTE FUNCTION platform_stats_users();
+
+DROP TRIGGER IF EXISTS trg_platform_stats_balance_transactions ON balance_transactions;
+CREATE TRIGGER trg_platform_stats_balance_transactions
+    AFTER INSERT OR DELETE ON balance_transactions
+    FOR EACH ROW EXECUTE FUNCTION platform_stats_balance_transactions();
+
+DROP TRIGGER IF EXISTS trg_platform_stats_withdrawals ON withdrawal_requests;
+CREATE TRIGGER trg_platform_stats_withdrawals
+    AFTER INSERT OR DELETE OR UPDATE OF status ON withdrawal_requests
+    FOR EACH ROW EXECUTE FUNCTION platform_stats_withdrawals();
+
+-- Начальные значения
+DELETE FROM platform_stats;
+INSERT INTO platform_stats (metric, shard, value)
+SELECT 'total_users', 0, COUNT(*) FROM users
+UNION ALL SELECT 'total_balance', 0, COALESCE(SUM(balance), 0) FROM users
+UNION ALL SELECT 'total_transactions', 0, COUNT(*) FROM balance_transactions
+UNION ALL SELECT 'pending_withdrawals', 0, COUNT(*) FROM withdrawal_requests WHERE status = 'pending';
@@ -0,0 +1,2 @@
+-- Очередь заданий, ожидающих пакетной проверки подписки
+CREATE INDEX IF NOT EXISTS idx_user_tasks_pending ON user_tasks(id) WHERE verified = FALSE;
@@ -0,0 +1,41 @@
+-- Версии для инвалидации кэшей в памяти функций
+CREATE TABLE IF NOT EXISTS cache_versions (
+    key VARCHAR(100) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION bump_cache_version(p_key VARCHAR) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO cache_versions (key, version) VALUES (p_key, 1)
+    ON CONFLICT (key) DO UPDATE SET version = cache_versions.version + 1;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION cache_versions_tasks() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_cache_version('tasks');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION cache_versions_user_tasks() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM bump_cache_version('user_tasks:' || OLD.user_id);
+    END IF;
+    IF TG_OP <> 'DELETE' AND (TG_OP = 'INSERT' OR NEW.user_id IS DISTINCT FROM OLD.user_id) THEN
+        PERFORM bump_cache_version('user_tasks:' || NEW.user_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_cache_versions_tasks ON tasks;
+CREATE TRIGGER trg_cache_versions_tasks
+    AFTER INSERT OR UPDATE OR DELETE ON tasks
+    FOR EACH STATEMENT EXECUTE FUNCTION cache_versions_tasks();
+
+DROP TRIGGER IF EXISTS trg_cache_versions_user_tasks ON user_tasks;
+CREATE TRIGGER trg_cache_versions_user_tasks
+    AFTER INSERT OR UPDATE OR DELETE ON user_tasks
+    FOR EACH ROW EXECUTE FUNCTION cache_versions_user_tasks();
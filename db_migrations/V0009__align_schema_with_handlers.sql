@@ -0,0 +1,20 @@
+-- Колонки и таблицы, которые используют функции, но не создавали миграции
+ALTER TABLE users ADD COLUMN IF NOT EXISTS is_admin BOOLEAN DEFAULT false;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS telegram_username VARCHAR(255);
+
+ALTER TABLE withdrawal_requests ADD COLUMN IF NOT EXISTS admin_comment TEXT;
+ALTER TABLE withdrawal_requests ADD COLUMN IF NOT EXISTS processed_by INTEGER REFERENCES users(id);
+
+-- Сделки с акциями
+CREATE TABLE IF NOT EXISTS stock_transactions (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    company_id INTEGER REFERENCES companies(id),
+    transaction_type VARCHAR(10) NOT NULL,
+    shares INTEGER NOT NULL,
+    price_per_share DECIMAL(10, 2) NOT NULL,
+    total_amount DECIMAL(14, 2) NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_stock_transactions_user_id ON stock_transactions(user_id);
+CREATE INDEX IF NOT EXISTS idx_stock_transactions_company_time ON stock_transactions(company_id, created_at);
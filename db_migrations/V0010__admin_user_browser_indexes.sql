@@ -0,0 +1,9 @@
+-- Индексы для постраничного списка пользователей в админке (keyset по ключу сортировки и id).
+-- Выражения совпадают с USER_SORTS в backend/admin/index.py
+CREATE INDEX IF NOT EXISTS idx_users_balance_id ON users ((COALESCE(balance, 0)), id);
+CREATE INDEX IF NOT EXISTS idx_users_created_at_id ON users ((COALESCE(created_at, '-infinity'::timestamp)), id);
+CREATE INDEX IF NOT EXISTS idx_users_last_login_id ON users ((COALESCE(last_login, '-infinity'::timestamp)), id);
+
+-- Поиск по префиксу username (без учёта регистра) и telegram_id: LIKE 'abc%' по btree
+CREATE INDEX IF NOT EXISTS idx_users_username_prefix ON users (lower(username) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_users_telegram_id_prefix ON users (telegram_id text_pattern_ops);
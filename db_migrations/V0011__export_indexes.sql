@@ -0,0 +1,5 @@
+-- Индексы для выгрузок и постраничного списка заявок (keyset по created_at, id)
+CREATE INDEX IF NOT EXISTS idx_withdrawal_requests_created_id ON withdrawal_requests(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_withdrawal_requests_status_created_id ON withdrawal_requests(status, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_balance_transactions_created_id ON balance_transactions(created_at, id);
+CREATE INDEX IF NOT EXISTS idx_stock_transactions_created_id ON stock_transactions(created_at, id);
@@ -0,0 +1,32 @@
+-- Журнал движений баланса: balance_transactions только дополняется,
+-- users.balance — проекция журнала (backend/*/ledger.py).
+CREATE OR REPLACE FUNCTION balance_transactions_append_only() RETURNS TRIGGER AS $$
+BEGIN
+    RAISE EXCEPTION 'balance_transactions is append-only';
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_balance_transactions_append_only ON balance_transactions;
+CREATE TRIGGER trg_balance_transactions_append_only
+    BEFORE UPDATE OR DELETE ON balance_transactions
+    FOR EACH ROW EXECUTE FUNCTION balance_transactions_append_only();
+
+-- Хвост журнала пользователя после снимка: WHERE user_id = ? AND id > ?
+CREATE INDEX IF NOT EXISTS idx_balance_transactions_user_id_id ON balance_transactions(user_id, id);
+DROP INDEX IF EXISTS idx_balance_transactions_user_id;
+
+-- Баланс пользователя на момент записи журнала ledger_id (включительно)
+CREATE TABLE IF NOT EXISTS balance_snapshots (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    ledger_id BIGINT NOT NULL,
+    balance BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, ledger_id)
+);
+CREATE INDEX IF NOT EXISTS idx_balance_snapshots_ledger_id ON balance_snapshots(ledger_id);
+
+-- Начальный снимок: текущие балансы покрывают всю историю до этого момента
+INSERT INTO balance_snapshots (user_id, ledger_id, balance)
+SELECT u.id, (SELECT COALESCE(MAX(id), 0) FROM balance_transactions), COALESCE(u.balance, 0)
+FROM users u
+ON CONFLICT (user_id, ledger_id) DO NOTHING;
@@ -0,0 +1,103 @@
+-- Баланс вынесен из широкой и часто обновляемой строки users в узкую таблицу.
+-- fillfactor 70 оставляет место на странице, а на balance нет индексов,
+-- поэтому обновления баланса — HOT (без новых записей в индексах).
+CREATE TABLE IF NOT EXISTS user_balances (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    balance BIGINT NOT NULL DEFAULT 0,
+    sharded BOOLEAN NOT NULL DEFAULT FALSE
+) WITH (fillfactor = 70);
+
+-- Режим для горячих счетов (sharded = TRUE): зачисления пишутся в одну из
+-- 16 строк-шардов по backend pid и не ждут блокировку основной строки.
+-- Баланс = user_balances.balance + SUM(delta); списания блокируют основную
+-- строку, fold_balance_shards() переносит шарды в неё.
+CREATE TABLE IF NOT EXISTS user_balance_shards (
+    user_id INTEGER NOT NULL REFERENCES user_balances(user_id) ON DELETE CASCADE,
+    shard SMALLINT NOT NULL,
+    delta BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, shard)
+) WITH (fillfactor = 70);
+
+INSERT INTO user_balances (user_id, balance)
+SELECT id, COALESCE(balance, 0) FROM users
+ON CONFLICT (user_id) DO NOTHING;
+
+CREATE OR REPLACE VIEW account_balances AS
+SELECT b.user_id, (b.balance + COALESCE(s.delta, 0))::bigint AS balance, b.sharded
+FROM user_balances b
+LEFT JOIN (
+    SELECT user_id, SUM(delta) AS delta
+    FROM user_balance_shards
+    GROUP BY user_id
+) s ON s.user_id = b.user_id;
+
+CREATE OR REPLACE FUNCTION create_user_balance() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_balances (user_id) VALUES (NEW.id) ON CONFLICT (user_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_create_user_balance ON users;
+CREATE TRIGGER trg_create_user_balance
+    AFTER INSERT ON users
+    FOR EACH ROW EXECUTE FUNCTION create_user_balance();
+
+CREATE OR REPLACE FUNCTION fold_balance_shards(p_user_id INTEGER) RETURNS BIGINT AS $$
+DECLARE
+    folded BIGINT;
+    result BIGINT;
+BEGIN
+    PERFORM 1 FROM user_balances WHERE user_id = p_user_id FOR UPDATE;
+    WITH removed AS (
+        DELETE FROM user_balance_shards WHERE user_id = p_user_id RETURNING delta
+    )
+    SELECT COALESCE(SUM(delta), 0) INTO folded FROM removed;
+    UPDATE user_balances SET balance = balance + folded
+    WHERE user_id = p_user_id
+    RETURNING balance INTO result;
+    RETURN result;
+END;
+$$ LANGUAGE plpgsql;
+
+-- total_balance теперь считается по user_balances и шардам, total_users — по users
+CREATE OR REPLACE FUNCTION platform_stats_users() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_platform_stat('total_users', CASE WHEN TG_OP = 'INSERT' THEN 1 ELSE -1 END);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION platform_stats_balances() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'user_balances' THEN
+        PERFORM bump_platform_stat('total_balance',
+            CASE WHEN TG_OP = 'DELETE' THEN 0 ELSE NEW.balance END
+            - CASE WHEN TG_OP = 'INSERT' THEN 0 ELSE OLD.balance END);
+    ELSE
+        PERFORM bump_platform_stat('total_balance',
+            CASE WHEN TG_OP = 'DELETE' THEN 0 ELSE NEW.delta END
+            - CASE WHEN TG_OP = 'INSERT' THEN 0 ELSE OLD.delta END);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_platform_stats_users ON users;
+CREATE TRIGGER trg_platform_stats_users
+    AFTER INSERT OR DELETE ON users
+    FOR EACH ROW EXECUTE FUNCTION platform_stats_users();
+
+DROP TRIGGER IF EXISTS trg_platform_stats_user_balances ON user_balances;
+CREATE TRIGGER trg_platform_stats_user_balances
+    AFTER INSERT OR DELETE OR UPDATE OF balance ON user_balances
+    FOR EACH ROW EXECUTE FUNCTION platform_stats_balances();
+
+DROP TRIGGER IF EXISTS trg_platform_stats_user_balance_shards ON user_balance_shards;
+CREATE TRIGGER trg_platform_stats_user_balance_shards
+    AFTER INSERT OR DELETE OR UPDATE OF delta ON user_balance_shards
+    FOR EACH ROW EXECUTE FUNCTION platform_stats_balances();
+
+-- Backfill выше прошёл до триггеров на user_balances, поэтому total_balance
+-- уже совпадает со старыми значениями users.balance.
+ALTER TABLE users DROP COLUMN IF EXISTS balance;
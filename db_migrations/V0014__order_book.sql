@@ -0,0 +1,45 @@
+-- Лимитные и рыночные заявки биржи. new — в очереди на сведение,
+-- open — стоит в книге (возможно, частично исполнена), filled / cancelled — закрыта.
+-- Рыночная заявка хранится с ценой-ограничителем и снимается после сведения.
+-- reserved — ещё не потраченный резерв звёзд покупателя.
+CREATE TABLE IF NOT EXISTS stock_orders (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    company_id INTEGER NOT NULL REFERENCES companies(id),
+    side VARCHAR(4) NOT NULL CHECK (side IN ('buy', 'sell')),
+    order_type VARCHAR(6) NOT NULL CHECK (order_type IN ('limit', 'market')),
+    price DECIMAL(10, 2) NOT NULL CHECK (price > 0),
+    shares INTEGER NOT NULL CHECK (shares > 0),
+    remaining INTEGER NOT NULL CHECK (remaining >= 0),
+    reserved BIGINT NOT NULL DEFAULT 0,
+    status VARCHAR(10) NOT NULL DEFAULT 'new' CHECK (status IN ('new', 'open', 'filled', 'cancelled')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Приоритет цена-время: лучшая заявка стороны — первая строка индекса,
+-- следующая страница — продолжение по (цена, id). Индексы частичные,
+-- поэтому их размер равен глубине книги, а не истории заявок.
+CREATE INDEX IF NOT EXISTS idx_stock_orders_asks
+    ON stock_orders(company_id, price, id) WHERE side = 'sell' AND status = 'open';
+CREATE INDEX IF NOT EXISTS idx_stock_orders_bids
+    ON stock_orders(company_id, (-price), id) WHERE side = 'buy' AND status = 'open';
+CREATE INDEX IF NOT EXISTS idx_stock_orders_queue
+    ON stock_orders(company_id, id) WHERE status = 'new';
+CREATE INDEX IF NOT EXISTS idx_stock_orders_user
+    ON stock_orders(user_id, id DESC);
+
+-- Сделки (принты) движка сопоставления
+CREATE TABLE IF NOT EXISTS stock_trades (
+    id BIGSERIAL PRIMARY KEY,
+    company_id INTEGER NOT NULL REFERENCES companies(id),
+    buy_order_id BIGINT NOT NULL REFERENCES stock_orders(id),
+    sell_order_id BIGINT NOT NULL REFERENCES stock_orders(id),
+    buyer_id INTEGER NOT NULL REFERENCES users(id),
+    seller_id INTEGER NOT NULL REFERENCES users(id),
+    price DECIMAL(10, 2) NOT NULL,
+    shares INTEGER NOT NULL,
+    amount BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_stock_trades_company_id ON stock_trades(company_id, id DESC);
@@ -0,0 +1,120 @@
+-- Цена оценки портфелей: меняется только тиком движка цен, поэтому сделки
+-- книги заявок (двигающие current_price) не переоценивают все портфели.
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS mark_price DECIMAL(10, 2);
+UPDATE companies SET mark_price = current_price WHERE mark_price IS NULL;
+
+-- Сводка портфеля пользователя по цене оценки: одна узкая строка на
+-- пользователя, без индексов кроме PK — частые обновления остаются HOT.
+CREATE TABLE IF NOT EXISTS portfolio_summaries (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    market_value DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    cost_basis DECIMAL(16, 2) NOT NULL DEFAULT 0,
+    positions INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) WITH (fillfactor = 80);
+
+-- Топ портфелей, пересчитывается на каждом тике из portfolio_summaries
+CREATE TABLE IF NOT EXISTS portfolio_leaderboard (
+    metric VARCHAR(10) NOT NULL,
+    rank INTEGER NOT NULL,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    market_value DECIMAL(16, 2) NOT NULL,
+    cost_basis DECIMAL(16, 2) NOT NULL,
+    PRIMARY KEY (metric, rank)
+);
+
+DROP TYPE IF EXISTS portfolio_change CASCADE;
+CREATE TYPE portfolio_change AS (
+    user_id INTEGER,
+    company_id INTEGER,
+    shares BIGINT,
+    cost NUMERIC,
+    positions INTEGER
+);
+
+-- Применяет изменения позиций одним upsert. Цены оценки читаются FOR SHARE,
+-- поэтому изменение не проскочит между чтением mark_price и переоценкой
+-- тика; строки сводок блокируются в порядке user_id.
+CREATE OR REPLACE FUNCTION apply_portfolio_changes(p_changes portfolio_change[]) RETURNS VOID AS $$
+    WITH marks AS (
+        SELECT id, COALESCE(mark_price, current_price, 0) AS mark
+        FROM companies
+        WHERE id IN (SELECT company_id FROM unnest(p_changes))
+        ORDER BY id
+        FOR SHARE
+    ),
+    deltas AS (
+        SELECT c.user_id, SUM(c.shares * m.mark) AS market_value,
+               SUM(c.cost) AS cost_basis, SUM(c.positions) AS positions
+        FROM unnest(p_changes) c
+        JOIN marks m ON m.id = c.company_id
+        WHERE c.user_id IS NOT NULL
+        GROUP BY c.user_id
+    )
+    INSERT INTO portfolio_summaries AS p (user_id, market_value, cost_basis, positions)
+    SELECT user_id, market_value, cost_basis, positions
+    FROM deltas
+    ORDER BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        market_value = p.market_value + EXCLUDED.market_value,
+        cost_basis = p.cost_basis + EXCLUDED.cost_basis,
+        positions = p.positions + EXCLUDED.positions,
+        updated_at = CURRENT_TIMESTAMP;
+$$ LANGUAGE sql;
+
+-- Триггер уровня оператора: новые строки позиций добавляются, старые вычитаются
+CREATE OR REPLACE FUNCTION portfolio_positions() RETURNS TRIGGER AS $$
+DECLARE
+    changes portfolio_change[] := '{}';
+BEGIN
+    IF TG_OP <> 'DELETE' THEN
+        SELECT changes || COALESCE(array_agg(ROW(
+            user_id, company_id, COALESCE(shares, 0),
+            COALESCE(shares, 0) * COALESCE(avg_purchase_price, 0),
+            (COALESCE(shares, 0) > 0)::int
+        )::portfolio_change), '{}')
+        INTO changes FROM new_positions;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        SELECT changes || COALESCE(array_agg(ROW(
+            user_id, company_id, -COALESCE(shares, 0),
+            -COALESCE(shares, 0) * COALESCE(avg_purchase_price, 0),
+            -(COALESCE(shares, 0) > 0)::int
+        )::portfolio_change), '{}')
+        INTO changes FROM old_positions;
+    END IF;
+    IF cardinality(changes) > 0 THEN
+        PERFORM apply_portfolio_changes(changes);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_portfolio_positions_insert ON user_stocks;
+CREATE TRIGGER trg_portfolio_positions_insert
+    AFTER INSERT ON user_stocks
+    REFERENCING NEW TABLE AS new_positions
+    FOR EACH STATEMENT EXECUTE FUNCTION portfolio_positions();
+
+DROP TRIGGER IF EXISTS trg_portfolio_positions_update ON user_stocks;
+CREATE TRIGGER trg_portfolio_positions_update
+    AFTER UPDATE ON user_stocks
+    REFERENCING OLD TABLE AS old_positions NEW TABLE AS new_positions
+    FOR EACH STATEMENT EXECUTE FUNCTION portfolio_positions();
+
+DROP TRIGGER IF EXISTS trg_portfolio_positions_delete ON user_stocks;
+CREATE TRIGGER trg_portfolio_positions_delete
+    AFTER DELETE ON user_stocks
+    REFERENCING OLD TABLE AS old_positions
+    FOR EACH STATEMENT EXECUTE FUNCTION portfolio_positions();
+
+INSERT INTO portfolio_summaries (user_id, market_value, cost_basis, positions)
+SELECT us.user_id,
+       SUM(COALESCE(us.shares, 0) * COALESCE(c.mark_price, 0)),
+       SUM(COALESCE(us.shares, 0) * COALESCE(us.avg_purchase_price, 0)),
+       COUNT(*) FILTER (WHERE us.shares > 0)
+FROM user_stocks us
+JOIN companies c ON c.id = us.company_id
+WHERE us.user_id IS NOT NULL
+GROUP BY us.user_id
+ON CONFLICT (user_id) DO NOTHING;
@@ -0,0 +1,12 @@
+-- Ключи идемпотентности денежных POST. status/response пусты, пока запрос
+-- выполняется; повтор с тем же ключом возвращает сохранённый ответ.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key VARCHAR(255) PRIMARY KEY,
+    user_id INTEGER,
+    request_hash BYTEA NOT NULL,
+    status SMALLINT,
+    response TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys(expires_at);
@@ -0,0 +1,101 @@
+-- Лента изменений для клиентов (backend/exchange/feed.py). Триггеры пишут
+-- события в транзакцию самого изменения с seq = NULL; номер seq выдаёт
+-- упорядочивающий запрос уже зафиксированным событиям, поэтому он растёт
+-- в порядке фиксации и чтение seq > since ничего не пропускает.
+CREATE SEQUENCE IF NOT EXISTS change_events_seq;
+
+CREATE TABLE IF NOT EXISTS change_events (
+    id BIGSERIAL PRIMARY KEY,
+    seq BIGINT,
+    topic VARCHAR(20) NOT NULL,
+    -- NULL — публичное событие, иначе видно только этому пользователю
+    user_id INTEGER,
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_change_events_seq ON change_events(seq) WHERE seq IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_change_events_pending ON change_events(id) WHERE seq IS NULL;
+
+-- Лоты P2P: выставлен / изменена цена / продан / снят. Событие listed несёт
+-- строку в том же виде, что и marketplace?action=list.
+CREATE OR REPLACE FUNCTION change_events_listings() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO change_events (topic, payload)
+    SELECT 'listing', jsonb_build_object(
+               'event', e.event, 'user_gift_id', n.id, 'gift_id', n.gift_id, 'sale_price', n.sale_price
+           ) || CASE WHEN e.event = 'listed' THEN jsonb_build_object('item',
+               to_jsonb(g) || jsonb_build_object(
+                   'user_gift_id', n.id, 'sale_price', n.sale_price, 'purchased_at', n.purchased_at,
+                   'seller_name', u.username, 'transaction_count', 0
+               )) ELSE '{}'::jsonb END
+    FROM new_gifts n
+    JOIN old_gifts o ON o.id = n.id
+    CROSS JOIN LATERAL (
+        SELECT CASE
+            WHEN n.is_on_sale AND NOT COALESCE(o.is_on_sale, false) THEN 'listed'
+            WHEN n.is_on_sale THEN 'repriced'
+            WHEN n.owner_id IS DISTINCT FROM o.owner_id THEN 'sold'
+            ELSE 'delisted'
+        END AS event
+    ) e
+    LEFT JOIN gifts g ON g.id = n.gift_id
+    LEFT JOIN users u ON u.id = n.owner_id
+    WHERE (COALESCE(n.is_on_sale, false) OR COALESCE(o.is_on_sale, false))
+      AND (n.is_on_sale IS DISTINCT FROM o.is_on_sale
+           OR n.sale_price IS DISTINCT FROM o.sale_price
+           OR n.owner_id IS DISTINCT FROM o.owner_id)
+    ORDER BY n.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_change_events_listings ON user_gifts;
+CREATE TRIGGER trg_change_events_listings
+    AFTER UPDATE ON user_gifts
+    REFERENCING OLD TABLE AS old_gifts NEW TABLE AS new_gifts
+    FOR EACH STATEMENT EXECUTE FUNCTION change_events_listings();
+
+-- Тик цены: сделки книги двигают current_price, тик движка — и mark_price
+CREATE OR REPLACE FUNCTION change_events_prices() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO change_events (topic, payload)
+    SELECT 'price', jsonb_build_object(
+        'company_id', n.id, 'current_price', n.current_price,
+        'mark_price', n.mark_price, 'change_percent', n.change_percent
+    )
+    FROM new_companies n
+    JOIN old_companies o ON o.id = n.id
+    WHERE n.current_price IS DISTINCT FROM o.current_price
+       OR n.mark_price IS DISTINCT FROM o.mark_price
+    ORDER BY n.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_change_events_prices ON companies;
+CREATE TRIGGER trg_change_events_prices
+    AFTER UPDATE ON companies
+    REFERENCING OLD TABLE AS old_companies NEW TABLE AS new_companies
+    FOR EACH STATEMENT EXECUTE FUNCTION change_events_prices();
+
+-- Движение баланса: одно приватное событие на пользователя за оператор.
+-- Абсолютный баланс не пишется: у шардированных счетов он складывается из
+-- шардов разных транзакций, клиент перечитывает его сам.
+CREATE OR REPLACE FUNCTION change_events_balances() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO change_events (topic, user_id, payload)
+    SELECT 'balance', user_id, jsonb_build_object('delta', SUM(amount), 'ledger_id', MAX(id))
+    FROM new_entries
+    WHERE user_id IS NOT NULL
+    GROUP BY user_id
+    ORDER BY user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_change_events_balances ON balance_transactions;
+CREATE TRIGGER trg_change_events_balances
+    AFTER INSERT ON balance_transactions
+    REFERENCING NEW TABLE AS new_entries
+    FOR EACH STATEMENT EXECUTE FUNCTION change_events_balances();
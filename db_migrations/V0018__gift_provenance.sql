@@ -0,0 +1,111 @@
+-- Провенанс экземпляров подарков. Функции писали в gift_transactions,
+-- которую миграции не создавали; история владения живёт в gift_history
+-- (по экземпляру gift_instance_id), сюда же переносятся старые сделки.
+ALTER TABLE gift_history ADD COLUMN IF NOT EXISTS gift_id INTEGER REFERENCES gifts(id);
+
+UPDATE gift_history h SET gift_id = ug.gift_id
+FROM user_gifts ug
+WHERE ug.id = h.gift_instance_id AND h.gift_id IS NULL;
+
+DO $$
+BEGIN
+    IF to_regclass('gift_transactions') IS NOT NULL THEN
+        INSERT INTO gift_history (gift_instance_id, gift_id, from_user_id, to_user_id, price, transaction_type, created_at)
+        SELECT user_gift_id, gift_id, seller_id, buyer_id, price, transaction_type, COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM gift_transactions
+        ORDER BY id;
+    END IF;
+END $$;
+
+-- Keyset-пагинация идёт по (created_at, id), NULL в ней не сравнивается
+UPDATE gift_history SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+ALTER TABLE gift_history ALTER COLUMN created_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_gift_history_instance_time ON gift_history(gift_instance_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_gift_history_gift_time ON gift_history(gift_id, created_at DESC, id DESC);
+
+-- Фактор p2p_trades движка цен теперь считает gift_history: старый
+-- водяной знак относился к id другой таблицы
+DELETE FROM price_engine_state WHERE factor = 'p2p_trades';
+
+-- Агрегаты P2P-сделок по подарку. Покупки в магазине сюда не входят,
+-- поэтому не встают в очередь за строкой популярного подарка.
+CREATE TABLE IF NOT EXISTS gift_trade_stats (
+    gift_id INTEGER PRIMARY KEY REFERENCES gifts(id) ON DELETE CASCADE,
+    trade_count INTEGER NOT NULL DEFAULT 0,
+    volume BIGINT NOT NULL DEFAULT 0,
+    last_price INTEGER,
+    min_price INTEGER,
+    max_price INTEGER,
+    last_trade_at TIMESTAMP
+) WITH (fillfactor = 80);
+
+CREATE OR REPLACE FUNCTION gift_trade_stats_apply() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO gift_trade_stats AS s (gift_id, trade_count, volume, last_price, min_price, max_price, last_trade_at)
+    SELECT gift_id, COUNT(*), SUM(price),
+           (array_agg(price ORDER BY created_at DESC, id DESC))[1],
+           MIN(price), MAX(price), MAX(created_at)
+    FROM new_history
+    WHERE transaction_type = 'p2p_sale' AND gift_id IS NOT NULL
+    GROUP BY gift_id
+    ORDER BY gift_id
+    ON CONFLICT (gift_id) DO UPDATE SET
+        trade_count = s.trade_count + EXCLUDED.trade_count,
+        volume = s.volume + EXCLUDED.volume,
+        last_price = CASE WHEN s.last_trade_at IS NULL OR EXCLUDED.last_trade_at >= s.last_trade_at
+                          THEN EXCLUDED.last_price ELSE s.last_price END,
+        min_price = LEAST(s.min_price, EXCLUDED.min_price),
+        max_price = GREATEST(s.max_price, EXCLUDED.max_price),
+        last_trade_at = GREATEST(s.last_trade_at, EXCLUDED.last_trade_at);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_gift_trade_stats ON gift_history;
+CREATE TRIGGER trg_gift_trade_stats
+    AFTER INSERT ON gift_history
+    REFERENCING NEW TABLE AS new_history
+    FOR EACH STATEMENT EXECUTE FUNCTION gift_trade_stats_apply();
+
+INSERT INTO gift_trade_stats (gift_id, trade_count, volume, last_price, min_price, max_price, last_trade_at)
+SELECT gift_id, COUNT(*), SUM(price),
+       (array_agg(price ORDER BY created_at DESC, id DESC))[1],
+       MIN(price), MAX(price), MAX(created_at)
+FROM gift_history
+WHERE transaction_type = 'p2p_sale' AND gift_id IS NOT NULL
+GROUP BY gift_id
+ON CONFLICT (gift_id) DO NOTHING;
+
+-- Событие listed ленты изменений несёт настоящее число сделок
+CREATE OR REPLACE FUNCTION change_events_listings() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO change_events (topic, payload)
+    SELECT 'listing', jsonb_build_object(
+               'event', e.event, 'user_gift_id', n.id, 'gift_id', n.gift_id, 'sale_price', n.sale_price
+           ) || CASE WHEN e.event = 'listed' THEN jsonb_build_object('item',
+               to_jsonb(g) || jsonb_build_object(
+                   'user_gift_id', n.id, 'sale_price', n.sale_price, 'purchased_at', n.purchased_at,
+                   'seller_name', u.username, 'transaction_count', COALESCE(s.trade_count, 0)
+               )) ELSE '{}'::jsonb END
+    FROM new_gifts n
+    JOIN old_gifts o ON o.id = n.id
+    CROSS JOIN LATERAL (
+        SELECT CASE
+            WHEN n.is_on_sale AND NOT COALESCE(o.is_on_sale, false) THEN 'listed'
+            WHEN n.is_on_sale THEN 'repriced'
+            WHEN n.owner_id IS DISTINCT FROM o.owner_id THEN 'sold'
+            ELSE 'delisted'
+        END AS event
+    ) e
+    LEFT JOIN gifts g ON g.id = n.gift_id
+    LEFT JOIN users u ON u.id = n.owner_id
+    LEFT JOIN gift_trade_stats s ON s.gift_id = n.gift_id
+    WHERE (COALESCE(n.is_on_sale, false) OR COALESCE(o.is_on_sale, false))
+      AND (n.is_on_sale IS DISTINCT FROM o.is_on_sale
+           OR n.sale_price IS DISTINCT FROM o.sale_price
+           OR n.owner_id IS DISTINCT FROM o.owner_id)
+    ORDER BY n.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
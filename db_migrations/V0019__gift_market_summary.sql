@@ -0,0 +1,156 @@
+-- Сводка рынка по подарку для marketplace?action=market_summary:
+-- минимальная цена и число лотов ведутся триггером на user_gifts,
+-- объём и VWAP за сутки складываются из часовых корзин P2P-сделок.
+CREATE TABLE IF NOT EXISTS gift_market_summary (
+    gift_id INTEGER PRIMARY KEY REFERENCES gifts(id) ON DELETE CASCADE,
+    floor_price INTEGER,
+    listing_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) WITH (fillfactor = 80);
+
+CREATE TABLE IF NOT EXISTS gift_trade_buckets (
+    gift_id INTEGER NOT NULL REFERENCES gifts(id) ON DELETE CASCADE,
+    bucket TIMESTAMP NOT NULL,
+    trades INTEGER NOT NULL DEFAULT 0,
+    volume BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (gift_id, bucket)
+);
+CREATE INDEX IF NOT EXISTS idx_gift_trade_buckets_bucket ON gift_trade_buckets(bucket);
+
+DROP TYPE IF EXISTS listing_change CASCADE;
+CREATE TYPE listing_change AS (
+    gift_id INTEGER,
+    listings INTEGER
+);
+
+-- Строки сводок блокируются в порядке gift_id до пересчёта минимума:
+-- следующий оператор берёт новый снимок и видит лоты всех транзакций,
+-- которые держали блокировку раньше, а более поздние пересчитают минимум сами.
+CREATE OR REPLACE FUNCTION apply_listing_changes(p_changes listing_change[]) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO gift_market_summary (gift_id)
+    SELECT DISTINCT gift_id FROM unnest(p_changes) WHERE gift_id IS NOT NULL
+    ORDER BY gift_id
+    ON CONFLICT (gift_id) DO NOTHING;
+
+    PERFORM 1 FROM gift_market_summary
+    WHERE gift_id IN (SELECT gift_id FROM unnest(p_changes))
+    ORDER BY gift_id
+    FOR UPDATE;
+
+    UPDATE gift_market_summary s
+    SET listing_count = s.listing_count + d.listings,
+        floor_price = (
+            SELECT MIN(ug.sale_price) FROM user_gifts ug
+            WHERE ug.gift_id = s.gift_id AND ug.is_on_sale = TRUE
+        ),
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT gift_id, SUM(listings) AS listings
+        FROM unnest(p_changes)
+        WHERE gift_id IS NOT NULL
+        GROUP BY gift_id
+    ) d
+    WHERE s.gift_id = d.gift_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Затрагивает только лоты: выставленные, снятые, проданные и с новой ценой
+CREATE OR REPLACE FUNCTION gift_market_listings() RETURNS TRIGGER AS $$
+DECLARE
+    changes listing_change[] := '{}';
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT COALESCE(array_agg(ROW(gift_id, 1)::listing_change), '{}')
+        INTO changes FROM new_listings WHERE is_on_sale;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT COALESCE(array_agg(ROW(gift_id, -1)::listing_change), '{}')
+        INTO changes FROM old_listings WHERE is_on_sale;
+    ELSE
+        SELECT COALESCE(array_agg(c), '{}') INTO changes
+        FROM (
+            SELECT ROW(o.gift_id, -1)::listing_change AS c
+            FROM old_listings o JOIN new_listings n ON n.id = o.id
+            WHERE COALESCE(o.is_on_sale, false) AND (
+                NOT COALESCE(n.is_on_sale, false) OR n.gift_id IS DISTINCT FROM o.gift_id
+                OR n.sale_price IS DISTINCT FROM o.sale_price)
+            UNION ALL
+            SELECT ROW(n.gift_id, 1)::listing_change
+            FROM old_listings o JOIN new_listings n ON n.id = o.id
+            WHERE COALESCE(n.is_on_sale, false) AND (
+                NOT COALESCE(o.is_on_sale, false) OR n.gift_id IS DISTINCT FROM o.gift_id
+                OR n.sale_price IS DISTINCT FROM o.sale_price)
+        ) moved;
+    END IF;
+    IF cardinality(changes) > 0 THEN
+        PERFORM apply_listing_changes(changes);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_gift_market_listings_insert ON user_gifts;
+CREATE TRIGGER trg_gift_market_listings_insert
+    AFTER INSERT ON user_gifts
+    REFERENCING NEW TABLE AS new_listings
+    FOR EACH STATEMENT EXECUTE FUNCTION gift_market_listings();
+
+DROP TRIGGER IF EXISTS trg_gift_market_listings_update ON user_gifts;
+CREATE TRIGGER trg_gift_market_listings_update
+    AFTER UPDATE ON user_gifts
+    REFERENCING OLD TABLE AS old_listings NEW TABLE AS new_listings
+    FOR EACH STATEMENT EXECUTE FUNCTION gift_market_listings();
+
+DROP TRIGGER IF EXISTS trg_gift_market_listings_delete ON user_gifts;
+CREATE TRIGGER trg_gift_market_listings_delete
+    AFTER DELETE ON user_gifts
+    REFERENCING OLD TABLE AS old_listings
+    FOR EACH STATEMENT EXECUTE FUNCTION gift_market_listings();
+
+-- P2P-сделки дополнительно раскладываются по часовым корзинам
+CREATE OR REPLACE FUNCTION gift_trade_stats_apply() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO gift_trade_stats AS s (gift_id, trade_count, volume, last_price, min_price, max_price, last_trade_at)
+    SELECT gift_id, COUNT(*), SUM(price),
+           (array_agg(price ORDER BY created_at DESC, id DESC))[1],
+           MIN(price), MAX(price), MAX(created_at)
+    FROM new_history
+    WHERE transaction_type = 'p2p_sale' AND gift_id IS NOT NULL
+    GROUP BY gift_id
+    ORDER BY gift_id
+    ON CONFLICT (gift_id) DO UPDATE SET
+        trade_count = s.trade_count + EXCLUDED.trade_count,
+        volume = s.volume + EXCLUDED.volume,
+        last_price = CASE WHEN s.last_trade_at IS NULL OR EXCLUDED.last_trade_at >= s.last_trade_at
+                          THEN EXCLUDED.last_price ELSE s.last_price END,
+        min_price = LEAST(s.min_price, EXCLUDED.min_price),
+        max_price = GREATEST(s.max_price, EXCLUDED.max_price),
+        last_trade_at = GREATEST(s.last_trade_at, EXCLUDED.last_trade_at);
+
+    INSERT INTO gift_trade_buckets AS b (gift_id, bucket, trades, volume)
+    SELECT gift_id, date_trunc('hour', created_at), COUNT(*), SUM(price)
+    FROM new_history
+    WHERE transaction_type = 'p2p_sale' AND gift_id IS NOT NULL
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (gift_id, bucket) DO UPDATE SET
+        trades = b.trades + EXCLUDED.trades,
+        volume = b.volume + EXCLUDED.volume;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO gift_market_summary (gift_id, floor_price, listing_count)
+SELECT gift_id, MIN(sale_price), COUNT(*)
+FROM user_gifts
+WHERE is_on_sale = TRUE AND gift_id IS NOT NULL
+GROUP BY gift_id
+ON CONFLICT (gift_id) DO NOTHING;
+
+INSERT INTO gift_trade_buckets (gift_id, bucket, trades, volume)
+SELECT gift_id, date_trunc('hour', created_at), COUNT(*), SUM(price)
+FROM gift_history
+WHERE transaction_type = 'p2p_sale' AND gift_id IS NOT NULL
+  AND created_at >= CURRENT_TIMESTAMP - INTERVAL '1 day'
+GROUP BY 1, 2
+ON CONFLICT (gift_id, bucket) DO NOTHING;
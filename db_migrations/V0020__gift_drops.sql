@@ -0,0 +1,50 @@
+-- Дропы подарков ограниченного тиража (backend/marketplace/drops.py).
+-- remaining — атомарный счётчик остатка: списывается одним условным
+-- UPDATE ... WHERE remaining >= n, поэтому тираж нельзя перепродать.
+-- fcfs продаёт сразу; queue и lottery принимают заявки с резервом звёзд
+-- и распределяют их пакетами за один проход.
+CREATE TABLE IF NOT EXISTS gift_drops (
+    id SERIAL PRIMARY KEY,
+    gift_id INTEGER NOT NULL REFERENCES gifts(id),
+    mode VARCHAR(10) NOT NULL DEFAULT 'fcfs' CHECK (mode IN ('fcfs', 'queue', 'lottery')),
+    price INTEGER NOT NULL CHECK (price >= 0),
+    supply INTEGER NOT NULL CHECK (supply >= 0),
+    remaining INTEGER NOT NULL CHECK (remaining >= 0),
+    max_per_user INTEGER NOT NULL DEFAULT 1 CHECK (max_per_user > 0),
+    status VARCHAR(10) NOT NULL DEFAULT 'open' CHECK (status IN ('open', 'closed', 'sold_out', 'allocated')),
+    starts_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    -- Конец приёма заявок лотереи; после него проходит розыгрыш
+    closes_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) WITH (fillfactor = 50);
+
+CREATE INDEX IF NOT EXISTS idx_gift_drops_gift_open ON gift_drops(gift_id) WHERE status = 'open';
+
+-- Заявки queue/lottery: только вставки, без общей горячей строки.
+-- Звёзды за quantity штук списываются при подаче (drop_reserve) и
+-- возвращаются за нераспределённую часть (drop_refund).
+CREATE TABLE IF NOT EXISTS drop_intents (
+    id BIGSERIAL PRIMARY KEY,
+    drop_id INTEGER NOT NULL REFERENCES gift_drops(id),
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    quantity INTEGER NOT NULL CHECK (quantity > 0),
+    allocated INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(10) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'won', 'partial', 'lost')),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    allocated_at TIMESTAMP,
+    UNIQUE (drop_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_drop_intents_pending ON drop_intents(drop_id, id) WHERE status = 'pending';
+
+-- Лимитированные подарки магазина продаются через постоянный fcfs-дроп;
+-- остаток — тираж минус уже выпущенные экземпляры.
+INSERT INTO gift_drops (gift_id, mode, price, supply, remaining, max_per_user, status)
+SELECT g.id, 'fcfs', g.base_price, g.total_supply,
+       GREATEST(g.total_supply - COUNT(ug.id), 0), g.total_supply,
+       CASE WHEN g.total_supply - COUNT(ug.id) > 0 THEN 'open' ELSE 'sold_out' END
+FROM gifts g
+LEFT JOIN user_gifts ug ON ug.gift_id = g.id
+WHERE g.is_limited AND g.total_supply IS NOT NULL
+  AND NOT EXISTS (SELECT 1 FROM gift_drops d WHERE d.gift_id = g.id)
+GROUP BY g.id;
@@ -0,0 +1,7 @@
+-- Сортировка админки по балансу (USER_SORTS в backend/admin/index.py).
+-- idx_users_balance_id ушёл вместе с users.balance, и keyset-страница
+-- сортировала всех пользователей через account_balances. Ключ — основная
+-- строка user_balances: у горячих (sharded) счетов незафиксированные шарды
+-- в порядок не входят до fold_balance_shards(). Обновления баланса перестают
+-- быть HOT, но горячие зачисления и так пишутся в шарды.
+CREATE INDEX IF NOT EXISTS idx_user_balances_balance_user ON user_balances(balance, user_id);
@@ -0,0 +1,3 @@
+-- Фактор p2p_trades движка цен читает только P2P-сделки gift_history
+-- после водяного знака; покупки в магазине и дропах индекс не раздувают.
+CREATE INDEX IF NOT EXISTS idx_gift_history_p2p_id ON gift_history(id) WHERE transaction_type = 'p2p_sale';
@@ -0,0 +1,13 @@
+-- Каталог магазина кэшируется в памяти marketplace (get_catalog) и
+-- сверяется с версией 'gifts': правка подарков видна со следующего запроса.
+CREATE OR REPLACE FUNCTION cache_versions_gifts() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM bump_cache_version('gifts');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_cache_versions_gifts ON gifts;
+CREATE TRIGGER trg_cache_versions_gifts
+    AFTER INSERT OR UPDATE OR DELETE ON gifts
+    FOR EACH STATEMENT EXECUTE FUNCTION cache_versions_gifts();
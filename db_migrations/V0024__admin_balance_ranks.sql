@@ -0,0 +1,25 @@
+-- Индекс по user_balances.balance из V0021 лишал обновления баланса HOT:
+-- каждое списание и зачисление писало и запись индекса. Сортировка админки
+-- по балансу теперь идёт по снимку user_balance_ranks (баланс с шардами),
+-- который backend/admin/balance_ranks.py обновляет периодически, а
+-- user_balances остаётся без индексов на balance.
+DROP INDEX IF EXISTS idx_user_balances_balance_user;
+
+CREATE TABLE IF NOT EXISTS user_balance_ranks (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    balance BIGINT NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_user_balance_ranks_balance_user ON user_balance_ranks(balance, user_id);
+
+-- Новый пользователь попадает в снимок сразу, с нулевым балансом
+CREATE OR REPLACE FUNCTION create_user_balance() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO user_balances (user_id) VALUES (NEW.id) ON CONFLICT (user_id) DO NOTHING;
+    INSERT INTO user_balance_ranks (user_id) VALUES (NEW.id) ON CONFLICT (user_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO user_balance_ranks (user_id, balance)
+SELECT user_id, balance FROM account_balances
+ON CONFLICT (user_id) DO NOTHING;
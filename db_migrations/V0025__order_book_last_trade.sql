@@ -0,0 +1,23 @@
+-- Принты книги заявок больше не двигают current_price: по нему исполняются
+-- мгновенные buy/sell, и сделка с самим собой или сообщником по крайней
+-- цене иначе переоценивала бы их. Последний принт хранится отдельно.
+ALTER TABLE companies ADD COLUMN IF NOT EXISTS last_trade_price DECIMAL(10, 2);
+
+-- Тик цены: тик движка двигает current_price и mark_price, сделки книги — last_trade_price
+CREATE OR REPLACE FUNCTION change_events_prices() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO change_events (topic, payload)
+    SELECT 'price', jsonb_build_object(
+        'company_id', n.id, 'current_price', n.current_price,
+        'mark_price', n.mark_price, 'change_percent', n.change_percent,
+        'last_trade_price', n.last_trade_price
+    )
+    FROM new_companies n
+    JOIN old_companies o ON o.id = n.id
+    WHERE n.current_price IS DISTINCT FROM o.current_price
+       OR n.mark_price IS DISTINCT FROM o.mark_price
+       OR n.last_trade_price IS DISTINCT FROM o.last_trade_price
+    ORDER BY n.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,16 @@
+-- Розыгрыш лотереи по md5(drop_id:id) можно было предсказать: id заявок
+-- идут подряд. Теперь порядок — md5(seed:id) по секретному seed дропа.
+-- seed_hash (sha256 от seed) публикуется при создании дропа, а seed
+-- раскрывается после розыгрыша (status = 'allocated'). Так результат можно
+-- перепроверить, и seed нельзя подменить после подачи заявок.
+ALTER TABLE gift_drops ADD COLUMN IF NOT EXISTS seed VARCHAR(64);
+ALTER TABLE gift_drops ADD COLUMN IF NOT EXISTS seed_hash VARCHAR(64);
+
+-- Ещё не разыгранные лотереи получают seed сейчас
+UPDATE gift_drops
+SET seed = replace(gen_random_uuid()::text, '-', '') || replace(gen_random_uuid()::text, '-', '')
+WHERE mode = 'lottery' AND status <> 'allocated' AND seed IS NULL;
+
+UPDATE gift_drops
+SET seed_hash = encode(sha256(convert_to(seed, 'UTF8')), 'hex')
+WHERE seed IS NOT NULL AND seed_hash IS NULL;
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState } from "react";
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
@@ -7,7 +7,8 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle } from "@/components/u
 import { Label } from "@/components/ui/label";
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer } from 'recharts';
 import Icon from "@/components/ui/icon";
-import { exchangeApi } from "@/lib/api";
+import { exchangeApi, PortfolioSummary, type ChangeEvent } from "@/lib/api";
+import { useChangeFeed } from "@/hooks/use-change-feed";
 import { toast } from "sonner";
 
 interface ExchangeProps {
@@ -18,6 +19,7 @@ interface ExchangeProps {
 export const Exchange = ({ userId, onBalanceUpdate }: ExchangeProps) => {
   const [companies, setCompanies] = useState<any[]>([]);
   const [portfolio, setPortfolio] = useState<any[]>([]);
+  const [summary, setSummary] = useState<PortfolioSummary | null>(null);
   const [selectedCompany, setSelectedCompany] = useState<any>(null);
   const [showTradeDialog, setShowTradeDialog] = useState(false);
   const [showChartDialog, setShowChartDialog] = useState(false);
@@ -26,18 +28,18 @@ export const Exchange = ({ userId, onBalanceUpdate }: ExchangeProps) => {
   const [tradeType, setTradeType] = useState<"buy" | "sell">("buy");
   const [loading, setLoading] = useState(true);
 
-  useEffect(() => {
-    loadData();
-  }, []);
+  useChangeFeed(userId, ["price"], { onReset: () => loadData(), onEvents: (events) => applyPrices(events) });
 
   const loadData = async () => {
     try {
-      const [companiesData, portfolioData] = await Promise.all([
+      const [companiesData, portfolioData, summaryData] = await Promise.all([
         exchangeApi.getCompanies(),
-        exchangeApi.getPortfolio(userId)
+        exchangeApi.getPortfolio(userId),
+        exchangeApi.getPortfolioSummary(userId)
       ]);
       setCompanies(companiesData);
       setPortfolio(portfolioData);
+      setSummary(summaryData);
     } catch (error: any) {
       toast.error(error.message || "Ошибка загрузки");
     } finally {
@@ -45,6 +47,31 @@ export const Exchange = ({ userId, onBalanceUpdate }: ExchangeProps) => {
     }
   };
 
+  // Тик цены приходит дельтой: пересчитываем позиции на месте, а сводку
+  // перечитываем (одна строка), только если сдвинулась оценка наших бумаг
+  const applyPrices = (events: ChangeEvent[]) => {
+    const prices = new Map(events.map((event) => [event.payload.company_id, event.payload]));
+    setCompanies((current) => current.map((company) => {
+      const update = prices.get(company.id);
+      return update ? { ...company, ...update, id: company.id } : company;
+    }));
+    setPortfolio((current) => current.map((item) => {
+      const update = prices.get(item.company_id);
+      if (!update) return item;
+      const price = Number(update.current_price);
+      const shares = Number(item.shares);
+      return {
+        ...item,
+        current_price: update.current_price,
+        current_value: price * shares,
+        profit: (price - Number(item.avg_purchase_price)) * shares
+      };
+    }));
+    if (portfolio.some((item) => prices.has(item.company_id))) {
+      exchangeApi.getPortfolioSummary(userId).then(setSummary).catch(() => undefined);
+    }
+  };
+
   const handleTrade = async () => {
     if (!selectedCompany || !tradeAmount) return;
 
@@ -100,8 +127,8 @@ export const Exchange = ({ userId, onBalanceUpdate }: ExchangeProps) => {
     );
   }
 
-  const totalPortfolioValue = portfolio.reduce((sum, item) => sum + (item.current_value || 0), 0);
-  const totalProfit = portfolio.reduce((sum, item) => sum + (item.profit || 0), 0);
+  const totalPortfolioValue = Number(summary?.market_value ?? 0);
+  const totalProfit = Number(summary?.unrealized_pnl ?? 0);
 
   return (
     <>
@@ -134,7 +161,7 @@ export const Exchange = ({ userId, onBalanceUpdate }: ExchangeProps) => {
           </CardHeader>
           <CardContent>
             <div className="text-3xl font-heading font-bold text-blue">
-              {portfolio.length}
+              {summary?.positions ?? portfolio.length}
             </div>
           </CardContent>
         </Card>
@@ -1,12 +1,16 @@
-import { useState, useEffect } from "react";
+import { useState } from "react";
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Badge } from "@/components/ui/badge";
 import { Dialog, DialogContent, DialogDescription, DialogHeader, DialogTitle } from "@/components/ui/dialog";
 import Icon from "@/components/ui/icon";
-import { marketplaceApi } from "@/lib/api";
+import { marketplaceApi, type ChangeEvent } from "@/lib/api";
+import { useChangeFeed } from "@/hooks/use-change-feed";
 import { toast } from "sonner";
 
+// Столько лотов отдаёт первая страница action=list; дельты ленты не растят список сверх неё
+const PAGE_SIZE = 20;
+
 interface P2PMarketProps {
   userId: number;
   onBalanceUpdate: () => void;
@@ -17,11 +21,11 @@ export const P2PMarket = ({ userId, onBalanceUpdate }: P2PMarketProps) => {
   const [selectedItem, setSelectedItem] = useState<any>(null);
   const [showHistory, setShowHistory] = useState(false);
   const [history, setHistory] = useState<any[]>([]);
+  const [historyGiftId, setHistoryGiftId] = useState<number | null>(null);
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
 
-  useEffect(() => {
-    loadItems();
-  }, []);
+  useChangeFeed(userId, ["listing"], { onReset: () => loadItems(), onEvents: (events) => applyListings(events) });
 
   const loadItems = async () => {
     try {
@@ -34,6 +38,25 @@ export const P2PMarket = ({ userId, onBalanceUpdate }: P2PMarketProps) => {
     }
   };
 
+  // Лоты приходят дельтами: listed несёт строку списка, остальные меняют или убирают её
+  const applyListings = (events: ChangeEvent[]) => {
+    setItems((current) => {
+      let next = current;
+      for (const { payload } of events) {
+        next = next.filter((item) => item.user_gift_id !== payload.user_gift_id);
+        if (payload.event === "listed") {
+          next = [...next, payload.item];
+        } else if (payload.event === "repriced") {
+          const previous = current.find((item) => item.user_gift_id === payload.user_gift_id);
+          if (previous) next = [...next, { ...previous, sale_price: payload.sale_price }];
+        }
+      }
+      return next
+        .sort((a, b) => a.sale_price - b.sale_price || a.user_gift_id - b.user_gift_id)
+        .slice(0, PAGE_SIZE);
+    });
+  };
+
   const handleBuy = async (userGiftId: number, price: number) => {
     try {
       await marketplaceApi.buyFromUser(userId, userGiftId);
@@ -48,13 +71,26 @@ export const P2PMarket = ({ userId, onBalanceUpdate }: P2PMarketProps) => {
   const handleShowHistory = async (giftId: number) => {
     try {
       const data = await marketplaceApi.getHistory(giftId);
-      setHistory(data);
+      setHistory(data.history);
+      setHistoryGiftId(giftId);
+      setHistoryCursor(data.nextCursor);
       setShowHistory(true);
     } catch (error: any) {
       toast.error(error.message || "Ошибка загрузки истории");
     }
   };
 
+  const loadMoreHistory = async () => {
+    if (historyGiftId === null || !historyCursor) return;
+    try {
+      const data = await marketplaceApi.getHistory(historyGiftId, historyCursor);
+      setHistory((current) => [...current, ...data.history]);
+      setHistoryCursor(data.nextCursor);
+    } catch (error: any) {
+      toast.error(error.message || "Ошибка загрузки истории");
+    }
+  };
+
   if (loading) {
     return (
       <div className="flex items-center justify-center py-12">
@@ -163,6 +199,11 @@ export const P2PMarket = ({ userId, onBalanceUpdate }: P2PMarketProps) => {
                 </CardContent>
               </Card>
             ))}
+            {historyCursor && (
+              <Button variant="outline" className="w-full" onClick={loadMoreHistory}>
+                Показать ещё
+              </Button>
+            )}
           </div>
         </DialogContent>
       </Dialog>
@@ -0,0 +1,76 @@
+import { useEffect, useRef } from "react"
+
+import { feedApi, type ChangeEvent, type ChangeTopic } from "@/lib/api"
+
+const RETRY_DELAY = 5000
+
+type Handlers = {
+  onEvents: (events: ChangeEvent[]) => void
+  // Полная загрузка: при подписке и когда лента потеряла позицию клиента
+  onReset: () => void
+}
+
+type Listener = {
+  topics: ChangeTopic[]
+  handlers: { current: Handlers }
+  ready: boolean
+}
+
+// Один long-poll на вкладку, сколько бы компонентов ни подписалось
+const listeners = new Set<Listener>()
+let since: number | null = null
+let running = false
+let feedUserId: number | undefined
+
+function markReady(listener: Listener) {
+  if (!listener.ready) {
+    listener.ready = true
+    listener.handlers.current.onReset()
+  }
+}
+
+async function run() {
+  running = true
+  while (listeners.size > 0) {
+    try {
+      const batch = await feedApi.getChanges(since, feedUserId, since === null ? 0 : 20)
+      const resumed = since !== null
+      since = batch.next
+      listeners.forEach((listener) => {
+        if (!listener.ready) {
+          markReady(listener)
+        } else if (resumed && batch.reset) {
+          listener.handlers.current.onReset()
+        } else {
+          const events = batch.events.filter((event) => listener.topics.includes(event.topic))
+          if (events.length > 0) listener.handlers.current.onEvents(events)
+        }
+      })
+    } catch (error) {
+      // Без ленты компоненты всё равно загружают данные, а лента догоняет после паузы
+      listeners.forEach(markReady)
+      await new Promise((resolve) => setTimeout(resolve, RETRY_DELAY))
+    }
+  }
+  running = false
+}
+
+export function useChangeFeed(userId: number | undefined, topics: ChangeTopic[], handlers: Handlers) {
+  const handlersRef = useRef(handlers)
+  handlersRef.current = handlers
+  const topicsKey = topics.join(",")
+
+  useEffect(() => {
+    const listener: Listener = { topics: topicsKey.split(",") as ChangeTopic[], handlers: handlersRef, ready: false }
+    feedUserId = userId
+    listeners.add(listener)
+    if (since !== null) {
+      // Лента уже идёт: события после загрузки применяются поверх неё
+      markReady(listener)
+    }
+    if (!running) run()
+    return () => {
+      listeners.delete(listener)
+    }
+  }, [userId, topicsKey])
+}
@@ -16,6 +16,35 @@ export interface User {
   created_at: string;
 }
 
+export interface PortfolioSummary {
+  market_value: number | string;
+  cost_basis: number | string;
+  unrealized_pnl: number | string;
+  positions: number;
+  updated_at: string | null;
+}
+
+// Каждый денежный POST получает свой ключ: повтор этого же запроса сервер не выполнит дважды
+const idempotentHeaders = () => ({
+  'Content-Type': 'application/json',
+  'Idempotency-Key': crypto.randomUUID()
+});
+
+export type ChangeTopic = 'listing' | 'price' | 'balance';
+
+export interface ChangeEvent {
+  seq: number;
+  topic: ChangeTopic;
+  user_id: number | null;
+  payload: any;
+}
+
+export interface ChangeBatch {
+  events: ChangeEvent[];
+  next: number;
+  reset: boolean;
+}
+
 export const authApi = {
   async register(username: string, email?: string, telegram_username?: string): Promise<User> {
     const response = await fetch(AUTH_URL, {
@@ -58,7 +87,7 @@ export const tasksApi = {
   async verifyTask(userId: number, taskId: number, telegramUserId?: number) {
     const response = await fetch(TASKS_URL, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: idempotentHeaders(),
       body: JSON.stringify({ action: 'verify', user_id: userId, task_id: taskId, telegram_user_id: telegramUserId })
     });
     const data = await response.json();
@@ -68,11 +97,19 @@ export const tasksApi = {
 };
 
 export const marketplaceApi = {
-  async getP2PItems() {
-    const response = await fetch(`${MARKETPLACE_URL}?action=list`);
+  async getP2PItems(filters: Record<string, string | number> = {}) {
+    const data = await marketplaceApi.getP2PPage(filters);
+    return data.items;
+  },
+
+  async getP2PPage(filters: Record<string, string | number> = {}, cursor?: string) {
+    const params = new URLSearchParams({ action: 'list' });
+    Object.entries(filters).forEach(([key, value]) => params.set(key, String(value)));
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${MARKETPLACE_URL}?${params}`);
     const data = await response.json();
     if (!response.ok) throw new Error(data.error);
-    return data.items;
+    return { items: data.items, nextCursor: data.next_cursor as string | null };
   },
 
   async getMyGifts(userId: number) {
@@ -82,28 +119,66 @@ export const marketplaceApi = {
     return data.gifts;
   },
 
-  async getHistory(giftId: number) {
-    const response = await fetch(`${MARKETPLACE_URL}?action=history&gift_id=${giftId}`);
+  async getMarketSummary(giftId?: number) {
+    const params = new URLSearchParams({ action: 'market_summary' });
+    if (giftId) params.set('gift_id', String(giftId));
+    const response = await fetch(`${MARKETPLACE_URL}?${params}`);
     const data = await response.json();
     if (!response.ok) throw new Error(data.error);
-    return data.history;
+    return data.summary;
   },
 
-  async buyFromStore(userId: number, giftId: number) {
+  async getHistory(giftId: number, cursor?: string) {
+    const params = new URLSearchParams({ action: 'history', gift_id: String(giftId) });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${MARKETPLACE_URL}?${params}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return { history: data.history, nextCursor: data.next_cursor as string | null, stats: data.stats };
+  },
+
+  async buyFromStore(userId: number, giftId: number, quantity = 1) {
     const response = await fetch(MARKETPLACE_URL, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ action: 'buy_from_store', user_id: userId, gift_id: giftId })
+      headers: idempotentHeaders(),
+      body: JSON.stringify({ action: 'buy_from_store', user_id: userId, gift_id: giftId, quantity })
     });
     const data = await response.json();
     if (!response.ok) throw new Error(data.error);
     return data;
   },
 
+  async getDrops() {
+    const response = await fetch(`${MARKETPLACE_URL}?action=drops`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data.drops;
+  },
+
+  // fcfs отвечает status=won сразу, queue — после распределения, lottery — pending до розыгрыша
+  async dropPurchase(userId: number, dropId: number, quantity = 1) {
+    const response = await fetch(MARKETPLACE_URL, {
+      method: 'POST',
+      headers: idempotentHeaders(),
+      body: JSON.stringify({ action: 'drop_purchase', user_id: userId, drop_id: dropId, quantity })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data;
+  },
+
+  async getDropEntry(userId: number, dropId: number) {
+    const params = new URLSearchParams({ action: 'drop_entry', drop_id: String(dropId), user_id: String(userId) });
+    const response = await fetch(`${MARKETPLACE_URL}?${params}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data;
+  },
+
   async buyFromUser(buyerId: number, userGiftId: number) {
     const response = await fetch(MARKETPLACE_URL, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: idempotentHeaders(),
       body: JSON.stringify({ action: 'buy_from_user', buyer_id: buyerId, user_gift_id: userGiftId })
     });
     const data = await response.json();
@@ -111,15 +186,38 @@ export const marketplaceApi = {
     return data;
   },
 
-  async listForSale(userGiftId: number, salePrice: number) {
+  async listForSale(userId: number, userGiftId: number, salePrice: number) {
     const response = await fetch(MARKETPLACE_URL, {
       method: 'PUT',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ action: 'list_for_sale', user_gift_id: userGiftId, sale_price: salePrice })
+      body: JSON.stringify({ action: 'list_for_sale', user_id: userId, user_gift_id: userGiftId, sale_price: salePrice })
     });
     const data = await response.json();
     if (!response.ok) throw new Error(data.error);
     return data;
+  },
+
+  // sale_price: null снимает лот; результат приходит по каждому user_gift_id
+  async updateListings(userId: number, items: { user_gift_id: number; sale_price: number | null }[]) {
+    const response = await fetch(MARKETPLACE_URL, {
+      method: 'PUT',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'list_for_sale', user_id: userId, items })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data.results;
+  },
+
+  async delist(userId: number, userGiftIds: number[]) {
+    const response = await fetch(MARKETPLACE_URL, {
+      method: 'PUT',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'delist', user_id: userId, user_gift_ids: userGiftIds })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data.results;
   }
 };
 
@@ -138,6 +236,20 @@ export const exchangeApi = {
     return data.portfolio;
   },
 
+  async getPortfolioSummary(userId: number): Promise<PortfolioSummary> {
+    const response = await fetch(`${EXCHANGE_URL}?action=portfolio_summary&user_id=${userId}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data.summary;
+  },
+
+  async getLeaderboard(metric: 'value' | 'pnl' = 'value', limit = 20) {
+    const response = await fetch(`${EXCHANGE_URL}?action=leaderboard&metric=${metric}&limit=${limit}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data.leaderboard;
+  },
+
   async getPriceHistory(companyId: number) {
     const response = await fetch(`${EXCHANGE_URL}?action=price_history&company_id=${companyId}`);
     const data = await response.json();
@@ -145,10 +257,20 @@ export const exchangeApi = {
     return data.history;
   },
 
+  async getCandles(companyId: number, interval: '1m' | '1h' | '1d' | 'auto' = 'auto', from?: string, to?: string) {
+    const params = new URLSearchParams({ action: 'price_history', company_id: String(companyId), interval });
+    if (from) params.set('from', from);
+    if (to) params.set('to', to);
+    const response = await fetch(`${EXCHANGE_URL}?${params}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data.candles;
+  },
+
   async buyShares(userId: number, companyId: number, shares: number) {
     const response = await fetch(EXCHANGE_URL, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: idempotentHeaders(),
       body: JSON.stringify({ action: 'buy', user_id: userId, company_id: companyId, shares })
     });
     const data = await response.json();
@@ -159,12 +281,66 @@ export const exchangeApi = {
   async sellShares(userId: number, companyId: number, shares: number) {
     const response = await fetch(EXCHANGE_URL, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: idempotentHeaders(),
       body: JSON.stringify({ action: 'sell', user_id: userId, company_id: companyId, shares })
     });
     const data = await response.json();
     if (!response.ok) throw new Error(data.error);
     return data;
+  },
+
+  async placeOrder(userId: number, companyId: number, side: 'buy' | 'sell', shares: number, price?: number) {
+    const response = await fetch(EXCHANGE_URL, {
+      method: 'POST',
+      headers: idempotentHeaders(),
+      body: JSON.stringify({
+        action: 'place_order', user_id: userId, company_id: companyId, side, shares,
+        type: price === undefined ? 'market' : 'limit', price
+      })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data.order;
+  },
+
+  async cancelOrder(userId: number, orderId: number) {
+    const response = await fetch(EXCHANGE_URL, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'cancel_order', user_id: userId, order_id: orderId })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data;
+  },
+
+  async getOrderBook(companyId: number, levels = 20) {
+    const response = await fetch(`${EXCHANGE_URL}?action=order_book&company_id=${companyId}&levels=${levels}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return { bids: data.bids, asks: data.asks };
+  },
+
+  async getOrders(userId: number, status?: string, cursor?: string) {
+    const params = new URLSearchParams({ action: 'orders', user_id: String(userId) });
+    if (status) params.set('status', status);
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${EXCHANGE_URL}?${params}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return { orders: data.orders, nextCursor: data.next_cursor as string | null };
+  }
+};
+
+export const feedApi = {
+  async getChanges(since: number | null, userId?: number, wait = 20): Promise<ChangeBatch> {
+    const params = new URLSearchParams({ action: 'changes', wait: String(wait) });
+    if (since !== null) params.set('since', String(since));
+    if (userId) params.set('user_id', String(userId));
+    const response = await fetch(`${EXCHANGE_URL}?${params}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return { events: data.events, next: data.next, reset: data.reset };
   }
 };
 
@@ -190,6 +366,39 @@ export const adminApi = {
     return data.users;
   },
 
+  async getUsersPage(adminId: number, params: Record<string, string | number> = {}, cursor?: string) {
+    const query = new URLSearchParams({ action: 'users', admin_id: String(adminId) });
+    Object.entries(params).forEach(([key, value]) => query.set(key, String(value)));
+    if (cursor) query.set('cursor', cursor);
+    const response = await fetch(`${ADMIN_URL}?${query}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return {
+      users: data.users,
+      nextCursor: data.next_cursor as string | null,
+      totalEstimate: data.total_estimate as number | undefined
+    };
+  },
+
+  async exportRows(adminId: number, table: string, params: Record<string, string> = {}, cursor?: string) {
+    const query = new URLSearchParams({ action: 'export', admin_id: String(adminId), table, ...params });
+    if (cursor) query.set('cursor', cursor);
+    const response = await fetch(`${ADMIN_URL}?${query}`);
+    if (!response.ok) throw new Error((await response.json()).error);
+    return { blob: await response.blob(), nextCursor: response.headers.get('X-Next-Cursor') };
+  },
+
+  async processWithdrawals(adminId: number, items: { withdrawal_id: number; status: 'approved' | 'rejected'; comment?: string }[]) {
+    const response = await fetch(ADMIN_URL, {
+      method: 'PUT',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ action: 'process_withdrawals', admin_id: adminId, items })
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data.results as { withdrawal_id: number; outcome: string }[];
+  },
+
   async addBalance(adminId: number, userId: number, amount: number, reason: string) {
     const response = await fetch(ADMIN_URL, {
       method: 'POST',
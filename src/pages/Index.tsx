@@ -11,12 +11,14 @@ import AuthModal from "@/components/AuthModal";
 import P2PMarket from "@/components/P2PMarket";
 import Exchange from "@/components/Exchange";
 import { getUser, clearUser, saveUser, type User, tasksApi, marketplaceApi } from "@/lib/api";
+import { useChangeFeed } from "@/hooks/use-change-feed";
 
 const Index = () => {
   const [user, setUser] = useState<User | null>(null);
   const [showAuthModal, setShowAuthModal] = useState(false);
   const [balance, setBalance] = useState(0);
   const [tasks, setTasks] = useState<any[]>([]);
+  const [marketSummary, setMarketSummary] = useState<Record<number, any>>({});
   const [gifts, setGifts] = useState([
     { id: 1, name: "Леденец", price: 100, image: "🍭", rating: 2, category: "Starter", description: "Маленький и сладкий подарок для начинающих" },
     { id: 2, name: "Шоколадка", price: 250, image: "🍫", rating: 2, category: "Starter", description: "Вкусный шоколад поднимет настроение" },
@@ -57,6 +59,7 @@ const Index = () => {
       setBalance(savedUser.balance);
       loadTasks(savedUser.id);
       loadGifts();
+      loadMarketSummary();
     } else {
       setShowAuthModal(true);
     }
@@ -92,6 +95,16 @@ const Index = () => {
     }
   };
 
+  // Минимальная цена и число лотов P2P по каждому подарку — одним запросом
+  const loadMarketSummary = async () => {
+    try {
+      const summary = await marketplaceApi.getMarketSummary();
+      setMarketSummary(Object.fromEntries(summary.map((row: any) => [row.gift_id, row])));
+    } catch (error) {
+      console.error("Error loading market summary:", error);
+    }
+  };
+
   const handleAuthSuccess = (newUser: User) => {
     setUser(newUser);
     setBalance(newUser.balance);
@@ -118,6 +131,9 @@ const Index = () => {
     }
   };
 
+  // Баланс меняют и чужие действия (продажа лота, исполнение заявки) — лента сообщает о них
+  useChangeFeed(user?.id, ["balance"], { onReset: () => handleBalanceUpdate(), onEvents: () => handleBalanceUpdate() });
+
   const handleTaskComplete = async (taskId: number, reward: number) => {
     if (!user) return;
 
@@ -346,6 +362,11 @@ const Index = () => {
                       <Icon name="Coins" className="text-gold" size={18} />
                       <span className="text-gold">{gift.price.toLocaleString()}</span>
                     </div>
+                    {marketSummary[gift.id]?.listing_count > 0 && (
+                      <div className="text-center text-xs text-muted-foreground">
+                        P2P от {Number(marketSummary[gift.id].floor_price).toLocaleString()} ⭐ · лотов: {marketSummary[gift.id].listing_count}
+                      </div>
+                    )}
                     <Button
                       onClick={() => handleBuyGift(gift.id, gift.price)}
                       className="w-full bg-blue hover:bg-blue/90 text-white font-heading transition-all duration-300"
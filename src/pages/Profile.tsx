@@ -103,7 +103,7 @@ const Profile = () => {
     if (!price) return;
 
     try {
-      await marketplaceApi.listForSale(userGiftId, parseInt(price));
+      await marketplaceApi.listForSale(user.id, userGiftId, parseInt(price));
       toast.success("Подарок выставлен на продажу!");
       loadData();
     } catch (error: any) {
@@ -111,6 +111,16 @@ const Profile = () => {
     }
   };
 
+  const handleDelist = async (userGiftId: number) => {
+    try {
+      await marketplaceApi.delist(user.id, [userGiftId]);
+      toast.success("Подарок снят с продажи");
+      loadData();
+    } catch (error: any) {
+      toast.error(error.message || "Ошибка");
+    }
+  };
+
   if (!user) return null;
 
   if (loading) {
@@ -288,6 +298,17 @@ const Profile = () => {
                           Продать
                         </Button>
                       )}
+                      {gift.is_on_sale && (
+                        <Button
+                          onClick={() => handleDelist(gift.id)}
+                          size="sm"
+                          variant="outline"
+                          className="w-full"
+                        >
+                          <Icon name="X" className="mr-2" size={14} />
+                          Снять с продажи
+                        </Button>
+                      )}
                     </CardContent>
                   </Card>
                 ))}
@@ -321,7 +342,7 @@ const Profile = () => {
                             </div>
                             <div>
                               <div className="text-muted-foreground">Средняя цена</div>
-                              <div className="font-semibold">{item.average_buy_price?.toLocaleString()} ⭐</div>
+                              <div className="font-semibold">{item.avg_purchase_price?.toLocaleString()} ⭐</div>
                             </div>
                             <div>
                               <div className="text-muted-foreground">Текущая цена</div>